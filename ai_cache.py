@@ -0,0 +1,122 @@
+"""TTL + LRU cache for AI replies to repeated prompts"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from context_builder import ACTIVITY_HEADER, MEMORY_HEADER
+from termAi.utils import preprocess_message
+
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", 600))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", 2000))
+AI_CACHE_MAX_BYTES = int(os.getenv("AI_CACHE_MAX_BYTES", 2 * 1024 * 1024))
+# Conversation turns before the new message that are part of the key. Off by
+# default: turns carry user ids and earlier replies, so a repeated greeting
+# or FAQ in a live room would never hit.
+AI_CACHE_CONTEXT_TURNS = int(os.getenv("AI_CACHE_CONTEXT_TURNS", 0))
+
+
+def _split_user(content):
+    """(user_id, text) from the 'user_id: text' form on_message gives user turns"""
+    user_id, sep, text = content.partition(': ')
+    return (user_id, text) if sep else ("", content)
+
+
+def cache_key(messages, context_turns=AI_CACHE_CONTEXT_TURNS):
+    """Key for [system..., ...history, user] or None if the prompt isn't cacheable.
+
+    Hashes the system prompts and the normalised user text, so the same
+    question hits whoever asks it. The room-activity note changes with every
+    message and is left out. When the asking user's memories are in the
+    prompt the reply is personal, so the user id joins the key. With
+    context_turns > 0 the last that many turns are hashed too.
+    """
+    if len(messages) < 2 or messages[-1].get('role') != 'user':
+        return None
+    user_id, text = _split_user(messages[-1].get('content', ''))
+    text = preprocess_message(text)
+    if not text:
+        return None
+    earlier = messages[:-1]
+    h = hashlib.sha1()
+    for msg in earlier:
+        if msg.get('role') != 'system':
+            continue
+        content = msg.get('content', '')
+        if content.startswith(ACTIVITY_HEADER):
+            continue
+        if content.startswith(MEMORY_HEADER):
+            h.update(f"user:{user_id}\0".encode())
+        h.update(f"system:{content}\0".encode())
+    h.update(b'\0')
+    if context_turns > 0:
+        turns = [msg for msg in earlier if msg.get('role') != 'system'][-context_turns:]
+        for msg in turns:
+            h.update(f"{msg.get('role')}:{msg.get('content', '')}\0".encode())
+    h.update(b'\0')
+    h.update(text.encode())
+    return h.hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe reply cache bounded by entry count and total reply bytes"""
+
+    def __init__(self, ttl=AI_CACHE_TTL, max_entries=AI_CACHE_MAX_ENTRIES,
+                 max_bytes=AI_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (expires_at, reply, size)
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.time():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, reply):
+        if key is None or not isinstance(reply, str) or not reply:
+            return
+        size = len(key) + len(reply.encode())
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.time() + self.ttl, reply, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, _, size = self.entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self.entries), 'bytes': self.bytes, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0}
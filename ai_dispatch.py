@@ -0,0 +1,85 @@
+"""Bounded worker pool that runs AI jobs off the MQTT network thread"""
+import os
+import queue
+import threading
+import time
+
+AI_WORKERS = int(os.getenv("AI_WORKERS", 4))
+AI_QUEUE_DEPTH = int(os.getenv("AI_QUEUE_DEPTH", 32))
+
+
+class AIDispatcher:
+    """Runs handler(job) on a fixed set of worker threads.
+
+    Jobs wait in a bounded queue. When the queue is full, submit() sheds the
+    job instead of blocking, so the caller (paho's network thread) always
+    returns at broker speed.
+    """
+
+    def __init__(self, handler, workers=AI_WORKERS, queue_depth=AI_QUEUE_DEPTH):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.jobs = queue.Queue(maxsize=max(1, queue_depth))
+        self.threads = []
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'shed': 0}
+
+    def start(self):
+        """Start worker threads (idempotent)"""
+        if self.threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"ai-worker-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+        print(f"[AI_POOL] {self.workers} workers started, queue depth {self.jobs.maxsize}")
+
+    def submit(self, job):
+        """Queue a job. Returns False if the queue is full and the job was shed."""
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                self.stats['shed'] += 1
+            print(f"[AI_POOL] Queue full ({self.jobs.maxsize}), shedding job")
+            return False
+        with self.lock:
+            self.stats['submitted'] += 1
+        return True
+
+    def _worker(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                return
+            with self.lock:
+                self.in_flight += 1
+            started = time.time()
+            try:
+                self.handler(job)
+                with self.lock:
+                    self.stats['completed'] += 1
+            except Exception as e:
+                with self.lock:
+                    self.stats['failed'] += 1
+                print(f"[AI_POOL] Job failed after {time.time() - started:.2f}s: {e}")
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+                self.jobs.task_done()
+
+    def stop(self, timeout=5):
+        """Ask workers to exit after draining queued jobs"""
+        for _ in self.threads:
+            self.jobs.put(None)
+        for t in self.threads:
+            t.join(timeout)
+        self.threads = []
+
+    def status(self):
+        """Snapshot of queue depth, in-flight jobs and counters"""
+        with self.lock:
+            return dict(self.stats, queued=self.jobs.qsize(), in_flight=self.in_flight,
+                        workers=self.workers, capacity=self.jobs.maxsize)
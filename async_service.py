@@ -0,0 +1,278 @@
+"""Asyncio service mode: MQTT ingest, AI jobs, HTTP and maintenance on one event loop
+
+Started with `python mqtt_service.py --async` (or SERVICE_MODE=async). The
+service module is passed in rather than imported so that running
+mqtt_service.py as __main__ doesn't load a second copy of it.
+"""
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import paho.mqtt.client as mqtt
+
+from ai_dispatch import AI_WORKERS, AI_QUEUE_DEPTH
+from mqtt_connection import MQTT_KEEPALIVE
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 15))
+HTTP_MAX_BODY = int(os.getenv("HTTP_MAX_BODY", 1024 * 1024))
+# Blocking SDK calls still need a thread each, but only this many at once;
+# everything else waits as a cheap coroutine in the job queue.
+ASYNC_AI_WORKERS = int(os.getenv("ASYNC_AI_WORKERS", max(AI_WORKERS, 16)))
+ASYNC_AI_QUEUE_DEPTH = int(os.getenv("ASYNC_AI_QUEUE_DEPTH", max(AI_QUEUE_DEPTH, 1000)))
+
+
+class AsyncAIDispatcher:
+    """Drop-in for ai_dispatch.AIDispatcher backed by an asyncio.Queue"""
+
+    def __init__(self, loop, handler, publisher, workers=ASYNC_AI_WORKERS,
+                 queue_depth=ASYNC_AI_QUEUE_DEPTH):
+        self.loop = loop
+        self.handler = handler
+        self.publisher = publisher
+        self.workers = max(1, workers)
+        self.jobs = asyncio.Queue(maxsize=max(1, queue_depth))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ai-exec")
+        self.tasks = []
+        self.in_flight = 0
+        self.stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'shed': 0}
+
+    def start(self):
+        for _ in range(self.workers):
+            self.tasks.append(self.loop.create_task(self._worker()))
+        print(f"[AI_POOL] {self.workers} async workers started, queue depth {self.jobs.maxsize}")
+
+    def submit(self, job):
+        """Called on the loop thread from on_message; never blocks"""
+        job = dict(job, client=self.publisher)
+        try:
+            self.jobs.put_nowait(job)
+        except asyncio.QueueFull:
+            self.stats['shed'] += 1
+            print(f"[AI_POOL] Queue full ({self.jobs.maxsize}), shedding job")
+            return False
+        self.stats['submitted'] += 1
+        return True
+
+    async def _worker(self):
+        while True:
+            job = await self.jobs.get()
+            self.in_flight += 1
+            started = time.time()
+            try:
+                await self.loop.run_in_executor(self.executor, self.handler, job)
+                self.stats['completed'] += 1
+            except Exception as e:
+                self.stats['failed'] += 1
+                print(f"[AI_POOL] Job failed after {time.time() - started:.2f}s: {e}")
+            finally:
+                self.in_flight -= 1
+                self.jobs.task_done()
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.executor.shutdown(wait=False)
+
+    def status(self):
+        return dict(self.stats, queued=self.jobs.qsize(), in_flight=self.in_flight,
+                    workers=self.workers, capacity=self.jobs.maxsize)
+
+
+# ==========================================
+# MQTT over the event loop (paho external-loop API)
+# ==========================================
+def attach_mqtt(loop, client):
+    """Drive paho's socket from loop readers/writers instead of a network thread"""
+    def on_socket_open(client, userdata, sock):
+        loop.add_reader(sock, client.loop_read)
+
+    def on_socket_close(client, userdata, sock):
+        loop.remove_reader(sock)
+
+    def on_socket_register_write(client, userdata, sock):
+        loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(client, userdata, sock):
+        loop.remove_writer(sock)
+
+    client.on_socket_open = on_socket_open
+    client.on_socket_close = on_socket_close
+    client.on_socket_register_write = on_socket_register_write
+    client.on_socket_unregister_write = on_socket_unregister_write
+
+
+async def mqtt_misc_loop(connection):
+    """Keepalive pings and backoff reconnects; replaces loop_forever()"""
+    while True:
+        if connection.loop_misc() != mqtt.MQTT_ERR_SUCCESS:
+            delay = connection.next_delay()
+            print(f"[MQTT] Not connected. Reconnecting in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+            try:
+                connection.reconnect()
+            except Exception as e:
+                connection.stats['failed_connects'] += 1
+                print(f"[MQTT] Reconnect failed: {e}. Will retry...")
+            continue
+        await asyncio.sleep(1)
+
+
+# ==========================================
+# HTTP (health + static files)
+# ==========================================
+def _head(status, reason, headers, keep_alive=False):
+    lines = [f"HTTP/1.1 {status} {reason}"] + [f"{name}: {value}" for name, value in headers]
+    lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+
+def _response(status, reason, content_type, body, keep_alive=False):
+    head = (f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode('latin-1') + body
+
+
+async def _run_exec(service, body):
+    """Async port of the /exec remote shell endpoint"""
+    try:
+        data = json.loads(body)
+    except Exception:
+        return 400, 'Bad Request', 'application/json', b''
+    if data.get('token') != service.admin_token:
+        return 403, 'Forbidden', 'application/json', json.dumps({'error': 'Invalid token'}).encode()
+    command = data.get('command')
+    try:
+        proc = await asyncio.create_subprocess_shell(
+            command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), 5)
+        except asyncio.TimeoutError:
+            proc.kill()
+            return 500, 'Internal Server Error', 'application/json', json.dumps({'error': 'Command timeout'}).encode()
+        print(f"[SHELL] Executed: {command}")
+        output = stdout.decode() + stderr.decode()
+        return 200, 'OK', 'application/json', json.dumps({'output': output, 'success': True}).encode()
+    except Exception as e:
+        return 500, 'Internal Server Error', 'application/json', json.dumps({'error': str(e)}).encode()
+
+
+def make_http_handler(service, loop):
+    async def handle(reader, writer):
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), HTTP_TIMEOUT)
+                if not request_line:
+                    break
+                parts = request_line.decode('latin-1').split()
+                if len(parts) < 2:
+                    writer.write(_response(400, 'Bad Request', 'text/plain', b''))
+                    break
+                method, path = parts[0], parts[1]
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), HTTP_TIMEOUT)
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                keep_alive = headers.get('connection', '').lower() == 'keep-alive'
+                # Always consume the body so the next request on this connection starts cleanly
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    length = -1
+                if length < 0 or length > HTTP_MAX_BODY:
+                    writer.write(_response(413, 'Payload Too Large', 'text/plain', b''))
+                    break
+                body = await asyncio.wait_for(reader.readexactly(length), HTTP_TIMEOUT) if length else b''
+
+                if method == 'GET' and path == '/health':
+                    resp = (200, 'OK', 'text/html', service.health_page().encode())
+                elif method in ('GET', 'HEAD'):
+                    # Preloaded assets: no disk read, no executor hop
+                    status, reason, extra, body, file_path = service.static_assets.respond(
+                        path, headers, head=method == 'HEAD')
+                    writer.write(_head(status, reason, extra, keep_alive))
+                    if file_path:
+                        with open(file_path, 'rb') as f:
+                            await loop.sendfile(writer.transport, f)
+                    else:
+                        writer.write(body)
+                    await writer.drain()
+                    if not keep_alive:
+                        break
+                    continue
+                elif method == 'POST' and path == '/exec':
+                    resp = await _run_exec(service, body)
+                else:
+                    resp = (404, 'Not Found', 'text/plain', b'')
+
+                writer.write(_response(*resp, keep_alive=keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            print(f"[HTTP] Request failed: {e}")
+        finally:
+            writer.close()
+
+    return handle
+
+
+# ==========================================
+# Maintenance
+# ==========================================
+async def maintenance_loop(service):
+    """Periodic cleanup; replaces the self-respawning threading.Timer"""
+    while True:
+        await asyncio.sleep(service.MAINTENANCE_INTERVAL)
+        try:
+            service.cleanup_inactive_users()
+        except Exception as e:
+            print(f"[CLEANUP] Maintenance failed: {e}")
+
+
+async def main(service):
+    loop = asyncio.get_running_loop()
+
+    server = await asyncio.start_server(make_http_handler(service, loop), '0.0.0.0', service.PORT)
+    print(f"[HTTP] Async server running on {service.PORT}")
+
+    connection = service.mqtt_connection
+    attach_mqtt(loop, connection.client)
+    # Every publish from executor or plugin threads is marshalled onto this loop
+    connection.bind_loop(loop)
+    # Coalescing windows close on the loop too (no flusher thread)
+    service.output.bind_loop(loop)
+
+    dispatcher = AsyncAIDispatcher(loop, service.process_ai_job, connection)
+    service.ai_dispatcher = dispatcher
+    dispatcher.start()
+
+    # Only records the broker; mqtt_misc_loop makes (and retries) the connection
+    connection.connect_async(service.MQTT_BROKER, service.MQTT_PORT, MQTT_KEEPALIVE)
+
+    try:
+        await asyncio.gather(
+            server.serve_forever(),
+            mqtt_misc_loop(connection),
+            maintenance_loop(service),
+        )
+    finally:
+        dispatcher.stop()
+        connection.disconnect()
+
+
+def run(service):
+    """Entry point used by mqtt_service.py --async"""
+    print("[ASYNC] Starting single event loop service mode")
+    try:
+        asyncio.run(main(service))
+    except Exception as e:
+        print(f"[ERROR] Async service failed: {e}")
@@ -1,5 +1,4 @@
-import openai
-import os
+from llm_providers import get_provider
 from termAi.models import SimpleChatBot
 from termAi.data_collector import ChatLogger
 
@@ -9,18 +8,17 @@ logger = ChatLogger()
 
 def get_ai_response(user_message, use_api=False):
     try:
-        if use_api and os.getenv("OPENAI_API_KEY"):
-            client = openai.OpenAI(
-                api_key=os.getenv("OPENAI_API_KEY")
-            )
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
+        # Shared pooled client; None when OPENAI_API_KEY isn't set
+        provider = get_provider("openai") if use_api else None
+        if provider:
+            response = provider.chat(
+                [
                     {"role": "system", "content": "You are TermAi, a helpful assistant in TermChat LT. Respond in Lithuanian when possible."},
                     {"role": "user", "content": user_message}
-                ]
+                ],
+                model="gpt-3.5-turbo"
             )
-            ai_response = response.choices[0].message.content
+            ai_response = response["choices"][0]["message"]["content"]
         else:
             # Use local termAi library
             ai_response = local_bot.think(user_message)
@@ -30,7 +28,7 @@ def get_ai_response(user_message, use_api=False):
         return ai_response
         
     except Exception as e:
-        # Fallback to local AI on any error
+        # Fallback to local AI on any error (including an open circuit)
         ai_response = local_bot.think(user_message)
         logger.log_interaction(user_message, ai_response)
-        return ai_response
\ No newline at end of file
+        return ai_response
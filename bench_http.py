@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+HTTP front end benchmark: old single-threaded HTTPServer vs FrontEndServer
+
+Runs both servers locally on the repo's own assets and drives them with a
+built-in load generator (no external tools needed):
+
+  throughput  - N keep-alive clients fetching / (gzip accepted)
+  slow        - S slow clients (mobile links dribbling their request and
+                reading the MQTT bundle slowly) while /health is probed;
+                measures how long health checks wait
+
+Usage: python bench_http.py [--clients 16] [--requests 200] [--slow 8]
+"""
+
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import threading
+import time
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+from http_front import CachedHealth, FrontEndServer, KeepAliveMixin
+from static_assets import StaticAssets
+
+
+def fake_health_page():
+    return "<h1>TermOS LT - God Mode Backend</h1><p>Status: ONLINE</p>"
+
+
+class QuietMixin:
+    def log_message(self, format, *args):
+        pass
+
+
+class QuietHTTPServer(HTTPServer):
+    def handle_error(self, request, client_address):
+        pass  # slow clients hang up mid-response when a run ends
+
+
+class BaselineHandler(QuietMixin, SimpleHTTPRequestHandler):
+    """What mqtt_service served before: index.html read per request, no compression"""
+
+    def do_GET(self):
+        if self.path == '/':
+            with open("index.html", "rb") as f:
+                self.send_response(200)
+                self.send_header('Content-type', 'text/html')
+                self.end_headers()
+                self.wfile.write(f.read())
+        elif self.path == '/health':
+            self.send_response(200)
+            self.send_header('Content-type', 'text/html')
+            self.end_headers()
+            self.wfile.write(fake_health_page().encode())
+        else:
+            super().do_GET()
+
+
+def make_front_handler(assets, health):
+    class FrontHandler(QuietMixin, KeepAliveMixin, SimpleHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/health':
+                body = health.get()
+                self.send_response(200)
+                self.send_header('Content-type', 'text/html')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            status, reason, headers, body, file_path = assets.respond(self.path, self.headers)
+            self.send_response(status, reason)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            if file_path:
+                self.wfile.flush()
+                with open(file_path, 'rb') as f:
+                    self.connection.sendfile(f)
+            elif body:
+                self.wfile.write(body)
+    return FrontHandler
+
+
+def start(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+
+def throughput(port, clients, requests):
+    latencies = []
+    transferred = [0]
+    errors = [0]
+    lock = threading.Lock()
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        local = []
+        size = 0
+        for _ in range(requests):
+            started = time.perf_counter()
+            try:
+                conn.request('GET', '/', headers={'Accept-Encoding': 'gzip, br'})
+                resp = conn.getresponse()
+                size += len(resp.read())
+                if resp.will_close:
+                    conn.close()
+                    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            except (OSError, http.client.HTTPException):
+                with lock:
+                    errors[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+                continue
+            local.append(time.perf_counter() - started)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            transferred[0] += size
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'req/s': round(len(latencies) / elapsed, 1),
+        'p50 ms': round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+        'p99 ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 2) if latencies else None,
+        'KB/req': round(transferred[0] / max(1, len(latencies)) / 1024, 1),
+        'errors': errors[0],
+    }
+
+
+def slow_client(port, stop):
+    """Send a request for mqtt.min.js a few bytes at a time, then read it slowly"""
+    request = b"GET /mqtt.min.js HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n"
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.settimeout(30)
+    try:
+        sock.connect(('127.0.0.1', port))
+        for i in range(0, len(request), 4):
+            if stop.is_set():
+                return
+            sock.sendall(request[i:i + 4])
+            time.sleep(0.1)
+        while not stop.is_set():
+            if not sock.recv(2048):
+                break
+            time.sleep(0.05)
+    except OSError:
+        pass
+    finally:
+        sock.close()
+
+
+def health_under_slow_clients(port, slow_clients, probes=10):
+    stop = threading.Event()
+    threads = [threading.Thread(target=slow_client, args=(port, stop), daemon=True)
+               for _ in range(slow_clients)]
+    for t in threads:
+        t.start()
+    time.sleep(0.3)
+    waits = []
+    failures = 0
+    for _ in range(probes):
+        started = time.perf_counter()
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/health')
+            resp = conn.getresponse()
+            resp.read()
+            conn.close()
+            waits.append(time.perf_counter() - started)
+        except (OSError, http.client.HTTPException):
+            failures += 1
+        time.sleep(0.1)
+    stop.set()
+    return {
+        'health p50 ms': round(statistics.median(waits) * 1000, 2) if waits else None,
+        'health max ms': round(max(waits) * 1000, 2) if waits else None,
+        'health failures (5s timeout)': failures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--slow', type=int, default=8)
+    args = parser.parse_args()
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    baseline = QuietHTTPServer(('127.0.0.1', 0), BaselineHandler)
+    assets = StaticAssets(os.getcwd())
+    health = CachedHealth(fake_health_page)
+    front = FrontEndServer(('127.0.0.1', 0), make_front_handler(assets, health), health=health)
+
+    for name, server in (("HTTPServer (old)", baseline), ("FrontEndServer", front)):
+        port = start(server)
+        print(f"\n=== {name} ===")
+        print("throughput:", throughput(port, args.clients, args.requests))
+        print(f"{args.slow} slow clients:", health_under_slow_clients(port, args.slow))
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""Clustered mode: several mqtt_service processes sharing one broker
+
+With CLUSTER=true every node subscribes to the service topics through an
+MQTT v5 shared subscription ($share/<CLUSTER_GROUP>/termchat/input, ...).
+The broker therefore delivers each message to one node of the group, not to
+all of them, and AI replies are no longer duplicated.
+
+Room state (history, AI context) lives on exactly one node: the owner of
+the room on a consistent-hash ring of the live nodes. A node that receives
+a chat message for a room it doesn't own forwards the raw payload to the
+owner's inbox topic. When a node joins or leaves, only the rooms on its
+arcs of the ring change owner.
+
+Nodes coordinate over one control topic:
+  hello / bye   membership (bye is also the connection's last will)
+  move          a user changed room, so every node routes them the same way
+  admin         admin commands and plugin uploads, applied on every node
+Members that miss heartbeats for CLUSTER_NODE_TTL seconds drop off the ring.
+
+The broker may be public, so every frame carries an HMAC-SHA256 over its
+JSON made with CLUSTER_SECRET, which all nodes share. Frames also carry a
+timestamp, and anything older than CLUSTER_FRAME_MAX_AGE is dropped, so a
+captured admin frame cannot be replayed later. The "bye" will is the
+exception, because the broker sends it long after it was signed. Instead,
+every broker connection gets a fresh session nonce, carried by that
+connection's hellos and by its will, and a bye only counts when its nonce
+matches the sender's latest hello. A replayed bye from an earlier
+connection is ignored. Forwarded messages are only accepted for the chat
+topics.
+"""
+import bisect
+import hashlib
+import hmac
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+CLUSTER_ENABLED = os.getenv("CLUSTER", "false").lower() == "true"
+CLUSTER_GROUP = os.getenv("CLUSTER_GROUP", "termai")
+CLUSTER_NODE_ID = os.getenv("CLUSTER_NODE_ID", f"{socket.gethostname()}-{os.getpid()}")
+CLUSTER_TOPIC = os.getenv("CLUSTER_TOPIC", "termchat/cluster")
+CLUSTER_VNODES = int(os.getenv("CLUSTER_VNODES", 64))
+CLUSTER_NODE_TTL = float(os.getenv("CLUSTER_NODE_TTL", 35))
+CLUSTER_MAX_HOPS = int(os.getenv("CLUSTER_MAX_HOPS", 2))
+CLUSTER_SECRET = os.getenv("CLUSTER_SECRET", "")
+CLUSTER_FRAME_MAX_AGE = float(os.getenv("CLUSTER_FRAME_MAX_AGE", 60))
+# Topics a node accepts in "forward" frames
+FORWARD_TOPICS = ("termchat/input", "termchat/messages")
+
+_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+
+def _hash(key):
+    # Stable across processes and hosts, unlike hash()
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+def shared(topic, group=CLUSTER_GROUP):
+    """Shared-subscription filter for a topic"""
+    return f"$share/{group}/{topic}"
+
+
+class HashRing:
+    """Consistent hashing with virtual nodes; owner() is a binary search"""
+
+    def __init__(self, nodes=(), vnodes=CLUSTER_VNODES):
+        self.vnodes = vnodes
+        self.points = []
+        self.owners = []
+        self.set_nodes(nodes)
+
+    def set_nodes(self, nodes):
+        ring = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(self.vnodes))
+        self.points = [point for point, _ in ring]
+        self.owners = [node for _, node in ring]
+
+    def owner(self, key):
+        if not self.points:
+            return None
+        index = bisect.bisect(self.points, _hash(key)) % len(self.points)
+        return self.owners[index]
+
+
+class ClusterNode:
+    """This process's membership, room ownership and control-topic traffic"""
+
+    def __init__(self, node_id=CLUSTER_NODE_ID, group=CLUSTER_GROUP, prefix=CLUSTER_TOPIC,
+                 ttl=CLUSTER_NODE_TTL, vnodes=CLUSTER_VNODES, on_event=None, secret=CLUSTER_SECRET,
+                 max_age=CLUSTER_FRAME_MAX_AGE, forward_topics=FORWARD_TOPICS):
+        if not secret:
+            raise ValueError("CLUSTER_SECRET must be set: control frames are signed with it")
+        self.secret = secret.encode('utf-8')
+        self.max_age = max_age
+        self.forward_topics = frozenset(forward_topics)
+        self.node_id = node_id
+        self.group = group
+        self.prefix = f"{prefix}/{group}/"
+        self.control_topic = f"{prefix}/{group}/control"
+        self.inbox_topic = f"{prefix}/{group}/node/{node_id}"
+        self.ttl = ttl
+        self.on_event = on_event
+        self.members = {node_id: time.monotonic()}
+        self.sessions = {}  # node -> session nonce from its latest hello
+        self.session = None  # nonce of the current broker connection
+        self.next_session = None  # nonce in the will armed for the next connect
+        self.connection = None
+        self.ring = HashRing([node_id], vnodes)
+        self.lock = threading.Lock()
+        self.stats = {'forwarded': 0, 'received': 0, 'events_sent': 0, 'events_applied': 0,
+                      'joins': 0, 'leaves': 0, 'rejected': 0}
+
+    # ---- topics ----
+    def subscriptions(self, topics):
+        """Shared filters for the service topics plus this node's control/inbox topics"""
+        return [shared(topic, self.group) for topic in topics] + [self.control_topic, self.inbox_topic]
+
+    def is_cluster_topic(self, topic):
+        return topic.startswith(self.prefix)
+
+    def attach(self, connection):
+        """Register 'bye' as the last will; must run before connecting"""
+        self.connection = connection
+        self._arm_will()
+
+    def _arm_will(self):
+        # The will goes out with the next CONNECT, so it names that connection's nonce
+        self.next_session = uuid.uuid4().hex
+        self.connection.will_set(self.control_topic, self._frame("bye", session=self.next_session))
+
+    def connected(self, client):
+        """Called from on_connect: adopt this connection's nonce, re-arm the will, say hello"""
+        if self.connection is not None:
+            self.session = self.next_session
+            self._arm_will()
+        self.announce(client)
+
+    def _sign(self, body):
+        return hmac.new(self.secret, body.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def _frame(self, kind, **fields):
+        body = _encoder.encode(dict(fields, type=kind, node=self.node_id, ts=time.time()))
+        return _encoder.encode({"body": body, "sig": self._sign(body)}).encode('utf-8')
+
+    def _open(self, payload):
+        """The verified frame dict inside a signed envelope, or None"""
+        try:
+            envelope = json.loads(payload)
+            body, sig = envelope["body"], envelope["sig"]
+            if not isinstance(body, str) or not isinstance(sig, str):
+                return None
+            if not hmac.compare_digest(self._sign(body), sig):
+                return None
+            frame = json.loads(body)
+            if not isinstance(frame, dict) or not isinstance(frame.get("node"), str):
+                return None
+            kind = frame["type"]
+            if kind != "bye" and abs(time.time() - float(frame["ts"])) > self.max_age:
+                return None
+        except (ValueError, KeyError, TypeError):
+            return None
+        return frame
+
+    # ---- membership ----
+    def _rebuild(self):
+        self.ring.set_nodes(sorted(self.members))
+
+    def announce(self, client):
+        client.publish(self.control_topic, self._frame("hello", session=self.session))
+
+    def heartbeat(self, client):
+        """Called from maintenance: say hello and drop members that went quiet"""
+        self.announce(client)
+        now = time.monotonic()
+        with self.lock:
+            self.members[self.node_id] = now
+            stale = [node for node, seen in self.members.items() if now - seen > self.ttl]
+            for node in stale:
+                del self.members[node]
+                self.sessions.pop(node, None)
+            if stale:
+                self.stats['leaves'] += len(stale)
+                self._rebuild()
+        if stale:
+            print(f"[CLUSTER] Expired {stale}; {len(self.members)} nodes")
+
+    # ---- ownership ----
+    def owner(self, room):
+        with self.lock:
+            return self.ring.owner(room)
+
+    def forward(self, client, node, topic, payload, hops=0):
+        """Hand a raw message to the node that owns its room"""
+        self.stats['forwarded'] += 1
+        client.publish(f"{self.prefix}node/{node}", self._frame(
+            "forward", topic=topic, payload=payload.decode('utf-8', 'replace'), hops=hops + 1))
+
+    def broadcast(self, client, kind, **fields):
+        """Publish a coordination event (move, admin) for the other nodes"""
+        self.stats['events_sent'] += 1
+        client.publish(self.control_topic, self._frame(kind, **fields))
+
+    # ---- inbound ----
+    def receive(self, client, topic, payload):
+        """Handle a message on a cluster topic.
+
+        Returns (topic, payload bytes, hops) for a message forwarded to this
+        node, which the caller then processes as if it came from the broker;
+        otherwise None.
+        """
+        frame = self._open(payload)
+        if frame is None:
+            self.stats['rejected'] += 1
+            return None
+        kind = frame["type"]
+        sender = frame["node"]
+
+        if kind == "forward":
+            try:
+                forwarded = str(frame["topic"]), str(frame["payload"]).encode('utf-8'), int(frame.get("hops", 1))
+            except (KeyError, TypeError, ValueError):
+                forwarded = None
+            if forwarded is None or forwarded[0] not in self.forward_topics:
+                # Only chat input is routed by room; anything else has no business here
+                self.stats['rejected'] += 1
+                return None
+            self.stats['received'] += 1
+            return forwarded
+        if sender == self.node_id:
+            return None
+
+        if kind == "hello":
+            with self.lock:
+                new = sender not in self.members
+                self.members[sender] = time.monotonic()
+                self.sessions[sender] = frame.get("session")
+                if new:
+                    self.stats['joins'] += 1
+                    self._rebuild()
+            if new:
+                print(f"[CLUSTER] Node {sender} joined; {len(self.members)} nodes")
+                # Let the newcomer learn about us without waiting a heartbeat
+                self.announce(client)
+        elif kind == "bye":
+            with self.lock:
+                session = frame.get("session")
+                if session is None or session != self.sessions.get(sender):
+                    # A will from an earlier connection, or a replay of one
+                    self.stats['rejected'] += 1
+                    return None
+                gone = self.members.pop(sender, None) is not None
+                if gone:
+                    del self.sessions[sender]
+                    self.stats['leaves'] += 1
+                    self._rebuild()
+            if gone:
+                print(f"[CLUSTER] Node {sender} left; {len(self.members)} nodes")
+        elif self.on_event:
+            self.stats['events_applied'] += 1
+            self.on_event(kind, frame)
+        return None
+
+    def status(self):
+        with self.lock:
+            return dict(self.stats, node=self.node_id, group=self.group, nodes=sorted(self.members))
@@ -0,0 +1,204 @@
+"""Token-budgeted prompt assembly for AI calls
+
+Prompts used to be [room prompt] + the last N history items, whatever their
+size. ContextBuilder fills a token budget instead, in priority order:
+
+1. the room prompt (always) and the user's new message (always)
+2. the user's most relevant memories from the memory bank
+3. conversation history, newest first
+4. recent room activity from the message store, if budget is left
+
+Recent room activity is fetched from the store at most once every
+CONTEXT_PREFIX_TTL seconds per room. The note is rebuilt from those docs on
+every call, so lines already in the caller's history (including the message
+being answered) are always left out. The room prompt stays first and
+byte-identical, so provider-side prompt caching still lines up. The response cache keys on the room prompt, not on the
+activity note, and adds the user to the key when their memories are in the
+prompt, so a reply built with one user's memories is never served to another.
+
+Token counts are a local estimate (no tokenizer download): words are split
+into ~4-character pieces and every punctuation mark counts as one token,
+which tracks BPE tokenizers closely enough for budgeting.
+"""
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+CONTEXT_MEMORY_LIMIT = int(os.getenv("CONTEXT_MEMORY_LIMIT", 3))
+CONTEXT_DB_MESSAGES = int(os.getenv("CONTEXT_DB_MESSAGES", 20))
+CONTEXT_ACTIVITY_TOKENS = int(os.getenv("CONTEXT_ACTIVITY_TOKENS", 300))
+CONTEXT_PREFIX_TTL = float(os.getenv("CONTEXT_PREFIX_TTL", 30))
+# Role/separator tokens the chat format adds to every message
+MESSAGE_OVERHEAD = 4
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+# Sender id the message store uses for AI replies
+ASSISTANT_ID = "TERMAI"
+# Headers of the system notes build() adds; ai_cache recognises them by these
+ACTIVITY_HEADER = "Recent messages in this room:\n"
+MEMORY_HEADER = "What you remember about this user:\n- "
+
+
+@lru_cache(maxsize=8192)
+def estimate_tokens(text):
+    """Approximate BPE token count of a string"""
+    count = 0
+    for piece in _TOKEN_RE.findall(text):
+        count += (len(piece) + 3) // 4 if piece[0].isalnum() or piece[0] == '_' else 1
+    return count
+
+
+def message_tokens(message):
+    return estimate_tokens(message.get('content') or '') + MESSAGE_OVERHEAD
+
+
+def _normalise(line):
+    return ' '.join(line.split()).casefold()
+
+
+def history_line(message, assistant_id=ASSISTANT_ID):
+    """A history message as the message store would show it ("sender: text")
+
+    User turns already carry their "user_id: " prefix; AI replies don't.
+    """
+    content = message.get('content') or ''
+    if message.get('role') == 'assistant':
+        content = f"{assistant_id}: {content}"
+    return _normalise(content)
+
+
+class ContextBuilder:
+    """Builds [room prompt, room activity?, memories?, ...history] under a token budget.
+
+    recent_messages(room, limit) -> message docs (oldest first)
+    memories(user_id, query, limit) -> memory texts (best first)
+    """
+
+    def __init__(self, recent_messages=None, memories=None, budget=CONTEXT_TOKEN_BUDGET,
+                 memory_limit=CONTEXT_MEMORY_LIMIT, db_messages=CONTEXT_DB_MESSAGES,
+                 activity_tokens=CONTEXT_ACTIVITY_TOKENS, prefix_ttl=CONTEXT_PREFIX_TTL):
+        self.recent_messages = recent_messages
+        self.memories = memories
+        self.budget = budget
+        self.memory_limit = memory_limit
+        self.db_messages = db_messages
+        self.activity_tokens = activity_tokens
+        self.prefix_ttl = prefix_ttl
+        self.activity = {}  # room -> (expires_at, message docs)
+        self.lock = threading.Lock()
+        self.stats = {'builds': 0, 'activity_hits': 0, 'activity_misses': 0,
+                      'tokens_sent': 0, 'tokens_dropped': 0}
+
+    def _room_docs(self, room):
+        """Recent message docs for a room, fetched at most once per prefix_ttl"""
+        if self.recent_messages is None or self.db_messages <= 0:
+            return []
+        now = time.time()
+        with self.lock:
+            cached = self.activity.get(room)
+            if cached and cached[0] > now:
+                self.stats['activity_hits'] += 1
+                return cached[1]
+            self.stats['activity_misses'] += 1
+        try:
+            docs = list(self.recent_messages(room, self.db_messages))
+        except Exception as e:
+            print(f"[CONTEXT] Room activity unavailable: {e}")
+            docs = []
+        with self.lock:
+            self.activity[room] = (now + self.prefix_ttl, docs)
+        return docs
+
+    def _activity_note(self, docs, history_texts):
+        """Recent room messages not already in the history, newest kept first"""
+        lines = []
+        used = 0
+        for doc in reversed(docs):
+            line = f"{doc.get('user_id')}: {doc.get('message')}"
+            if _normalise(line) in history_texts:
+                continue
+            cost = estimate_tokens(line) + 1
+            if used + cost > self.activity_tokens:
+                break
+            lines.append(line)
+            used += cost
+        if not lines:
+            return None
+        lines.reverse()
+        return {"role": "system", "content": ACTIVITY_HEADER + "\n".join(lines)}
+
+    def prefix(self, room, system_content, history_texts=()):
+        """[room prompt, activity note?] for a room and their token cost
+
+        history_texts are history_line() values; activity lines matching one
+        of them are left out of the note.
+        """
+        messages = [{"role": "system", "content": system_content}]
+        note = self._activity_note(self._room_docs(room), set(history_texts))
+        if note:
+            messages.append(note)
+        return messages, sum(message_tokens(m) for m in messages)
+
+    def invalidate(self, room=None):
+        with self.lock:
+            if room is None:
+                self.activity.clear()
+            else:
+                self.activity.pop(room, None)
+
+    def build(self, room, system_content, history, user_id=None, query=None):
+        """Prompt messages for one AI call; history ends with the user's new message"""
+        history = list(history)
+        prefix, used = self.prefix(room, system_content, [history_line(m) for m in history])
+        messages = list(prefix)
+
+        latest = history.pop() if history else None
+        if latest is not None:
+            used += message_tokens(latest)
+
+        if self.memories is not None and user_id and query and self.memory_limit > 0:
+            try:
+                texts = self.memories(user_id, query, self.memory_limit)
+            except Exception as e:
+                print(f"[CONTEXT] Memory lookup failed: {e}")
+                texts = []
+            kept = []
+            for text in texts:
+                cost = estimate_tokens(text) + 1
+                if used + cost + MESSAGE_OVERHEAD > self.budget:
+                    break
+                kept.append(text)
+                used += cost
+            if kept:
+                used += MESSAGE_OVERHEAD
+                messages.append({"role": "system", "content": MEMORY_HEADER + "\n- ".join(kept)})
+
+        # Newest turns first until the budget runs out
+        turns = []
+        dropped = 0
+        for message in reversed(history):
+            cost = message_tokens(message)
+            if used + cost > self.budget:
+                dropped = sum(message_tokens(m) for m in history[:len(history) - len(turns)])
+                break
+            turns.append(message)
+            used += cost
+        turns.reverse()
+        messages.extend(turns)
+        if latest is not None:
+            messages.append(latest)
+
+        with self.lock:
+            self.stats['builds'] += 1
+            self.stats['tokens_sent'] += used
+            self.stats['tokens_dropped'] += dropped
+        return messages
+
+    def status(self):
+        with self.lock:
+            builds = self.stats['builds']
+            return dict(self.stats, rooms_cached=len(self.activity), budget=self.budget,
+                        avg_prompt_tokens=round(self.stats['tokens_sent'] / builds, 1) if builds else 0.0)
@@ -0,0 +1,180 @@
+"""Concurrent HTTP front end for the threaded service mode
+
+HTTPServer handled one connection at a time, so a slow client pulling the
+327 KB MQTT bundle held up everyone, including Render's /health checks.
+
+FrontEndServer hands each accepted connection to a bounded worker pool.
+When every worker is busy, the accept thread peeks at the request line and
+answers `GET /health` itself from a cached body, so health checks never
+wait behind slow downloads. Other requests queue (up to HTTP_BACKLOG) and
+then get a quick 503 instead of queueing without limit.
+
+KeepAliveMixin gives handlers HTTP/1.1 keep-alive with a short idle timeout
+(so idle browsers don't pin workers) and a per-request socket timeout.
+Responses sent without a Content-Length automatically close the connection,
+so older handlers stay correct.
+"""
+import os
+import select
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+
+HTTP_WORKERS = int(os.getenv("HTTP_WORKERS", 16))
+HTTP_BACKLOG = int(os.getenv("HTTP_BACKLOG", 64))
+HTTP_REQUEST_TIMEOUT = float(os.getenv("HTTP_REQUEST_TIMEOUT", 15))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 5))
+HEALTH_CACHE_SECONDS = float(os.getenv("HEALTH_CACHE_SECONDS", 1.0))
+
+
+class CachedHealth:
+    """health_page() output, re-rendered at most every HEALTH_CACHE_SECONDS"""
+
+    def __init__(self, render, ttl=HEALTH_CACHE_SECONDS):
+        self.render = render
+        self.ttl = ttl
+        self.body = b''
+        self.expires = 0.0
+        self.lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if now >= self.expires:
+            with self.lock:
+                if now >= self.expires:
+                    try:
+                        self.body = self.render().encode()
+                    except Exception as e:
+                        self.body = f"<h1>degraded</h1><p>{e}</p>".encode()
+                    self.expires = now + self.ttl
+        return self.body
+
+
+class KeepAliveMixin:
+    """HTTP/1.1 keep-alive with idle and request timeouts for BaseHTTPRequestHandler"""
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; Nagle + delayed ACK adds ~40ms per keep-alive request
+    disable_nagle_algorithm = True
+    timeout = HTTP_REQUEST_TIMEOUT
+    keepalive_timeout = HTTP_KEEPALIVE_TIMEOUT
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            # Wait for the next request with the (shorter) idle timeout
+            try:
+                readable, _, _ = select.select([self.connection], [], [], self.keepalive_timeout)
+            except (OSError, ValueError):
+                return
+            if not readable:
+                return
+            self.handle_one_request()
+
+    def send_response(self, code, message=None):
+        self._has_length = False
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'content-length':
+            self._has_length = True
+        super().send_header(keyword, value)
+
+    def end_headers(self):
+        if not getattr(self, '_has_length', True) and self.request_version == 'HTTP/1.1':
+            # Body length unknown: the connection close marks its end
+            super().send_header('Connection', 'close')
+            self.close_connection = True
+        super().end_headers()
+
+
+class FrontEndServer(HTTPServer):
+    """HTTPServer with a bounded worker pool, 503 shedding and an inline /health lane"""
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, health=None, workers=HTTP_WORKERS,
+                 backlog=HTTP_BACKLOG):
+        super().__init__(server_address, handler_class)
+        self.health = health
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="http")
+        self.slots = threading.BoundedSemaphore(max(1, workers) + max(0, backlog))
+        self.workers = max(1, workers)
+        self.busy = 0
+        self.stats = {'accepted': 0, 'shed': 0, 'health_inline': 0, 'errors': 0}
+        self.stats_lock = threading.Lock()
+
+    def _count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def process_request(self, request, client_address):
+        if self.busy >= self.workers and self.health is not None and self._is_health(request):
+            # No free worker: a queued health check would wait behind slow clients
+            self._count('health_inline')
+            head = self._read_head(request)
+            self._reply(request, b"200 OK", b"text/html", self.health.get(), head.startswith(b"HEAD"))
+            self.shutdown_request(request)
+            return
+        if self.slots.acquire(blocking=False):
+            self._count('accepted')
+            self.pool.submit(self._work, request, client_address)
+            return
+        self._count('shed')
+        self._read_head(request)
+        self._reply(request, b"503 Service Unavailable", b"text/plain", b"Server busy, retry shortly")
+        self.shutdown_request(request)
+
+    def _work(self, request, client_address):
+        with self.stats_lock:
+            self.busy += 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self._count('errors')
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self.stats_lock:
+                self.busy -= 1
+            self.slots.release()
+
+    @staticmethod
+    def _is_health(request):
+        try:
+            request.settimeout(0.05)
+            head = request.recv(16, socket.MSG_PEEK)
+        except OSError:
+            return False
+        finally:
+            request.settimeout(None)
+        return head.startswith((b"GET /health ", b"GET /health?", b"HEAD /health"))
+
+    @staticmethod
+    def _read_head(request):
+        """Whatever the client has sent so far (read, so closing doesn't reset the reply)"""
+        try:
+            request.settimeout(0.05)
+            return request.recv(8192)
+        except OSError:
+            return b''
+
+    @staticmethod
+    def _reply(request, status, content_type, body, head_only=False):
+        try:
+            request.settimeout(1.0)
+            request.sendall(b"HTTP/1.1 " + status + b"\r\nContent-Type: " + content_type +
+                            b"\r\nContent-Length: " + str(len(body)).encode() +
+                            b"\r\nConnection: close\r\n\r\n" + (b'' if head_only else body))
+        except OSError:
+            pass
+
+    def status(self):
+        with self.stats_lock:
+            return dict(self.stats, workers=self.workers, busy=self.busy)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,219 @@
+"""Shared LLM provider clients (Zhipu, OpenAI, Groq)
+
+All three speak the OpenAI chat-completions wire format, so one client class
+covers them. Each provider keeps a requests.Session with a keep-alive
+connection pool, retries transient failures with jittered exponential
+backoff, and trips a circuit breaker when the upstream keeps failing so
+callers drop straight to their local fallback instead of waiting on timeouts.
+"""
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", 16))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", 5))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", 30))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 5))
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# name -> (api key env var, base url, default model, default read timeout)
+PROVIDER_CONFIG = {
+    "zhipu": ("ZHIPU_API_KEY", "https://open.bigmodel.cn/api/paas/v4", "glm-4-flash", 20),
+    "openai": ("OPENAI_API_KEY", "https://api.openai.com/v1", "gpt-3.5-turbo", 20),
+    "groq": ("GROQ_API_KEY", "https://api.groq.com/openai/v1", "llama3-8b-8192", 15),
+}
+
+
+class ProviderError(Exception):
+    """Upstream call failed; retryable errors have already been retried"""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class CircuitOpenError(ProviderError):
+    """Provider is marked down; caller should use its fallback immediately"""
+
+
+class CircuitBreaker:
+    """closed -> open after N consecutive failures -> half-open after reset_timeout
+
+    Half-open lets exactly one probe call through; its outcome closes or
+    re-opens the circuit. A probe that never reports back (hung thread) is
+    replaced after another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold=LLM_BREAKER_THRESHOLD, reset_timeout=LLM_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            return self._state(time.time())
+
+    def _state(self, now):
+        if self.opened_at is None:
+            return "closed"
+        if now - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        now = time.time()
+        with self.lock:
+            state = self._state(now)
+            if state == "closed":
+                return True
+            if state == "open":
+                return False
+            if self.probe_started is not None and now - self.probe_started < self.reset_timeout:
+                return False
+            self.probe_started = now
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                # A failed half-open probe re-opens for another full period
+                self.opened_at = time.time()
+            self.probe_started = None
+
+    def release(self):
+        """The call ended without a verdict on the upstream (e.g. HTTP 400)"""
+        with self.lock:
+            self.probe_started = None
+
+
+class LLMProvider:
+    """OpenAI-compatible chat-completions client with pooling, retries and a breaker"""
+
+    def __init__(self, name, base_url, api_key, default_model, timeout,
+                 max_retries=LLM_MAX_RETRIES, pool_size=LLM_POOL_SIZE):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.default_model = default_model
+        self.timeout = (LLM_CONNECT_TIMEOUT, timeout)
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        })
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'short_circuited': 0}
+        self.stats_lock = threading.Lock()
+
+    def _count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def _post(self, payload, stream=False):
+        if not self.breaker.allow():
+            self._count('short_circuited')
+            raise CircuitOpenError(f"{self.name} circuit open")
+
+        url = f"{self.base_url}/chat/completions"
+        for attempt in range(self.max_retries + 1):
+            self._count('requests')
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout, stream=stream)
+                if response.status_code == 200:
+                    self.breaker.record_success()
+                    return response
+                error = ProviderError(f"{self.name} HTTP {response.status_code}: {response.text[:200]}",
+                                      retryable=response.status_code in RETRYABLE_STATUS)
+                response.close()
+            except requests.RequestException as e:
+                error = ProviderError(f"{self.name} request failed: {e}", retryable=True)
+
+            if not error.retryable or attempt == self.max_retries:
+                break
+            self._count('retries')
+            # Full jitter: sleep somewhere in [0, 0.5 * 2^attempt] seconds, capped at 8
+            time.sleep(random.uniform(0, min(8.0, 0.5 * 2 ** attempt)))
+
+        self._count('failures')
+        if error.retryable:
+            self.breaker.record_failure()
+        else:
+            self.breaker.release()
+        raise error
+
+    def chat(self, messages, model=None, **params):
+        """Blocking completion. Returns the decoded response dict."""
+        payload = dict(params, model=model or self.default_model, messages=messages)
+        data = self._post(payload).json()
+        if 'error' in data:
+            raise ProviderError(f"{self.name} API error: {data['error']}")
+        if not data.get('choices'):
+            raise ProviderError(f"{self.name} returned no choices")
+        return data
+
+    def chat_stream(self, messages, model=None, **params):
+        """Yield decoded chunk dicts from a server-sent-events stream"""
+        payload = dict(params, model=model or self.default_model, messages=messages, stream=True)
+        response = self._post(payload, stream=True)
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                yield json.loads(data)
+        finally:
+            response.close()
+
+    def status(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        return dict(stats, circuit=self.breaker.state)
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(name):
+    """Shared provider instance, or None if its API key isn't configured"""
+    with _providers_lock:
+        if name in _providers:
+            return _providers[name]
+        key_env, base_url, model, timeout = PROVIDER_CONFIG[name]
+        api_key = os.getenv(key_env)
+        provider = None
+        if api_key:
+            prefix = name.upper()
+            provider = LLMProvider(
+                name,
+                os.getenv(f"{prefix}_BASE_URL", base_url),
+                api_key,
+                os.getenv(f"{prefix}_MODEL", model),
+                float(os.getenv(f"{prefix}_TIMEOUT", timeout)),
+            )
+        _providers[name] = provider
+        return provider
+
@@ -0,0 +1,555 @@
+"""Persistent per-user memory bank with local embeddings
+
+Replaces the in-process chromadb collection (lost on restart) and the TF-IDF
+vectorizer that was never fitted.
+
+- HashedEmbedder turns text into a fixed-size vector from hashed character
+  n-grams and words. It needs no model download and no fitting, and the same
+  text always gets the same vector in every process.
+- Vectors live in one memory-mapped float32 file (memory_bank/vectors.f32),
+  one row per memory. Metadata lives next to it in SQLite.
+- The index is partitioned per user: each user owns an int32 array of row
+  numbers, so a lookup only scores that user's memories (no `where` filter
+  over everyone's). Small partitions are scanned exactly. Large ones get a
+  lazily built IVF (k-means coarse lists, probe the nearest few, rescore
+  exactly), so top-k stays sub-millisecond however many memories other users
+  have and close to it for very large single partitions.
+
+The IVF is for banks that raise or lift the per-user cap (MEMORY_MAX_PER_USER,
+0 = no cap): with the default cap of 500 a partition never reaches
+MEMORY_IVF_MIN, and an exact scan of 500 rows is already well under a
+millisecond.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+import numpy as np
+
+MEMORY_DIR = os.getenv("MEMORY_DIR", "memory_bank")
+MEMORY_DIM = int(os.getenv("MEMORY_DIM", 256))
+# Partitions smaller than this are scanned exactly (only reachable when
+# MEMORY_MAX_PER_USER is raised past it or set to 0)
+MEMORY_IVF_MIN = int(os.getenv("MEMORY_IVF_MIN", 4096))
+MEMORY_IVF_PROBES = int(os.getenv("MEMORY_IVF_PROBES", 4))
+MEMORY_MAX_PER_USER = int(os.getenv("MEMORY_MAX_PER_USER", 500))
+# Each repeat of a memory counts as this many seconds of extra recency
+MEMORY_HIT_BONUS = float(os.getenv("MEMORY_HIT_BONUS", 86400))
+MEMORY_BATCH_SIZE = int(os.getenv("MEMORY_BATCH_SIZE", 64))
+MEMORY_FLUSH_INTERVAL = float(os.getenv("MEMORY_FLUSH_INTERVAL", 1.0))
+MEMORY_QUEUE_LIMIT = int(os.getenv("MEMORY_QUEUE_LIMIT", 10000))
+# Fewer texts than this are embedded in-process: the worker round-trip
+# (pickle + pipe) costs more than hashing a handful of short texts
+MEMORY_POOL_MIN_BATCH = int(os.getenv("MEMORY_POOL_MIN_BATCH", 8))
+
+_WORD_RE = re.compile(r"\w+")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS memories (
+    slot INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    category TEXT,
+    text TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    content_hash TEXT,
+    hits INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_memories_user ON memories (user_id);
+"""
+
+# Banks created before dedup/eviction lack these columns
+_MIGRATIONS = {
+    'content_hash': "ALTER TABLE memories ADD COLUMN content_hash TEXT",
+    'hits': "ALTER TABLE memories ADD COLUMN hits INTEGER NOT NULL DEFAULT 1",
+}
+
+
+def content_hash(category, text):
+    """Dedup key: whitespace/case-insensitive text within a category"""
+    normalized = " ".join(text.lower().split())
+    return hashlib.sha1(f"{category}\0{normalized}".encode('utf-8')).hexdigest()
+
+
+class HashedEmbedder:
+    """Feature-hashed bag of words + character 3..5-grams, L2-normalized"""
+
+    def __init__(self, dim=MEMORY_DIM, ngrams=(3, 4, 5)):
+        self.dim = dim
+        self.ngrams = ngrams
+
+    def features(self, text):
+        words = _WORD_RE.findall(text.lower())
+        features = [f"w:{w}" for w in words]
+        for word in words:
+            padded = f" {word} "
+            for n in self.ngrams:
+                features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return features
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        features = self.features(text)
+        if not features:
+            return vector
+        # crc32 is stable across processes (str hash() is salted per run)
+        hashes = np.fromiter((zlib.crc32(f.encode('utf-8')) for f in features),
+                             dtype=np.uint32, count=len(features))
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, hashes % self.dim, signs)
+        # Sublinear term frequency so repeated words don't dominate
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_many(self, texts):
+        return np.stack([self.embed(t) for t in texts]) if texts else np.zeros((0, self.dim), np.float32)
+
+
+def embed_texts(texts, dim=MEMORY_DIM):
+    """Module-level entry point so worker processes can embed (see worker_pool)"""
+    return HashedEmbedder(dim).embed_many(texts)
+
+
+class PooledEmbedder(HashedEmbedder):
+    """HashedEmbedder that sends batches to a ProcessWorkerPool.
+
+    Small batches and single queries stay in-process, and so does any batch
+    the pool fails on.
+    """
+
+    def __init__(self, pool, dim=MEMORY_DIM, ngrams=(3, 4, 5), min_batch=MEMORY_POOL_MIN_BATCH):
+        super().__init__(dim, ngrams)
+        self.pool = pool
+        self.min_batch = min_batch
+        self.fallbacks = 0
+
+    def embed_many(self, texts):
+        if len(texts) < max(1, self.min_batch):
+            return super().embed_many(texts)
+        try:
+            return self.pool.call(embed_texts, list(texts), self.dim)
+        except Exception as e:
+            self.fallbacks += 1
+            print(f"[MEMORY] Worker embedding failed ({e}), embedding in-process")
+            return super().embed_many(texts)
+
+
+class _Partition:
+    """One user's rows plus an optional IVF over them"""
+    __slots__ = ("rows", "lists", "centroids", "indexed", "lock")
+
+    def __init__(self, rows=None):
+        self.rows = np.asarray(rows if rows is not None else [], dtype=np.int32)
+        self.lists = None  # list of int32 row arrays, one per centroid
+        self.centroids = None
+        self.indexed = 0  # rows[:indexed] are covered by the IVF
+        self.lock = threading.Lock()
+
+
+class MemoryBank:
+    """Per-user vector memory on a memory-mapped file with SQLite metadata"""
+
+    def __init__(self, directory=MEMORY_DIR, dim=MEMORY_DIM, ivf_min=MEMORY_IVF_MIN,
+                 probes=MEMORY_IVF_PROBES, max_per_user=MEMORY_MAX_PER_USER):
+        self.directory = directory
+        self.dim = dim
+        self.max_per_user = max_per_user
+        self.ivf_min = ivf_min
+        self.probes = probes
+        self.embedder = HashedEmbedder(dim)
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(directory, "memories.db"), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_SCHEMA)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(memories)")}
+        for column, sql in _MIGRATIONS.items():
+            if column not in columns:
+                self.db.execute(sql)
+        self._backfill_hashes()
+        self.db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_memories_dedup "
+                        "ON memories (user_id, content_hash)")
+
+        self.vector_path = os.path.join(directory, "vectors.f32")
+        self.vectors = None
+        self.capacity = 0
+        self.partitions = {}
+        self.free_slots = []
+        self.next_slot = 0
+        self._load()
+        self.stats = {'added': 0, 'removed': 0, 'deduped': 0, 'evicted': 0, 'queries': 0,
+                      'ivf_builds': 0, 'total_query_ms': 0.0}
+
+    def _backfill_hashes(self):
+        """Give pre-dedup rows a content_hash, merging rows that turn out to be duplicates"""
+        rows = self.db.execute("SELECT slot, user_id, category, text, updated, hits FROM memories "
+                               "WHERE content_hash IS NULL ORDER BY updated DESC").fetchall()
+        if not rows:
+            return
+        merged = 0
+        with self.db:
+            for slot, user_id, category, text, updated, hits in rows:
+                key = content_hash(category, text)
+                keeper = self.db.execute("SELECT slot FROM memories WHERE user_id = ? AND content_hash = ?",
+                                         [user_id, key]).fetchone()
+                if keeper is None:
+                    self.db.execute("UPDATE memories SET content_hash = ? WHERE slot = ?", [key, slot])
+                    continue
+                # Newest copy wins (rows come newest first); repeats add to its hit count
+                self.db.execute("UPDATE memories SET hits = hits + ?, updated = MAX(updated, ?) WHERE slot = ?",
+                                [hits, updated, keeper[0]])
+                self.db.execute("DELETE FROM memories WHERE slot = ?", [slot])
+                merged += 1
+        print(f"[MEMORY] Backfilled content hashes for {len(rows)} memories ({merged} duplicates merged)")
+
+    # ---- storage ----
+    def _map(self, capacity):
+        row_bytes = self.dim * 4
+        size = os.path.getsize(self.vector_path) if os.path.exists(self.vector_path) else 0
+        if size < capacity * row_bytes:
+            with open(self.vector_path, 'ab') as f:
+                f.truncate(capacity * row_bytes)
+        if self.vectors is not None:
+            self.vectors.flush()
+        self.capacity = capacity
+        self.vectors = np.memmap(self.vector_path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+
+    def _load(self):
+        rows = self.db.execute("SELECT slot, user_id FROM memories ORDER BY slot").fetchall()
+        by_user = {}
+        for slot, user_id in rows:
+            by_user.setdefault(user_id, []).append(slot)
+        self.partitions = {user_id: _Partition(slots) for user_id, slots in by_user.items()}
+        used = {slot for slot, _ in rows}
+        self.next_slot = (rows[-1][0] + 1) if rows else 0
+        self.free_slots = [s for s in range(self.next_slot) if s not in used]
+        existing = os.path.getsize(self.vector_path) // (self.dim * 4) if os.path.exists(self.vector_path) else 0
+        self._map(max(1024, existing, self.next_slot))
+        print(f"[MEMORY] Memory bank at {self.directory}: {len(rows)} memories, {len(self.partitions)} users")
+
+    def _allocate(self, count):
+        slots = [self.free_slots.pop() for _ in range(min(count, len(self.free_slots)))]
+        extra = count - len(slots)
+        if extra:
+            slots.extend(range(self.next_slot, self.next_slot + extra))
+            self.next_slot += extra
+        if self.next_slot > self.capacity:
+            capacity = self.capacity
+            while capacity < self.next_slot:
+                capacity *= 2
+            self._map(capacity)
+        return slots
+
+    # ---- writes ----
+    def add_many(self, user_id, items, now=None):
+        """Upsert (category, text) pairs for a user. Returns their slots.
+
+        A memory whose normalized text already exists for the user in that
+        category is refreshed (updated time, hit count) instead of stored
+        again. Past max_per_user, the memories with the lowest
+        updated + MEMORY_HIT_BONUS * ln(1 + hits) are evicted.
+        """
+        return self.add_batch({user_id: items}, now).get(user_id, [])
+
+    def add_batch(self, items_by_user, now=None):
+        """add_many for several users at once: {user_id: [(category, text)]} -> {user_id: slots}
+
+        New texts of all the users are embedded in one embed_many call, so
+        a pooled embedder gets one batch worth a worker round-trip instead
+        of a handful of texts per user.
+        """
+        now = time.time() if now is None else now
+        plans = {}
+        for user_id, items in items_by_user.items():
+            if not items:
+                continue
+            keyed = {}
+            for category, text in items:
+                keyed.setdefault(content_hash(category, text), (category, text))
+            plans[user_id] = (keyed, len(items))
+        if not plans:
+            return {}
+
+        # Embedding is pure CPU (maybe a worker round-trip): only new content
+        # pays for it, and it runs without the bank lock so searches and other
+        # users' writes are not held up
+        todo = []
+        with self.lock:
+            for user_id, (keyed, _) in plans.items():
+                known = {key for key, _ in self.db.execute(self._lookup_sql(len(keyed)),
+                                                           [user_id, *keyed]).fetchall()}
+                todo.extend((user_id, key) for key in keyed if key not in known)
+        vectors = self.embedder.embed_many([plans[user_id][0][key][1] for user_id, key in todo])
+        embedded = {}
+        for (user_id, key), vector in zip(todo, vectors):
+            embedded.setdefault(user_id, {})[key] = vector
+
+        return {user_id: self._store(user_id, keyed, count, embedded.get(user_id, {}), now)
+                for user_id, (keyed, count) in plans.items()}
+
+    @staticmethod
+    def _lookup_sql(count):
+        marks = ",".join("?" * count)
+        return f"SELECT content_hash, slot FROM memories WHERE user_id = ? AND content_hash IN ({marks})"
+
+    def _store(self, user_id, keyed, count, embedded, now):
+        """Second half of add_batch for one user: write rows for texts embedded outside the lock"""
+        with self.lock:
+            # Re-check: another writer may have stored some of these meanwhile
+            existing = dict(self.db.execute(self._lookup_sql(len(keyed)), [user_id, *keyed]).fetchall())
+            fresh = [(key, item) for key, item in keyed.items() if key not in existing]
+            self.stats['deduped'] += count - len(fresh)
+
+            slots = []
+            if fresh:
+                missing = [key for key, _ in fresh if key not in embedded]
+                if missing:
+                    # Deleted since the first look; rare, embed here rather than lose it
+                    embedded.update(zip(missing, self.embedder.embed_many([keyed[k][1] for k in missing])))
+                slots = self._allocate(len(fresh))
+                self.vectors[slots] = np.stack([embedded[key] for key, _ in fresh])
+            with self.db:
+                if existing:
+                    self.db.executemany("UPDATE memories SET updated = ?, hits = hits + 1 WHERE slot = ?",
+                                        [(now, slot) for slot in existing.values()])
+                if fresh:
+                    self.db.executemany(
+                        "INSERT OR REPLACE INTO memories "
+                        "(slot, user_id, category, text, created, updated, content_hash, hits) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, 1)",
+                        [(slot, user_id, category, text, now, now, key)
+                         for slot, (key, (category, text)) in zip(slots, fresh)])
+            if slots:
+                partition = self.partitions.get(user_id)
+                if partition is None:
+                    partition = self.partitions[user_id] = _Partition()
+                with partition.lock:
+                    # New rows land after `indexed`, so an existing IVF stays valid
+                    partition.rows = np.concatenate([partition.rows, np.asarray(slots, dtype=np.int32)])
+                self.stats['added'] += len(slots)
+            self._enforce_cap(user_id)
+        slot_of = dict(existing)
+        slot_of.update(zip((key for key, _ in fresh), slots))
+        return [slot_of[key] for key in keyed]
+
+    def add(self, user_id, category, text):
+        return self.add_many(user_id, [(category, text)])[0]
+
+    def _enforce_cap(self, user_id):
+        partition = self.partitions.get(user_id)
+        excess = len(partition.rows) - self.max_per_user if partition is not None else 0
+        if excess <= 0 or self.max_per_user <= 0:
+            return
+        rows = self.db.execute("SELECT slot, updated, hits FROM memories WHERE user_id = ?", [user_id]).fetchall()
+        scores = np.array([updated + MEMORY_HIT_BONUS * np.log1p(hits) for _, updated, hits in rows])
+        victims = [rows[i][0] for i in np.argpartition(scores, excess - 1)[:excess]]
+        self._remove(user_id, victims)
+        self.stats['evicted'] += len(victims)
+
+    def remove(self, user_id, slots):
+        """Delete memories by slot; their rows are reused by later adds"""
+        if not slots:
+            return
+        with self.lock:
+            self._remove(user_id, slots)
+
+    def _remove(self, user_id, slots):
+        with self.db:
+            self.db.executemany("DELETE FROM memories WHERE slot = ? AND user_id = ?",
+                                [(int(s), user_id) for s in slots])
+        partition = self.partitions.get(user_id)
+        if partition is not None:
+            with partition.lock:
+                partition.rows = partition.rows[~np.isin(partition.rows, slots)]
+                partition.lists = partition.centroids = None
+                partition.indexed = 0
+                if not len(partition.rows):
+                    del self.partitions[user_id]
+        self.free_slots.extend(int(s) for s in slots)
+        self.stats['removed'] += len(slots)
+
+    def flush(self):
+        with self.lock:
+            self.vectors.flush()
+
+    # ---- search ----
+    def _build_ivf(self, partition):
+        rows = partition.rows
+        data = np.asarray(self.vectors[rows])
+        nlist = max(2, int(np.sqrt(len(rows))))
+        rng = np.random.default_rng(len(rows))
+        sample = data[rng.choice(len(rows), min(len(rows), nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(8):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    norm = np.linalg.norm(centroid)
+                    centroids[c] = centroid / norm if norm else centroid
+        assign = np.argmax(data @ centroids.T, axis=1)
+        order = np.argsort(assign, kind='stable')
+        bounds = np.searchsorted(assign[order], np.arange(nlist + 1))
+        partition.lists = [rows[order[bounds[c]:bounds[c + 1]]] for c in range(nlist)]
+        partition.centroids = centroids
+        partition.indexed = len(rows)
+        self.stats['ivf_builds'] += 1
+
+    def _candidates(self, partition, query):
+        with partition.lock:
+            rows = partition.rows
+            if len(rows) < self.ivf_min:
+                return rows
+            # Rebuild once the unindexed tail outgrows a quarter of the partition
+            if partition.lists is None or len(rows) - partition.indexed > partition.indexed // 4:
+                self._build_ivf(partition)
+            probes = np.argsort(partition.centroids @ query)[-self.probes:]
+            return np.concatenate([partition.lists[c] for c in probes] + [rows[partition.indexed:]])
+
+    def search(self, user_id, query, limit=3):
+        """Top-`limit` (slot, score) pairs for a user, best first"""
+        partition = self.partitions.get(user_id)
+        if partition is None or limit <= 0:
+            return []
+        started = time.perf_counter()
+        query_vector = self.embedder.embed(query)
+        rows = self._candidates(partition, query_vector)
+        if not len(rows):
+            return []
+        scores = self.vectors[rows] @ query_vector
+        if len(scores) > limit:
+            best = np.argpartition(scores, -limit)[-limit:]
+            best = best[np.argsort(scores[best])[::-1]]
+        else:
+            best = np.argsort(scores)[::-1]
+        self.stats['queries'] += 1
+        self.stats['total_query_ms'] += (time.perf_counter() - started) * 1000
+        return [(int(rows[i]), float(scores[i])) for i in best]
+
+    def fetch(self, slots, user_id=None):
+        """slot -> {'user_id','category','text','created','updated'}
+
+        With user_id, slots that no longer belong to that user are left out:
+        a search can return a slot that was evicted and reused for someone
+        else's memory before the fetch runs.
+        """
+        if not slots:
+            return {}
+        marks = ",".join("?" * len(slots))
+        sql = f"SELECT slot, user_id, category, text, created, updated FROM memories WHERE slot IN ({marks})"
+        args = [int(s) for s in slots]
+        if user_id is not None:
+            sql += " AND user_id = ?"
+            args.append(user_id)
+        with self.lock:
+            rows = self.db.execute(sql, args).fetchall()
+        return {r[0]: {'user_id': r[1], 'category': r[2], 'text': r[3], 'created': r[4], 'updated': r[5]}
+                for r in rows}
+
+    def query(self, user_id, query, limit=3):
+        """Texts of the most relevant memories, best first"""
+        hits = self.search(user_id, query, limit)
+        records = self.fetch([slot for slot, _ in hits], user_id)
+        return [records[slot]['text'] for slot, _ in hits if slot in records]
+
+    def count(self, user_id=None):
+        if user_id is None:
+            return sum(len(p.rows) for p in self.partitions.values())
+        partition = self.partitions.get(user_id)
+        return len(partition.rows) if partition is not None else 0
+
+    def status(self):
+        queries = self.stats['queries']
+        return dict(self.stats, memories=self.count(), users=len(self.partitions),
+                    avg_query_ms=round(self.stats['total_query_ms'] / queries, 3) if queries else 0.0)
+
+
+class MemoryIngest:
+    """Buffers store_user_memory calls and writes them to the bank in batches.
+
+    Writes are deduplicated before they reach the bank, so a burst of
+    identical preferences costs one upsert, and a flush embeds the new texts
+    of every user in it as one batch.
+    """
+
+    def __init__(self, bank, batch_size=MEMORY_BATCH_SIZE, flush_interval=MEMORY_FLUSH_INTERVAL,
+                 queue_limit=MEMORY_QUEUE_LIMIT):
+        self.bank = bank
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_limit = queue_limit
+        self.buffer = {}  # (user_id, content_hash) -> (user_id, category, text)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.running = False
+        self.stats = {'queued': 0, 'coalesced': 0, 'dropped': 0, 'written': 0, 'flushes': 0, 'failed_flushes': 0}
+
+    def start(self):
+        if self.thread:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="memory-ingest", daemon=True)
+        self.thread.start()
+
+    def enqueue(self, user_id, category, text):
+        """Queue one memory. Returns False if the buffer is full and it was dropped."""
+        key = (user_id, content_hash(category, text))
+        with self.lock:
+            if key in self.buffer:
+                self.stats['coalesced'] += 1
+                return True
+            if len(self.buffer) >= self.queue_limit:
+                self.stats['dropped'] += 1
+                return False
+            self.buffer[key] = (user_id, category, text)
+            self.stats['queued'] += 1
+            pending = len(self.buffer)
+        if not self.running:
+            self.flush()  # no writer thread (e.g. scripts): write through
+        elif pending >= self.batch_size:
+            self.wakeup.set()
+        return True
+
+    def flush(self):
+        with self.lock:
+            batch, self.buffer = self.buffer, {}
+        if not batch:
+            return
+        by_user = {}
+        for user_id, category, text in batch.values():
+            by_user.setdefault(user_id, []).append((category, text))
+        try:
+            # One embedding batch for every user in this flush
+            self.bank.add_batch(by_user, time.time())
+            self.bank.flush()
+            self.stats['written'] += len(batch)
+            self.stats['flushes'] += 1
+        except Exception as e:
+            self.stats['failed_flushes'] += 1
+            print(f"[MEMORY] Batch write failed: {e}")
+
+    def _run(self):
+        while self.running:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(5)
+            self.thread = None
+        self.flush()
+
+    def status(self):
+        with self.lock:
+            return dict(self.stats, pending=len(self.buffer))
@@ -0,0 +1,72 @@
+"""Single-pass keyword routing for on_message
+
+AI triggers, navigation keywords and plugin trigger words are compiled into
+one alternation regex. A message is classified with one finditer() pass
+whatever the number of keywords, and word-boundary rules stop short
+triggers like "ai" from firing inside words such as "tai" or "laikas".
+"""
+import re
+import threading
+
+
+class MessageRouter:
+    """Keyword tables per kind ('ai', 'nav', 'plugin', ...) compiled into one pattern.
+
+    Kinds registered with prefix=True also match inflected forms
+    ("biblioteka" matches "bibliotekai"); the rest must match a whole word.
+    Tables can be replaced at runtime; the compiled pattern is rebuilt and
+    swapped in atomically, so concurrent route() calls never see a half-built
+    table.
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.prefix_kinds = set()
+        self.lock = threading.Lock()
+        self.compiled = (None, [])
+
+    def set_keywords(self, kind, mapping, prefix=False):
+        """Replace the keyword -> value table for one kind and recompile"""
+        with self.lock:
+            self.tables[kind] = {k.lower(): v for k, v in mapping.items() if k}
+            if prefix:
+                self.prefix_kinds.add(kind)
+            else:
+                self.prefix_kinds.discard(kind)
+            self._rebuild()
+
+    def _rebuild(self):
+        targets = {}  # keyword -> [(kind, value)]
+        prefix_words = set()
+        for kind, table in self.tables.items():
+            for keyword, value in table.items():
+                targets.setdefault(keyword, []).append((kind, value))
+                if kind in self.prefix_kinds:
+                    prefix_words.add(keyword)
+
+        # Longest first so "termai" wins over "ai" at the same position
+        keywords = sorted(targets, key=len, reverse=True)
+        parts = []
+        for keyword in keywords:
+            piece = re.escape(keyword)
+            if re.match(r'\w', keyword):
+                piece = r'(?<!\w)' + piece
+            if re.search(r'\w$', keyword):
+                piece += r'\w*' if keyword in prefix_words else r'(?!\w)'
+            parts.append(f"({piece})")
+
+        pattern = re.compile("|".join(parts)) if parts else None
+        self.compiled = (pattern, [targets[k] for k in keywords])
+
+    def route(self, text_lower):
+        """Map kind -> matched values (in order of appearance, deduplicated)"""
+        pattern, targets = self.compiled
+        matches = {}
+        if pattern is None:
+            return matches
+        for match in pattern.finditer(text_lower):
+            for kind, value in targets[match.lastindex - 1]:
+                values = matches.setdefault(kind, [])
+                if value not in values:
+                    values.append(value)
+        return matches
@@ -0,0 +1,493 @@
+"""Write-behind chat message persistence
+
+Messages are appended to an in-memory buffer and flushed to MongoDB (or the
+embedded SQLite store) with insert_many once BATCH_SIZE messages are waiting
+or FLUSH_INTERVAL seconds have passed. If the database is unreachable,
+batches are spilled to a local append-only JSONL file and replayed once
+writes succeed again.
+
+Spilled docs keep the _id pymongo assigned on the first attempt, so a
+replay of a doc that did reach MongoDB fails as a duplicate key and is
+counted as written instead of being stored twice. Replays back off while
+the database stays down.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+try:
+    from bson import ObjectId
+except ImportError:  # SQLite-only installs: _ids are never assigned
+    ObjectId = None
+
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", 100))
+MESSAGE_FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", 1.0))
+MESSAGE_QUEUE_LIMIT = int(os.getenv("MESSAGE_QUEUE_LIMIT", 10000))
+MESSAGE_SPILL_PATH = os.getenv("MESSAGE_SPILL_PATH", "message_spill.jsonl")
+MESSAGE_REPLAY_BACKOFF_MAX = float(os.getenv("MESSAGE_REPLAY_BACKOFF_MAX", 60))
+
+DUPLICATE_KEY = 11000
+
+
+def _to_json(doc):
+    """Spill-file form of a message doc (datetime -> epoch seconds, ObjectId -> {"$oid"})"""
+    doc = dict(doc)
+    if isinstance(doc.get('timestamp'), datetime):
+        doc['timestamp'] = doc['timestamp'].timestamp()
+    if '_id' in doc:
+        doc['_id'] = {'$oid': str(doc['_id'])}
+    return json.dumps(doc)
+
+
+def _from_json(line):
+    doc = json.loads(line)
+    if isinstance(doc.get('timestamp'), (int, float)):
+        doc['timestamp'] = datetime.fromtimestamp(doc['timestamp'])
+    oid = doc.get('_id')
+    if isinstance(oid, dict):
+        if ObjectId is not None and ObjectId.is_valid(oid.get('$oid')):
+            doc['_id'] = ObjectId(oid['$oid'])
+        else:
+            del doc['_id']
+    return doc
+
+
+def _failed_docs(error, docs):
+    """Docs an insert_many(ordered=False) did not store.
+
+    A BulkWriteError lists the failed indexes; duplicate keys mean the doc
+    is already stored (a replay of an earlier partial write). Any other
+    error means nothing can be assumed written.
+    """
+    details = getattr(error, 'details', None)
+    if not isinstance(details, dict) or 'writeErrors' not in details:
+        return docs
+    if details.get('writeConcernErrors'):
+        return docs
+    failed = {e['index'] for e in details['writeErrors'] if e.get('code') != DUPLICATE_KEY}
+    return [doc for i, doc in enumerate(docs) if i in failed]
+
+
+class MessageWriter:
+    """Buffers message docs and writes them to a collection in batches"""
+
+    def __init__(self, collection, batch_size=MESSAGE_BATCH_SIZE,
+                 flush_interval=MESSAGE_FLUSH_INTERVAL, queue_limit=MESSAGE_QUEUE_LIMIT,
+                 spill_path=MESSAGE_SPILL_PATH):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_limit = queue_limit
+        self.spill_path = spill_path
+        self.buffer = deque()
+        self.lock = threading.Lock()
+        self.spill_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.running = False
+        self.stats = {'written': 0, 'flushes': 0, 'failed_flushes': 0, 'spilled': 0,
+                      'replayed': 0, 'last_flush_ms': 0.0, 'max_flush_ms': 0.0,
+                      'total_flush_ms': 0.0}
+        self.replay_backoff = 0.0
+        self.replay_at = 0.0
+        self._recover_replay()
+        # Leftovers from a previous run get replayed on the first good flush
+        if os.path.exists(spill_path):
+            with open(spill_path, encoding='utf-8') as f:
+                self.stats['spilled'] = sum(1 for line in f if line.strip())
+
+    def _recover_replay(self):
+        """Fold a replay file left by a crash mid-replay back into the spill file"""
+        replay_path = self.spill_path + ".replay"
+        if not os.path.exists(replay_path):
+            return
+        with open(replay_path, encoding='utf-8') as src, open(self.spill_path, 'a', encoding='utf-8') as dst:
+            for line in src:
+                if line.strip():
+                    dst.write(line if line.endswith("\n") else line + "\n")
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.remove(replay_path)
+
+    def start(self):
+        if self.thread:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+        self.thread.start()
+        print(f"[DATABASE] Write-behind enabled (batch {self.batch_size}, every {self.flush_interval}s)")
+
+    def enqueue(self, doc):
+        """Accept a message for persistence; never blocks on the database"""
+        with self.lock:
+            if len(self.buffer) >= self.queue_limit:
+                overflow = True
+            else:
+                self.buffer.append(doc)
+                overflow = False
+                full = len(self.buffer) >= self.batch_size
+        if overflow:
+            # Queue is at its bound: go straight to disk rather than drop
+            self._spill([doc])
+            return True
+        if full:
+            self.wakeup.set()
+        return True
+
+    def _run(self):
+        while self.running:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def _take_batch(self):
+        with self.lock:
+            n = min(len(self.buffer), self.batch_size)
+            return [self.buffer.popleft() for _ in range(n)]
+
+    def flush(self):
+        """Write everything buffered so far. Safe to call from any thread."""
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                break
+            failed = self._write(batch)
+            if failed:
+                self._spill(failed)
+                if len(failed) == len(batch):
+                    self._spill(self._drain())
+                    return
+        # A clean write clears the backoff, so replay follows the first good
+        # write; while the database stays down, replay is a probe every backoff
+        if self.stats['spilled'] > self.stats['replayed'] and time.time() >= self.replay_at:
+            self._replay()
+
+    def _backoff(self):
+        self.replay_backoff = min(MESSAGE_REPLAY_BACKOFF_MAX,
+                                  max(self.flush_interval, self.replay_backoff * 2))
+        self.replay_at = time.time() + self.replay_backoff
+
+    def _drain(self):
+        with self.lock:
+            docs = list(self.buffer)
+            self.buffer.clear()
+            return docs
+
+    def _write(self, docs):
+        """insert_many a batch; returns the docs that were not stored (empty on success)"""
+        # pymongo sets _id on the dicts it is given; the originals are shared
+        # with RoomTailCache, so it gets copies (which keep that _id if spilled)
+        docs = [dict(doc) for doc in docs]
+        started = time.time()
+        try:
+            self.collection.insert_many(docs, ordered=False)
+            failed = []
+        except Exception as e:
+            failed = _failed_docs(e, docs)
+            if failed:
+                self.stats['failed_flushes'] += 1
+                self._backoff()
+                print(f"[DATABASE] Batch write failed ({len(failed)} of {len(docs)} messages): {e}")
+                if len(failed) == len(docs):
+                    return failed
+        if not failed:
+            self.replay_backoff = 0.0
+            self.replay_at = 0.0
+        elapsed = (time.time() - started) * 1000
+        self.stats['flushes'] += 1
+        self.stats['written'] += len(docs) - len(failed)
+        self.stats['last_flush_ms'] = round(elapsed, 2)
+        self.stats['max_flush_ms'] = round(max(self.stats['max_flush_ms'], elapsed), 2)
+        self.stats['total_flush_ms'] += elapsed
+        return failed
+
+    def _spill(self, docs):
+        if not docs:
+            return
+        with self.spill_lock:
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                for doc in docs:
+                    f.write(_to_json(doc) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.stats['spilled'] += len(docs)
+
+    def _replay(self):
+        """Re-send spilled messages now that the database is reachable"""
+        with self.spill_lock:
+            if not os.path.exists(self.spill_path):
+                return
+            replay_path = self.spill_path + ".replay"
+            os.replace(self.spill_path, replay_path)
+        batch, pending = [], []
+        with open(replay_path, encoding='utf-8') as f:
+            lines = (line for line in f if line.strip())
+            for line in lines:
+                batch.append(_from_json(line))
+                if len(batch) >= self.batch_size:
+                    failed = self._write(batch)
+                    self.stats['replayed'] += len(batch) - len(failed)
+                    pending.extend(failed)
+                    batch = []
+                    if failed:
+                        # Still failing: keep the rest for the next attempt
+                        pending.extend(_from_json(l) for l in lines)
+                        break
+        if batch:
+            failed = self._write(batch)
+            self.stats['replayed'] += len(batch) - len(failed)
+            pending.extend(failed)
+        # Re-spill before dropping the replay file, so a crash here
+        # duplicates (harmless, same _id) rather than loses messages
+        if pending:
+            self.stats['spilled'] -= len(pending)
+            self._spill(pending)
+        os.remove(replay_path)
+        if not pending:
+            print(f"[DATABASE] Replayed spilled messages ({self.stats['replayed']} total)")
+
+    def stop(self):
+        """Flush what's left and stop the background thread"""
+        self.running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(5)
+            self.thread = None
+        self.flush()
+
+    def status(self):
+        with self.lock:
+            depth = len(self.buffer)
+        flushes = self.stats['flushes']
+        avg = self.stats['total_flush_ms'] / flushes if flushes else 0.0
+        status = {k: v for k, v in self.stats.items() if k != 'total_flush_ms'}
+        status.update(queue_depth=depth, avg_flush_ms=round(avg, 2),
+                      spill_pending=self.stats['spilled'] - self.stats['replayed'])
+        return status
+
+
+# ==========================================
+# Recent-history reads
+# ==========================================
+MESSAGE_TAIL_SIZE = int(os.getenv("MESSAGE_TAIL_SIZE", 200))
+MESSAGE_TAIL_ROOMS = int(os.getenv("MESSAGE_TAIL_ROOMS", 500))
+
+
+def ensure_indexes(collection):
+    """Compound (room, timestamp) indexes backing get_recent_messages"""
+    try:
+        collection.create_index([("room", 1), ("timestamp", -1)], name="room_timestamp")
+        collection.create_index([("room", 1), ("server_timestamp", -1)], name="room_server_timestamp")
+        print("[DATABASE] Message indexes ready")
+    except Exception as e:
+        print(f"[DATABASE] Index creation failed: {e}")
+
+
+def _as_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromtimestamp(float(value))
+
+
+class RoomTailCache:
+    """Last MESSAGE_TAIL_SIZE messages per room, kept current by every save.
+
+    A room is 'warm' once its tail has been loaded from the database; after
+    that, reads that fit in the tail never touch the database. 'complete'
+    means the tail holds the room's entire history, so short reads are
+    still authoritative.
+    """
+
+    def __init__(self, tail_size=MESSAGE_TAIL_SIZE, max_rooms=MESSAGE_TAIL_ROOMS):
+        self.tail_size = tail_size
+        self.max_rooms = max_rooms
+        self.rooms = OrderedDict()  # room -> {'tail': deque, 'warm': bool, 'complete': bool}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, room):
+        entry = self.rooms.get(room)
+        if entry is None:
+            entry = self.rooms[room] = {'tail': deque(maxlen=self.tail_size),
+                                        'warm': False, 'complete': True}
+            while len(self.rooms) > self.max_rooms:
+                self.rooms.popitem(last=False)
+        else:
+            self.rooms.move_to_end(room)
+        return entry
+
+    def add(self, doc):
+        """Record a newly saved message (O(1))"""
+        with self.lock:
+            entry = self._entry(doc.get('room'))
+            if len(entry['tail']) == self.tail_size:
+                entry['complete'] = False
+            entry['tail'].append(doc)
+
+    def fill(self, room, docs, complete):
+        """Warm a room from a database read (docs oldest first)"""
+        with self.lock:
+            entry = self._entry(room)
+            # Keep writes that arrived while the read was in flight
+            seen = {(d.get('user_id'), d.get('server_timestamp')) for d in docs}
+            pending = [d for d in entry['tail']
+                       if (d.get('user_id'), d.get('server_timestamp')) not in seen]
+            merged = docs + pending
+            entry['tail'] = deque(merged[-self.tail_size:], maxlen=self.tail_size)
+            entry['complete'] = complete and len(merged) <= self.tail_size
+            entry['warm'] = True
+
+    def get(self, room, limit, before=None, require_warm=True):
+        """Up to `limit` messages older than `before`, oldest first; None on a miss"""
+        with self.lock:
+            entry = self.rooms.get(room)
+            if entry is None or (require_warm and not entry['warm']):
+                self.misses += 1
+                return None
+            self.rooms.move_to_end(room)
+            result = []
+            for doc in reversed(entry['tail']):
+                if before is not None and doc.get('timestamp') >= before:
+                    continue
+                result.append(doc)
+                if len(result) == limit:
+                    break
+            if len(result) < limit and not entry['complete'] and require_warm:
+                self.misses += 1
+                return None
+            self.hits += 1
+        result.reverse()
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {'rooms': len(self.rooms), 'hits': self.hits, 'misses': self.misses}
+
+
+def read_recent(collection, cache, room, limit=50, before=None):
+    """Cached, paginated history read: newest `limit` messages before `before`, oldest first"""
+    before = _as_datetime(before)
+    if collection is None:
+        # No database: the tail cache is the only history there is
+        return cache.get(room, limit, before, require_warm=False) or []
+
+    cached = cache.get(room, limit, before)
+    if cached is not None:
+        return cached
+
+    fetch = limit if before is not None else max(limit, cache.tail_size)
+    if isinstance(collection, SQLiteMessageStore):
+        docs = collection.find_recent(room, fetch, before)
+    else:
+        query = {"room": room}
+        if before is not None:
+            query["timestamp"] = {"$lt": before}
+        docs = list(collection.find(query).sort("timestamp", -1).limit(fetch))
+        docs.reverse()
+    if before is None:
+        cache.fill(room, docs, complete=len(docs) < fetch)
+    return docs[-limit:] if limit else []
+
+
+# ==========================================
+# Embedded store (used when MongoDB isn't available)
+# ==========================================
+MESSAGE_DB_PATH = os.getenv("MESSAGE_DB_PATH", "termchat_messages.db")
+MESSAGE_RETENTION_PER_ROOM = int(os.getenv("MESSAGE_RETENTION_PER_ROOM", 10000))
+MESSAGE_RETENTION_DAYS = float(os.getenv("MESSAGE_RETENTION_DAYS", 90))
+MESSAGE_COMPACT_INTERVAL = int(os.getenv("MESSAGE_COMPACT_INTERVAL", 3600))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    room TEXT NOT NULL,
+    user_id TEXT,
+    message TEXT,
+    type TEXT,
+    timestamp REAL NOT NULL,
+    server_timestamp REAL
+);
+CREATE INDEX IF NOT EXISTS messages_room_ts ON messages(room, timestamp);
+"""
+
+
+class SQLiteMessageStore:
+    """SQLite (WAL) message store with the insert_many shape MessageWriter expects.
+
+    Writes go through one connection (the writer thread) and reads through
+    another, so WAL lets history reads run while a batch is committing.
+    """
+
+    def __init__(self, path=MESSAGE_DB_PATH, retention_per_room=MESSAGE_RETENTION_PER_ROOM,
+                 retention_days=MESSAGE_RETENTION_DAYS, compact_interval=MESSAGE_COMPACT_INTERVAL):
+        self.path = path
+        self.retention_per_room = retention_per_room
+        self.retention_days = retention_days
+        self.compact_interval = compact_interval
+        self.write_conn = self._connect()
+        self.write_conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.write_conn.executescript(_SCHEMA)
+        self.read_conn = self._connect()
+        self.write_lock = threading.Lock()
+        self.read_lock = threading.Lock()
+        self.last_compact = time.time()
+        print(f"[DATABASE] Embedded SQLite store at {path}")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def insert_many(self, docs, ordered=False):
+        rows = []
+        for doc in docs:
+            ts = doc.get('timestamp')
+            ts = ts.timestamp() if isinstance(ts, datetime) else float(ts or doc.get('server_timestamp') or time.time())
+            rows.append((doc.get('room'), doc.get('user_id'), doc.get('message'),
+                         doc.get('type'), ts, doc.get('server_timestamp')))
+        with self.write_lock:
+            with self.write_conn:
+                self.write_conn.executemany(
+                    "INSERT INTO messages (room, user_id, message, type, timestamp, server_timestamp) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        if time.time() - self.last_compact >= self.compact_interval:
+            self.compact()
+
+    def find_recent(self, room, limit, before=None):
+        """Newest `limit` messages in a room older than `before`, oldest first"""
+        sql = "SELECT room, user_id, message, type, timestamp, server_timestamp FROM messages WHERE room = ?"
+        args = [room]
+        if before is not None:
+            sql += " AND timestamp < ?"
+            args.append(before.timestamp() if isinstance(before, datetime) else float(before))
+        sql += " ORDER BY timestamp DESC LIMIT ?"
+        args.append(limit)
+        with self.read_lock:
+            rows = self.read_conn.execute(sql, args).fetchall()
+        rows.reverse()
+        return [{'room': r[0], 'user_id': r[1], 'message': r[2], 'type': r[3],
+                 'timestamp': datetime.fromtimestamp(r[4]), 'server_timestamp': r[5]} for r in rows]
+
+    def compact(self):
+        """Apply retention limits, then checkpoint the WAL and return free pages"""
+        self.last_compact = time.time()
+        cutoff = time.time() - self.retention_days * 86400
+        started = time.time()
+        with self.write_lock:
+            with self.write_conn:
+                aged = self.write_conn.execute("DELETE FROM messages WHERE timestamp < ?", (cutoff,)).rowcount
+                trimmed = self.write_conn.execute(
+                    "DELETE FROM messages WHERE id IN ("
+                    " SELECT id FROM (SELECT id, ROW_NUMBER() OVER ("
+                    "  PARTITION BY room ORDER BY timestamp DESC) AS rn FROM messages)"
+                    " WHERE rn > ?)", (self.retention_per_room,)).rowcount
+            self.write_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.write_conn.execute("PRAGMA incremental_vacuum")
+        print(f"[DATABASE] Compacted message store: {aged + trimmed} removed in "
+              f"{(time.time() - started) * 1000:.0f}ms")
@@ -0,0 +1,253 @@
+"""MQTT connection manager: backoff reconnects, offline publish queue, persistent session
+
+The old on_disconnect slept 5 seconds inside paho's callback thread and was
+never attached. MQTTConnection instead:
+
+- connects with a stable client id and clean_session=False, so the broker
+  keeps our subscriptions (and queued QoS 1 messages) across reconnects.
+  With MQTT_PROTOCOL=5 (required for shared subscriptions in clustered
+  mode) that is clean_start=False plus a MQTT_SESSION_EXPIRY window.
+  Unless MQTT_CLIENT_ID is set, the id ends in a random suffix generated
+  once and kept in MQTT_CLIENT_ID_FILE: on a public broker, a guessable id
+  would let anyone take over (or kick) our session.
+- leaves reconnecting to paho's own exponential backoff
+  (reconnect_delay_set), so no callback ever sleeps
+- buffers publishes made while disconnected in a bounded queue. When the
+  queue is full, QoS 0 frames are dropped before QoS 1/2 ones. On reconnect
+  the queue is replayed in order, skipping QoS 0 frames older than
+  MQTT_OFFLINE_MAX_AGE (stale stream chunks are worth less than the
+  bandwidth they cost). A QoS 0 publish that paho refuses while the link
+  still looks up is queued the same way and goes out with the next
+  completed publish, or on reconnect.
+
+The manager stands in for the paho client in the service callbacks, so
+every client.publish(...) in handlers and AI workers goes through the
+queue. Anything else is delegated to the underlying client.
+"""
+import os
+import random
+import secrets
+import socket
+import threading
+import time
+from collections import deque
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+MQTT_CLIENT_ID = os.getenv("MQTT_CLIENT_ID")
+MQTT_CLIENT_ID_FILE = os.getenv("MQTT_CLIENT_ID_FILE", ".mqtt_client_id")
+MQTT_KEEPALIVE = int(os.getenv("MQTT_KEEPALIVE", 60))
+# "311" or "5"
+MQTT_PROTOCOL = os.getenv("MQTT_PROTOCOL", "311")
+MQTT_SESSION_EXPIRY = int(os.getenv("MQTT_SESSION_EXPIRY", 3600))
+MQTT_RECONNECT_MIN = int(os.getenv("MQTT_RECONNECT_MIN", 1))
+MQTT_RECONNECT_MAX = int(os.getenv("MQTT_RECONNECT_MAX", 60))
+MQTT_OFFLINE_QUEUE = int(os.getenv("MQTT_OFFLINE_QUEUE", 1000))
+MQTT_OFFLINE_MAX_AGE = float(os.getenv("MQTT_OFFLINE_MAX_AGE", 60))
+
+
+def default_client_id(path=MQTT_CLIENT_ID_FILE):
+    """MQTT_CLIENT_ID, or termchat-backend-<host>-<secret suffix kept in `path`>"""
+    if MQTT_CLIENT_ID:
+        return MQTT_CLIENT_ID
+    try:
+        with open(path, encoding='utf-8') as f:
+            suffix = f.read().strip()
+    except OSError:
+        suffix = ""
+    if not suffix:
+        suffix = secrets.token_hex(8)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(suffix + "\n")
+        except OSError as e:
+            # Still private, just not persistent: each restart starts a new session
+            print(f"[MQTT] Could not save client id suffix to {path}: {e}")
+    return f"termchat-backend-{socket.gethostname()}-{suffix}"
+
+
+class MQTTConnection:
+    """Wraps a paho client; on_connect/on_message receive this object as `client`"""
+
+    def __init__(self, on_connect=None, on_message=None, client_id=None,
+                 queue_limit=MQTT_OFFLINE_QUEUE, max_age=MQTT_OFFLINE_MAX_AGE,
+                 protocol=MQTT_PROTOCOL, persistent=True):
+        client_id = client_id or default_client_id()
+        # persistent=False: a fresh session per connect (shared-subscription
+        # members, whose broker-side sessions must not outlive them)
+        self.persistent = persistent
+        self.client_id = client_id
+        self.handler_connect = on_connect
+        self.handler_message = on_message
+        self.queue_limit = queue_limit
+        self.max_age = max_age
+        self.v5 = str(protocol) == "5"
+        if self.v5:
+            # v5 has no clean_session; persistence is chosen per connect
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id,
+                                      protocol=mqtt.MQTTv5)
+        else:
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id,
+                                      clean_session=not persistent)
+        self.client.reconnect_delay_set(MQTT_RECONNECT_MIN, MQTT_RECONNECT_MAX)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_connect_fail = self._on_connect_fail
+        self.client.on_message = self._on_message
+        self.client.on_publish = self._on_publish
+        self.connected = False
+        self.offline = deque()  # (queued_at, topic, payload, qos, retain)
+        self.lock = threading.Lock()
+        self.delay = MQTT_RECONNECT_MIN
+        # Async mode: paho's socket belongs to this loop's thread (see bind_loop)
+        self.loop = None
+        self.loop_thread = None
+        self.stats = {'connects': 0, 'disconnects': 0, 'failed_connects': 0, 'queued': 0,
+                      'replayed': 0, 'dropped': 0, 'expired': 0, 'session_present': False,
+                      'last_disconnect': None}
+
+    def __getattr__(self, name):
+        # subscribe(), loop_read(), socket() ... go straight to paho
+        return getattr(self.client, name)
+
+    # ---- callbacks (never block) ----
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        if reason_code.is_failure:
+            print(f"[MQTT] Connect refused: {reason_code}")
+            return
+        self.delay = MQTT_RECONNECT_MIN
+        self.stats['connects'] += 1
+        self.stats['session_present'] = bool(getattr(flags, 'session_present', False))
+        if self.stats['connects'] > 1:
+            print(f"[MQTT] Reconnected (session {'resumed' if self.stats['session_present'] else 'new'})")
+        if self.handler_connect:
+            self.handler_connect(self, userdata, flags, reason_code, properties)
+        # Still "offline" until the backlog is out, so new frames queue behind it
+        self._replay()
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties=None):
+        self.connected = False
+        self.stats['disconnects'] += 1
+        self.stats['last_disconnect'] = str(reason_code)
+        print(f"[MQTT] Disconnected ({reason_code}); reconnecting with backoff, "
+              f"publishes are queued (max {self.queue_limit})")
+
+    def _on_connect_fail(self, client, userdata):
+        self.stats['failed_connects'] += 1
+        print(f"[MQTT] Connect attempt failed ({self.stats['failed_connects']} so far)")
+
+    def _on_message(self, client, userdata, message, properties=None):
+        if self.handler_message:
+            self.handler_message(self, userdata, message, properties)
+
+    def _on_publish(self, client, userdata, mid, reason_code=None, properties=None):
+        # A refused publish left the link up but the queue non-empty: paho is
+        # moving again, so send the backlog now instead of at the next reconnect
+        if not self.connected and self.offline and self.client.is_connected():
+            self._replay()
+
+    # ---- publishing ----
+    def bind_loop(self, loop):
+        """Async mode: call on the loop thread; publishes from any other thread are marshalled onto it"""
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if self.loop is not None and threading.get_ident() != self.loop_thread:
+            # paho isn't thread-safe once the event loop drives its socket
+            self.loop.call_soon_threadsafe(self.publish, topic, payload, qos, retain)
+            return None
+        if not self.connected:
+            with self.lock:
+                # connected only flips to True under the lock, once the queue is drained
+                if not self.connected:
+                    self._enqueue(topic, payload, qos, retain)
+                    return None
+        info = self.client.publish(topic, payload, qos, retain)
+        # paho keeps unsent QoS 1/2 messages itself and resends them on reconnect
+        if info.rc != mqtt.MQTT_ERR_SUCCESS and qos == 0:
+            with self.lock:
+                # Back to queueing (keeps order) until _replay drains it:
+                # on_publish if the link is still up, on_connect if it is not
+                self.connected = False
+                self._enqueue(topic, payload, qos, retain)
+        return info
+
+    def _enqueue(self, topic, payload, qos, retain):
+        if len(self.offline) >= self.queue_limit:
+            self._drop_one()
+        self.offline.append((time.monotonic(), topic, payload, qos, retain))
+        self.stats['queued'] += 1
+
+    def _drop_one(self):
+        for i, item in enumerate(self.offline):
+            if item[3] == 0:
+                del self.offline[i]
+                break
+        else:
+            self.offline.popleft()
+        self.stats['dropped'] += 1
+
+    def _replay(self):
+        """Drain the queue in order, then let publishes go straight to paho"""
+        sent = 0
+        while True:
+            with self.lock:
+                if not self.offline:
+                    self.connected = True
+                    break
+                pending, self.offline = self.offline, deque()
+            now = time.monotonic()
+            refused = None
+            for i, (queued_at, topic, payload, qos, retain) in enumerate(pending):
+                if qos == 0 and now - queued_at > self.max_age:
+                    self.stats['expired'] += 1
+                    continue
+                info = self.client.publish(topic, payload, qos, retain)
+                if info.rc != mqtt.MQTT_ERR_SUCCESS and qos == 0:
+                    refused = i
+                    break
+                sent += 1
+            if refused is not None:
+                # Keep the rest, in order, ahead of anything queued meanwhile
+                with self.lock:
+                    rest = list(pending)[refused:]
+                    self.offline.extendleft(reversed(rest))
+                    while len(self.offline) > self.queue_limit:
+                        self._drop_one()
+                break
+        if sent:
+            self.stats['replayed'] += sent
+            print(f"[MQTT] Replayed {sent} queued publishes")
+
+    # ---- running ----
+    def next_delay(self):
+        """Backoff with jitter for callers that drive reconnects themselves (async mode)"""
+        delay = self.delay
+        self.delay = min(self.delay * 2, MQTT_RECONNECT_MAX)
+        return random.uniform(delay / 2, delay)
+
+    def connect_async(self, host, port, keepalive=MQTT_KEEPALIVE):
+        """Record the broker; the network loop makes (and retries) the connection"""
+        if self.v5 and not self.persistent:
+            self.client.connect_async(host, port, keepalive, clean_start=True)
+        elif self.v5:
+            properties = Properties(PacketTypes.CONNECT)
+            properties.SessionExpiryInterval = MQTT_SESSION_EXPIRY
+            self.client.connect_async(host, port, keepalive, clean_start=False, properties=properties)
+        else:
+            self.client.connect_async(host, port, keepalive)
+
+    def run_forever(self, host, port, keepalive=MQTT_KEEPALIVE):
+        """Threaded mode: connect (retrying) and run paho's network loop"""
+        self.connect_async(host, port, keepalive)
+        self.client.loop_forever(retry_first_connection=True)
+
+    def status(self):
+        with self.lock:
+            queued = len(self.offline)
+        return dict(self.stats, connected=self.connected, offline_queue=queued,
+                    protocol="5" if self.v5 else "3.1.1")
@@ -1,16 +1,34 @@
+import argparse
 import sys
 import signal
-import paho.mqtt.client as mqtt
 import json
 import os
 import threading
 import random
 import string
 import time
+import uuid
 from datetime import datetime
 from dotenv import load_dotenv
-from http.server import HTTPServer, SimpleHTTPRequestHandler
-from zhipuai import ZhipuAI
+from http.server import SimpleHTTPRequestHandler
+from ai_dispatch import AIDispatcher
+from room_state import RoomStateStore
+from rate_limit import RateLimiter, peek_user_id
+from presence import PresenceTracker, PRESENCE_TICK
+from message_router import MessageRouter
+from plugin_sandbox import SandboxPool
+from plugin_dispatch import PluginDispatcher
+from plugin_loader import BytecodeCache, PluginLoader
+from ai_cache import ResponseCache, cache_key
+from context_builder import ContextBuilder
+from static_assets import StaticAssets
+from http_front import CachedHealth, FrontEndServer, KeepAliveMixin
+from output_publisher import OutputPublisher
+from worker_pool import SERVICE_WORKERS, ProcessWorkerPool
+from mqtt_connection import MQTTConnection
+from cluster import CLUSTER_ENABLED, CLUSTER_MAX_HOPS, ClusterNode
+from llm_providers import get_provider
+from message_store import MessageWriter, RoomTailCache, SQLiteMessageStore, ensure_indexes, read_recent
 
 # Database imports (with fallback)
 try:
@@ -20,26 +38,19 @@ except ImportError:
     MONGODB_AVAILABLE = False
     print("[WARNING] MongoDB not available - using memory storage")
 
-# Vector database imports
+# Vector database imports (memory bank needs NumPy)
 try:
-    import chromadb
-    import numpy as np
-    from sklearn.feature_extraction.text import TfidfVectorizer
+    from memory_bank import MemoryBank, MemoryIngest, PooledEmbedder
     VECTOR_DB_AVAILABLE = True
 except ImportError:
     VECTOR_DB_AVAILABLE = False
     print("[WARNING] Vector database not available - no memory bank")
 
-# Plugin system imports
-try:
-    import docker
-    from RestrictedPython import compile_restricted
-    from watchdog.observers import Observer
-    from watchdog.events import FileSystemEventHandler
-    PLUGIN_SYSTEM_AVAILABLE = True
-except ImportError:
-    PLUGIN_SYSTEM_AVAILABLE = False
-    print("[WARNING] Plugin system not available - no custom scripts")
+# Plugin system (sandboxed plugins in plugin_sandbox.py need no RestrictedPython)
+from plugin_runtime import (PLUGIN_COMPILER_VERSION, PLUGIN_POLICY, PLUGIN_SYSTEM_AVAILABLE, compile_plugin,
+                            run_code, run_trigger)
+if not PLUGIN_SYSTEM_AVAILABLE:
+    print("[WARNING] RestrictedPython not available - plugins run in subprocess sandboxes only")
 
 # Render compatibility
 if 'RENDER' in os.environ:
@@ -48,6 +59,22 @@ if 'RENDER' in os.environ:
 # Signal handler for graceful shutdown
 def signal_handler(sig, frame):
     print("[SHUTDOWN] Graceful shutdown initiated")
+    # Don't lose buffered chat messages
+    writer = globals().get('message_writer')
+    if writer:
+        writer.stop()
+    publisher = globals().get('output')
+    if publisher:
+        publisher.flush()
+    ingest = globals().get('memory_ingest')
+    if ingest:
+        ingest.stop()
+    pool = globals().get('sandbox_pool')
+    if pool:
+        pool.shutdown()
+    workers = globals().get('worker_pool')
+    if workers:
+        workers.shutdown()
     sys.exit(0)
 
 signal.signal(signal.SIGTERM, signal_handler)
@@ -56,40 +83,64 @@ signal.signal(signal.SIGINT, signal_handler)
 # ==========================================
 # GLOBAL VARIABLES (Ensure these are at the TOP of your file)
 # ==========================================
-current_room = "living_room"
-conv_history = []
-
-# Generate secure admin token
-admin_token = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+# Per-room conversation histories and each user's current room
+room_store = RoomStateStore(default_room="living_room")
 
 # Load Config with Render support
 load_dotenv()
+
+# Generate secure admin token (ADMIN_TOKEN shares one across cluster nodes)
+admin_token = os.getenv("ADMIN_TOKEN") or ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
 ZHIPU_API_KEY = os.getenv("ZHIPU_API_KEY")
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
 PORT = int(os.getenv("PORT", 10000))
+MQTT_BROKER = os.getenv("MQTT_BROKER", "broker.emqx.io")
+MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))
+# "threaded" (paho loop_forever + HTTPServer thread) or "async" (single asyncio loop)
+SERVICE_MODE = os.getenv("SERVICE_MODE", "threaded")
+# "auto" (MongoDB if reachable, else SQLite), "mongo", "sqlite" or "memory"
+MESSAGE_STORE = os.getenv("MESSAGE_STORE", "auto")
 
 # Database setup
 db = None
 vector_db = None
-vectorizer = None
+memory_ingest = None
 
-if MONGODB_AVAILABLE and MONGODB_URI:
+if MONGODB_AVAILABLE and MONGODB_URI and MESSAGE_STORE in ("auto", "mongo"):
     try:
-        mongo_client = MongoClient(MONGODB_URI)
+        mongo_client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=3000)
+        mongo_client.admin.command("ping")
         db = mongo_client.termchat
         print("[DATABASE] MongoDB connected successfully")
+        ensure_indexes(db.messages)
     except Exception as e:
         print(f"[DATABASE] MongoDB connection failed: {e}")
         db = None
-else:
+
+# Where chat messages live: Mongo collection, embedded SQLite, or nowhere
+message_collection = None
+if db is not None:
+    message_collection = db.messages
+elif MESSAGE_STORE in ("auto", "sqlite"):
+    try:
+        message_collection = SQLiteMessageStore()
+    except Exception as e:
+        print(f"[DATABASE] Embedded store failed: {e}")
+if message_collection is None:
     print("[DATABASE] Using memory storage (messages will not persist)")
 
+# Batched insert_many writer with local spill file while the store is down
+message_writer = MessageWriter(message_collection) if message_collection is not None else None
+# Per-room tail of recent messages, updated on every save
+message_tail = RoomTailCache()
+
 # Vector database setup for memory bank
 if VECTOR_DB_AVAILABLE:
     try:
-        chroma_client = chromadb.Client()
-        vector_db = chroma_client.get_or_create_collection(name="termai_memory")
-        vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
+        # Persistent, per-user partitioned vector index with local embeddings
+        vector_db = MemoryBank()
+        # Batched, deduplicating upserts with a per-user cap
+        memory_ingest = MemoryIngest(vector_db)
         print("[MEMORY] Vector database initialized")
     except Exception as e:
         print(f"[MEMORY] Vector database failed: {e}")
@@ -105,44 +156,84 @@ print(f"[CONFIG] API Key: {bool(ZHIPU_API_KEY)}")
 print(f"[CONFIG] Port: {PORT}")
 print(f"[CONFIG] Platform: {'Render' if 'RENDER' in os.environ else 'Local'}")
 
-# AI Client
-zhipu_client = ZhipuAI(api_key=ZHIPU_API_KEY) if ZHIPU_API_KEY else None
+# AI Client (shared pooled provider; None without ZHIPU_API_KEY)
+zhipu_client = get_provider("zhipu")
+
+# Publish replies as incremental "chunk" frames while the model is generating
+AI_STREAMING = os.getenv("AI_STREAMING", "false").lower() == "true"
+
+# Cache for repeated prompts (greetings, pings, FAQs)
+response_cache = ResponseCache()
 
 # Global State
-active_users = {}
+CHAT_TOPICS = ("termchat/input", "termchat/messages")
+rate_limiter = RateLimiter()
+# Live users on a timing wheel; join/leave events go out on termchat/presence
+active_users = PresenceTracker(
+    on_join=lambda user_id, online: (publish_presence("join", user_id, online),
+                                     trigger_plugins(connected_client, "user_join", {"user_id": user_id})),
+    on_leave=lambda user_id, online: (output.forget(user_id), publish_presence("leave", user_id, online)),
+)
+connected_client = None
+# One compact publish per frame on termchat/output (small system frames batched)
+output = OutputPublisher()
 admin_sessions = set()
 loaded_plugins = {}
 plugin_triggers = {}
 
 # Plugin system setup
-if PLUGIN_SYSTEM_AVAILABLE:
-    try:
-        docker_client = docker.from_env()
-        plugins_dir = os.path.join(os.getcwd(), 'plugins')
-        os.makedirs(plugins_dir, exist_ok=True)
-        print("[PLUGINS] Plugin system initialized")
-    except Exception as e:
-        print(f"[PLUGINS] Docker not available: {e}")
-        PLUGIN_SYSTEM_AVAILABLE = False
+plugins_dir = os.path.join(os.getcwd(), 'plugins')
+os.makedirs(plugins_dir, exist_ok=True)
+# Warm, rlimited worker interpreters per plugin (no Docker daemon needed)
+sandbox_pool = SandboxPool()
+# Restricted-compiled plugin code objects, keyed by source hash and compiler/policy
+plugin_code_cache = BytecodeCache(
+    os.path.join(plugins_dir, '__pycache__', 'restricted'),
+    salt=f"RestrictedPython {PLUGIN_COMPILER_VERSION} "
+         f"{getattr(PLUGIN_POLICY, '__module__', None)}.{getattr(PLUGIN_POLICY, '__qualname__', None)}")
+print("[PLUGINS] Plugin system initialized")
 
 # User activity cleanup task
+MAINTENANCE_INTERVAL = int(os.getenv("MAINTENANCE_INTERVAL", PRESENCE_TICK))
+ROOM_SWEEP_INTERVAL = 600
+last_room_sweep = time.time()
+
+def publish_presence(event, user_id, online):
+    """Announce a join/leave with the exact live-user count"""
+    if connected_client is None:
+        return
+    output.publish(connected_client, {
+        "type": event,
+        "user": user_id,
+        "online": online
+    }, topic="termchat/presence")
+
 def cleanup_inactive_users():
-    """Remove inactive users periodically"""
-    current_time = time.time()
-    inactive_users = []
-    
-    for user_id, data in active_users.items():
-        if current_time - data.get('last_message', 0) > 3600:  # 1 hour timeout
-            inactive_users.append(user_id)
-    
-    for user_id in inactive_users:
-        del active_users[user_id]
-        print(f"[CLEANUP] Removed inactive user: {user_id}")
+    """Expire idle users (only the due wheel slots) and, every 10 min, idle rooms"""
+    global last_room_sweep
+    inactive_users = active_users.expire()
+    if inactive_users:
+        print(f"[CLEANUP] Removed {len(inactive_users)} inactive users, {len(active_users)} online")
+
+    if cluster is not None and connected_client is not None:
+        cluster.heartbeat(connected_client)
 
-# Schedule cleanup every 10 minutes
+    if time.time() - last_room_sweep >= ROOM_SWEEP_INTERVAL:
+        last_room_sweep = time.time()
+        evicted = room_store.evict_idle(3600)
+        if evicted:
+            print(f"[CLEANUP] Evicted {evicted} idle room histories")
+
+# Run cleanup on one long-lived thread instead of a new Timer thread per cycle
 def start_cleanup_timer():
-    cleanup_inactive_users()
-    threading.Timer(600, start_cleanup_timer).start()
+    def loop():
+        while True:
+            time.sleep(MAINTENANCE_INTERVAL)
+            try:
+                cleanup_inactive_users()
+            except Exception as e:
+                print(f"[CLEANUP] Maintenance failed: {e}")
+    threading.Thread(target=loop, name="maintenance", daemon=True).start()
 
 # Room-Specific AI Prompts (Multilingual)
 ROOM_PROMPTS = {
@@ -159,6 +250,30 @@ ROOM_PROMPTS = {
     "think_tank": """You are AI Strategist. Solve problems, generate ideas, plan projects. Analyze and suggest solutions. IMPORTANT: Respond in the same language as the user's message."""
 }
 
+# Navigation keywords (matched as word prefixes, so inflections work too)
+NAV_KEYWORDS = {
+    "biblioteka": "library",
+    "studija": "studio", 
+    "dirbtuvės": "workshop",
+    "poilsio": "lounge",
+    "laboratorija": "think_tank"
+}
+
+ROOM_NAMES = {
+    "library": "📚 Biblioteka",
+    "studio": "🎨 Studija", 
+    "workshop": "💻 Dirbtuvės",
+    "lounge": "🎭 Poilsio kambarys",
+    "think_tank": "🧠 Laboratorija"
+}
+
+# Whole-word AI triggers ("ai" no longer fires inside "tai" or "laikas")
+AI_TRIGGERS = ["ai", "termai", "?"]
+
+message_router = MessageRouter()
+message_router.set_keywords("ai", {trigger: True for trigger in AI_TRIGGERS})
+message_router.set_keywords("nav", NAV_KEYWORDS, prefix=True)
+
 # AI Tools/Functions for Agentic Behavior
 AI_TOOLS = [
     {
@@ -208,179 +323,163 @@ AI_TOOLS = [
     }
 ]
 # Plugin System Functions
-def load_plugin(plugin_name, plugin_code, triggers=None):
-    """Load a plugin with restricted execution"""
-    if not PLUGIN_SYSTEM_AVAILABLE:
-        return False, "Plugin system not available"
+def load_plugin(plugin_name, plugin_code, triggers=None, sandboxed=False):
+    """Load a plugin with restricted execution (or in a subprocess sandbox)"""
+    if sandboxed or not PLUGIN_SYSTEM_AVAILABLE:
+        success, message = sandbox_pool.load(plugin_name, plugin_code)
+        if success:
+            register_plugin(plugin_name, plugin_code, {}, triggers, sandboxed=True)
+        return success, message
     
     try:
-        # Compile with restrictions
-        compiled_code = compile_restricted(plugin_code, filename=f"{plugin_name}.py", mode='exec')
-        if compiled_code.errors:
-            return False, f"Compilation errors: {compiled_code.errors}"
+        # Compile with restrictions (cached on disk by source hash)
+        code, errors = plugin_code_cache.compile(plugin_code, f"{plugin_name}.py", compile_plugin)
+        if errors:
+            return False, f"Compilation errors: {errors}"
         
-        # Create safe execution environment
-        safe_globals = {
-            '__builtins__': {
-                'print': print,
-                'len': len,
-                'str': str,
-                'int': int,
-                'float': float,
-                'bool': bool,
-                'list': list,
-                'dict': dict,
-                'range': range,
-                'enumerate': enumerate,
-                'zip': zip,
-            },
-            'json': json,
-            'time': time,
-            'random': random,
-        }
-        
-        # Execute plugin code
-        plugin_locals = {}
-        exec(compiled_code.code, safe_globals, plugin_locals)
-        
-        # Store plugin
-        loaded_plugins[plugin_name] = {
-            'code': plugin_code,
-            'locals': plugin_locals,
-            'triggers': triggers or [],
-            'active': True
-        }
-        
-        # Register triggers
-        if triggers:
-            for trigger in triggers:
-                if trigger not in plugin_triggers:
-                    plugin_triggers[trigger] = []
-                plugin_triggers[trigger].append(plugin_name)
-        
-        print(f"[PLUGINS] Loaded plugin: {plugin_name}")
+        # Execute plugin code (validates it; with --workers the triggers run in workers)
+        register_plugin(plugin_name, plugin_code, run_code(code), triggers)
         return True, "Plugin loaded successfully"
         
     except Exception as e:
         return False, f"Plugin execution error: {str(e)}"
 
-def execute_plugin_docker(plugin_name, plugin_code, input_data):
-    """Execute plugin in Docker container for maximum security"""
-    if not PLUGIN_SYSTEM_AVAILABLE:
-        return None
+def register_plugin(plugin_name, plugin_code, plugin_locals, triggers, sandboxed=False):
+    """Store a loaded plugin and register its triggers.
+
+    The entry is replaced in one assignment and trigger lists are rebuilt
+    rather than mutated, so a reload never leaves readers a half-registered
+    plugin; calls already running keep the handler they started with.
+    """
+    loaded_plugins[plugin_name] = {
+        'code': plugin_code,
+        'locals': plugin_locals,
+        'triggers': triggers or [],
+        'active': True,
+        'sandboxed': sandboxed
+    }
     
-    try:
-        # Create temporary script
-        script_content = f"""
-import json
-import sys
+    # Register triggers (dropping ones a reloaded version no longer has)
+    set_plugin_triggers(plugin_name, triggers or [])
+    
+    # A reloaded plugin starts with a clean budget record
+    plugin_dispatcher.enable(plugin_name)
+    print(f"[PLUGINS] Loaded plugin: {plugin_name}{' (sandboxed)' if sandboxed else ''}")
 
-# Plugin code
-{plugin_code}
+def set_plugin_triggers(plugin_name, triggers):
+    """Copy-on-write update of the trigger -> plugin names table"""
+    for trigger in set(plugin_triggers) | set(triggers):
+        names = [n for n in plugin_triggers.get(trigger, []) if n != plugin_name]
+        if trigger in triggers:
+            names.append(plugin_name)
+        if names:
+            plugin_triggers[trigger] = names
+        else:
+            plugin_triggers.pop(trigger, None)
+    refresh_plugin_keywords()
 
-# Input data
-input_data = {json.dumps(input_data)}
+def unload_plugin(plugin_name):
+    """Remove a plugin and its triggers"""
+    set_plugin_triggers(plugin_name, [])
+    loaded_plugins.pop(plugin_name, None)
+    sandbox_pool.unload(plugin_name)
 
-# Execute main function if exists
-if 'main' in locals():
-    result = main(input_data)
-    print(json.dumps(result))
-else:
-    print(json.dumps({{'error': 'No main function found'}}))
-"""
-        
-        # Run in Docker container
-        container = docker_client.containers.run(
-            'python:3.9-alpine',
-            f'python -c "{script_content}"',
-            remove=True,
-            network_mode='none',  # No network access
-            mem_limit='128m',     # Memory limit
-            cpu_period=100000,    # CPU limit
-            cpu_quota=50000,      # 50% CPU
-            timeout=10,           # 10 second timeout
-            capture_output=True,
-            text=True
-        )
-        
-        if container.returncode == 0:
-            return json.loads(container.stdout.strip())
-        else:
-            print(f"[PLUGINS] Docker execution error: {container.stderr}")
-            return {'error': container.stderr}
-            
-    except Exception as e:
-        print(f"[PLUGINS] Docker execution failed: {e}")
-        return {'error': str(e)}
+# Loads plugins/*.py at startup and hot-reloads them on change
+plugin_loader = PluginLoader(
+    plugins_dir,
+    lambda name, code, triggers, sandboxed: load_plugin(name, code, triggers, sandboxed=sandboxed),
+    unload_plugin
+)
 
-def trigger_plugins(trigger_type, data):
-    """Trigger plugins based on events"""
-    if trigger_type not in plugin_triggers:
-        return []
-    
-    results = []
-    for plugin_name in plugin_triggers[trigger_type]:
-        if plugin_name in loaded_plugins and loaded_plugins[plugin_name]['active']:
-            try:
-                plugin = loaded_plugins[plugin_name]
-                if 'handle_trigger' in plugin['locals']:
-                    result = plugin['locals']['handle_trigger'](trigger_type, data)
-                    results.append({'plugin': plugin_name, 'result': result})
-            except Exception as e:
-                print(f"[PLUGINS] Error in plugin {plugin_name}: {e}")
-    
-    return results
-    """Execute AI function calls"""
+def execute_plugin_sandboxed(plugin_name, plugin_code, input_data):
+    """Run a plugin's main(input_data) in a warm subprocess sandbox"""
     try:
-        if function_name == "play_music":
-            return {
-                "action": "play_music",
-                "url": arguments.get("url"),
-                "title": arguments.get("title")
-            }
-        elif function_name == "open_panel":
-            return {
-                "action": "open_panel",
-                "panel": arguments.get("panel"),
-                "data": arguments.get("data", {})
-            }
-        elif function_name == "remember_user_preference":
-            store_user_memory(user_id, arguments.get("category"), arguments.get("preference"))
-            return {"action": "memory_stored", "message": "Preference saved!"}
-        else:
-            return {"action": "error", "message": f"Unknown function: {function_name}"}
+        # Workers are started once per plugin (and again only if the code changes)
+        if not sandbox_pool.has(plugin_name, plugin_code):
+            success, message = sandbox_pool.load(plugin_name, plugin_code)
+            if not success:
+                return {'error': message}
+        return sandbox_pool.execute(plugin_name, None, input_data, op="main")
     except Exception as e:
-        return {"action": "error", "message": f"Function error: {str(e)}"}
+        print(f"[PLUGINS] Sandbox execution failed: {e}")
+        return {'error': str(e)}
+
+def refresh_plugin_keywords():
+    """Hot-reload "keyword:<word>" plugin triggers into the message router"""
+    keywords = {t.split(":", 1)[1]: t for t in plugin_triggers if t.startswith("keyword:")}
+    message_router.set_keywords("plugin", keywords)
+
+def publish_plugin_results(client, results):
+    """Publish send_message actions returned by plugins"""
+    if client is None:
+        return  # triggered (e.g. by a join) before the broker connection came up
+    for item in results:
+        result = item.get('result')
+        if isinstance(result, dict) and result.get('action') == 'send_message':
+            output.publish(client, {
+                "type": "chat",
+                "id": "PLUGIN",
+                "plugin": item['plugin'],
+                "msg": str(result.get('message', ''))[:500]
+            }, coalesce=True)
+
+def disable_plugin(plugin_name):
+    """Called by the dispatcher when a plugin keeps blowing its budget"""
+    plugin = loaded_plugins.get(plugin_name)
+    if plugin:
+        plugin['active'] = False
+
+# Concurrent fan-out with per-plugin wall/CPU budgets and auto-disable
+plugin_dispatcher = PluginDispatcher(on_disable=disable_plugin)
+
+def plugin_calls(trigger_type, data):
+    """(name, callable) pairs for every active plugin registered on a trigger"""
+    calls = []
+    for plugin_name in plugin_triggers.get(trigger_type, []):
+        plugin = loaded_plugins.get(plugin_name)
+        if not plugin or not plugin['active']:
+            continue
+        if plugin.get('sandboxed'):
+            calls.append((plugin_name, lambda name=plugin_name: sandbox_pool.execute(
+                name, trigger_type, data, timeout=plugin_dispatcher.deadline)))
+        elif 'handle_trigger' in plugin['locals'] and worker_pool is not None:
+            # --workers: off the supervisor's GIL, and killed with its worker on overrun
+            calls.append((plugin_name, lambda name=plugin_name, code=plugin['code']: worker_pool.call(
+                run_trigger, name, code, trigger_type, data, timeout=plugin_dispatcher.deadline)))
+        elif 'handle_trigger' in plugin['locals']:
+            handler = plugin['locals']['handle_trigger']
+            calls.append((plugin_name, lambda handler=handler: handler(trigger_type, data)))
+    return calls
+
+def trigger_plugins(client, trigger_type, data):
+    """Run the plugins registered on a trigger and publish their send_message results"""
+    calls = plugin_calls(trigger_type, data)
+    if calls:
+        # Collected off the calling thread; a slow plugin can't stall on_message
+        plugin_dispatcher.submit(calls, lambda results: publish_plugin_results(client, results))
 
 def store_user_memory(user_id, category, preference):
     """Store user preference in vector database"""
-    if vector_db and vectorizer:
+    if memory_ingest is not None:
         try:
             memory_text = f"{category}: {preference}"
-            vector_db.add(
-                documents=[memory_text],
-                metadatas=[{"user_id": user_id, "category": category, "timestamp": time.time()}],
-                ids=[f"{user_id}_{category}_{int(time.time())}"]
-            )
-            print(f"[MEMORY] Stored preference for {user_id}: {category} = {preference}")
+            memory_ingest.enqueue(user_id, category, memory_text)
+            print(f"[MEMORY] Queued preference for {user_id}: {category} = {preference}")
         except Exception as e:
             print(f"[MEMORY] Failed to store: {e}")
 
 def retrieve_user_memories(user_id, query, limit=3):
     """Retrieve relevant user memories"""
-    if vector_db:
+    if vector_db is not None:
         try:
-            results = vector_db.query(
-                query_texts=[query],
-                where={"user_id": user_id},
-                n_results=limit
-            )
-            return results.get('documents', [[]])[0]
+            # Only this user's partition is searched
+            return vector_db.query(user_id, query, limit)
         except Exception as e:
             print(f"[MEMORY] Failed to retrieve: {e}")
     return []
 
 def save_message_to_db(room, user_id, message_text, msg_type="chat"):
+    """Queue a chat message for batched write-behind persistence"""
     message_doc = {
         "room": room,
         "user_id": user_id,
@@ -390,66 +489,117 @@ def save_message_to_db(room, user_id, message_text, msg_type="chat"):
         "server_timestamp": time.time()
     }
     
-    if db:
-        try:
-            db.messages.insert_one(message_doc)
-            return True
-        except Exception as e:
-            print(f"[DATABASE] Failed to save message: {e}")
+    message_tail.add(message_doc)
+    if message_writer:
+        return message_writer.enqueue(message_doc)
     
     # Fallback to memory (existing behavior)
     return False
 
-def get_recent_messages(room, limit=50):
-    """Get recent messages from database"""
-    if db:
-        try:
-            messages = db.messages.find(
-                {"room": room}
-            ).sort("timestamp", -1).limit(limit)
-            return list(reversed(list(messages)))
-        except Exception as e:
-            print(f"[DATABASE] Failed to get messages: {e}")
+def get_recent_messages(room, limit=50, before=None):
+    """Get recent messages (oldest first); pass `before` (datetime or epoch) to page back"""
+    try:
+        return read_recent(message_collection, message_tail, room, limit, before)
+    except Exception as e:
+        print(f"[DATABASE] Failed to get messages: {e}")
     return []
+# Token-budgeted prompts: room prompt, memories, history and room activity
+context_builder = ContextBuilder(recent_messages=get_recent_messages, memories=retrieve_user_memories)
+
 def ai_call(messages, room):
     """AI API call with room context and function calling"""
     if not zhipu_client:
         return get_fallback_response(messages)
+
+    key = cache_key(messages)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
     
     try:
         # Enhanced AI call with function calling support
-        response = zhipu_client.chat.completions.create(
+        response = zhipu_client.chat(
+            messages,
             model="glm-4-flash",
-            messages=messages,
             tools=AI_TOOLS,
             temperature=0.7,
             max_tokens=300
         )
+        message = response["choices"][0]["message"]
         
         # Check if AI wants to call a function
-        if response.choices[0].message.tool_calls:
-            tool_call = response.choices[0].message.tool_calls[0]
-            function_name = tool_call.function.name
-            arguments = json.loads(tool_call.function.arguments)
-            
-            # Extract user_id from messages
-            user_id = "unknown"
-            for msg in reversed(messages):
-                if msg.get('role') == 'user' and ':' in msg.get('content', ''):
-                    user_id = msg['content'].split(':')[0]
-                    break
+        if message.get("tool_calls"):
+            tool_call = message["tool_calls"][0]
+            function_name = tool_call["function"]["name"]
+            arguments = json.loads(tool_call["function"]["arguments"])
             
             # Execute the function
-            function_result = execute_ai_function(function_name, arguments, user_id)
+            function_result = execute_ai_function(function_name, arguments, extract_user_id(messages))
             
-            # Return function result as action
+            # Return function result as action (never cached: it has side effects)
             return json.dumps(function_result)
         
-        return response.choices[0].message.content
+        reply = message.get("content")
+        response_cache.put(key, reply)
+        return reply
+    except Exception as e:
+        print(f"[AI ERROR] {e}")
+        return get_fallback_response(messages)
+
+def ai_call_stream(messages, room, on_delta):
+    """Streaming variant of ai_call; on_delta(text) is called for each content chunk"""
+    if not zhipu_client:
+        return get_fallback_response(messages)
+
+    key = cache_key(messages)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    try:
+        stream = zhipu_client.chat_stream(
+            messages,
+            model="glm-4-flash",
+            tools=AI_TOOLS,
+            temperature=0.7,
+            max_tokens=300
+        )
+
+        parts = []
+        function_name, arguments = None, []
+        for chunk in stream:
+            if not chunk.get("choices"):
+                continue
+            delta = chunk["choices"][0].get("delta", {})
+            if delta.get("tool_calls"):
+                # Tool calls arrive as name + argument fragments; run them at the end
+                call = delta["tool_calls"][0].get("function", {})
+                function_name = call.get("name") or function_name
+                if call.get("arguments"):
+                    arguments.append(call["arguments"])
+            elif delta.get("content"):
+                parts.append(delta["content"])
+                on_delta(delta["content"])
+
+        if function_name:
+            function_result = execute_ai_function(
+                function_name, json.loads(''.join(arguments) or '{}'), extract_user_id(messages))
+            return json.dumps(function_result)
+
+        reply = ''.join(parts)
+        response_cache.put(key, reply)
+        return reply
     except Exception as e:
         print(f"[AI ERROR] {e}")
         return get_fallback_response(messages)
 
+def extract_user_id(messages):
+    """Find the sender of the latest 'user_id: text' turn"""
+    for msg in reversed(messages):
+        if msg.get('role') == 'user' and ':' in msg.get('content', ''):
+            return msg['content'].split(':')[0]
+    return "unknown"
+
 def get_fallback_response(messages):
     """Multilingual fallback AI responses"""
     if not messages:
@@ -484,16 +634,18 @@ def get_fallback_response(messages):
 
 def handle_admin(payload):
     """Enhanced admin command handler with plugin support"""
-    global current_room, conv_history
-    
     try:
         # Try to parse as JSON for plugin uploads
         data = json.loads(payload)
         if data.get('action') == 'upload_plugin':
+            # Plugin code runs on the server: same token as every other admin command
+            if data.get('token') != admin_token:
+                return "INVALID TOKEN. Access Denied."
             success, message = load_plugin(
                 data.get('name'),
                 data.get('code'),
-                data.get('triggers', [])
+                data.get('triggers', []),
+                sandboxed=data.get('sandboxed', False)
             )
             return f"Plugin upload: {message}"
     except json.JSONDecodeError:
@@ -511,9 +663,15 @@ def handle_admin(payload):
     cmd = parts[1]
     if cmd == "status":
         plugin_count = len(loaded_plugins)
-        return f"Users: {len(active_users)}, Room: {current_room}, History: {len(conv_history)}, Plugins: {plugin_count}"
+        rooms = room_store.stats()
+        return f"Users: {len(active_users)}, Default room: {room_store.default_room}, Rooms: {rooms['rooms']}, History: {rooms['messages']}, Plugins: {plugin_count}"
     elif cmd == "reset":
-        conv_history = []
+        if len(parts) > 2:
+            room_store.clear(parts[2])
+            context_builder.invalidate(parts[2])
+            return f"Room {parts[2]} reset complete"
+        room_store.clear()
+        context_builder.invalidate()
         return "System reset complete"
     elif cmd == "plugins":
         if not loaded_plugins:
@@ -522,16 +680,29 @@ def handle_admin(payload):
         for name, plugin in loaded_plugins.items():
             status = "ACTIVE" if plugin['active'] else "INACTIVE"
             triggers = ", ".join(plugin['triggers']) if plugin['triggers'] else "None"
-            plugin_list.append(f"{name} ({status}) - Triggers: {triggers}")
+            line = f"{name} ({status}) - Triggers: {triggers}"
+            timing = plugin_dispatcher.plugin_status(name)
+            if timing and timing['calls']:
+                line += (f" - p50 {timing['p50']}ms p95 {timing['p95']}ms p99 {timing['p99']}ms,"
+                         f" calls {timing['calls']}, errors {timing['errors']},"
+                         f" over budget {timing['overruns']}, late {timing['late']}")
+            plugin_list.append(line)
         return "Loaded plugins:\n" + "\n".join(plugin_list)
     elif cmd.startswith("room") and len(parts) > 2:
         new_room = parts[2]
         if new_room in ROOM_PROMPTS:
-            current_room = new_room
-            return f"Room changed to: {new_room}"
+            room_store.default_room = new_room
+            return f"Default room changed to: {new_room}"
         return f"Invalid room: {new_room}"
+    elif cmd == "cache":
+        if len(parts) > 2 and parts[2] == "clear":
+            response_cache.clear()
+            return "AI response cache cleared"
+        return f"AI cache: {response_cache.stats()}"
     elif cmd == "users":
-        return f"Active users: {list(active_users.keys())}"
+        shown = active_users.user_ids(limit=50)
+        more = len(active_users) - len(shown)
+        return f"Active users ({len(active_users)}): {shown}" + (f" (+{more} more)" if more > 0 else "")
     else:
         return f"Unknown command: {cmd}"
 
@@ -565,73 +736,107 @@ def execute_ai_function(function_name, arguments, user_id):
     except Exception as e:
         return {"action": "error", "message": f"Function error: {str(e)}"}
 
-def on_disconnect(client, userdata, flags, reason_code, properties=None):
-    print(f"[MQTT] Disconnected. Code: {reason_code}. Reconnecting...")
-    time.sleep(5)
-    try:
-        client.reconnect()
-        print("[MQTT] Reconnected successfully")
-    except Exception as e:
-        print(f"[MQTT] Reconnect failed: {e}. Will retry...")
+SERVICE_TOPICS = ("termchat/input", "termchat/messages", "termchat/admin", "termchat/tunnel/+", "termchat/room/+")
 
 def on_connect(client, u, flags, rc, p=None):
+    global connected_client
+    connected_client = client
     print(f"[MQTT] Connected. Code: {rc}")
-    client.subscribe("termchat/input")
-    client.subscribe("termchat/messages")
-    client.subscribe("termchat/admin")
-    client.subscribe("termchat/tunnel/+")
-    client.subscribe("termchat/room/+")
+    # Clustered: shared subscriptions, so each message reaches one node of the group
+    topics = cluster.subscriptions(SERVICE_TOPICS) if cluster is not None else SERVICE_TOPICS
+    for topic in topics:
+        client.subscribe(topic)
+    if cluster is not None:
+        cluster.connected(client)
 
 # ==========================================
 # CORRECTED FUNCTION
 # ==========================================
 
+def is_display_mirror(topic, raw):
+    """index_clean.html echoes each line to termchat/messages as {user, text}
+    for other browsers to show; the same line also arrives on termchat/input"""
+    if topic != "termchat/messages" or b'"text"' not in raw:
+        return False
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return False
+    return isinstance(data, dict) and "text" in data and "msg" not in data
+
 def on_message(client, userdata, message, properties=None):
-    # 1. DECLARE GLOBALS AT THE VERY START
-    global current_room, conv_history
     topic = message.topic
-    payload = message.payload.decode()
+    raw = message.payload
+    hops = 0
+
+    # Display copies are not input: storing them would duplicate every line as user "unknown"
+    if is_display_mirror(topic, raw):
+        return
+
+    if cluster is not None:
+        if cluster.is_cluster_topic(topic):
+            forwarded = cluster.receive(client, topic, raw)
+            if forwarded is None:
+                return
+            topic, raw, hops = forwarded
+        if topic in CHAT_TOPICS and hops < CLUSTER_MAX_HOPS:
+            # Room state lives on the room's owner; hand the message over untouched
+            owner = cluster.owner(room_store.get_user_room(peek_user_id(raw)))
+            if owner != cluster.node_id:
+                cluster.forward(client, owner, topic, raw, hops)
+                return
+
+    # Rate limiting runs on the raw bytes so floods are rejected before any parsing
+    if topic in CHAT_TOPICS:
+        allowed, limited_id = rate_limiter.admit(topic, raw, room_store.get_user_room)
+        if not allowed:
+            return
+
+    payload = raw.decode()
     
     try:
         # Parse JSON if possible
         data = json.loads(payload)
         user_id = data.get("id", "unknown")
         message_text = data.get("msg", payload)
+        # Output encoding the client can read ("msgpack" or "json")
+        requested_encoding = data.get("enc")
     except:
         # Fallback to plain text
         user_id = "system"
         message_text = payload
+        requested_encoding = None
+
+    if topic in CHAT_TOPICS and user_id != limited_id:
+        # The peek saw a different "id" than json.loads keeps (it takes the last duplicate)
+        allowed, _ = rate_limiter.admit(topic, raw, room_store.get_user_room, user_id=user_id)
+        if not allowed:
+            return
 
     print(f"[MQTT] {topic}: {user_id} -> {message_text[:50]}...")
 
     # Handle both termchat/input and termchat/messages topics
-    if topic in ["termchat/input", "termchat/messages"]:
+    if topic in CHAT_TOPICS:
         # Validate message content
         if len(message_text) > 500:
             print(f"[SECURITY] Message too long from {user_id}: {len(message_text)} chars")
             return
             
-        # Rate limiting per user
-        current_time = time.time()
-        if user_id in active_users:
-            last_msg_time = active_users[user_id].get('last_message', 0)
-            if current_time - last_msg_time < 1:  # 1 second cooldown
-                print(f"[RATE_LIMIT] User {user_id} sending too fast")
-                return
-        
-        # Update user activity
-        active_users[user_id] = {
-            'last_message': current_time,
-            'message_count': active_users.get(user_id, {}).get('message_count', 0) + 1
-        }
+        # Update user activity (O(1); first message publishes a join)
+        active_users.touch(user_id)
+        if requested_encoding:
+            output.set_encoding(user_id, requested_encoding)
         
     elif topic == "termchat/admin":
         resp = handle_admin(message_text)
-        client.publish("termchat/output", json.dumps({
+        if cluster is not None:
+            # Resets, room changes and plugin uploads apply on every node
+            cluster.broadcast(client, "admin", payload=message_text)
+        output.publish(client, {
             "type": "admin",
             "id": "ADMIN",
             "msg": resp
-        }))
+        }, coalesce=True)
         return
 
     # 3. TUNNEL & VIDEO (Pass-through)
@@ -641,152 +846,244 @@ def on_message(client, userdata, message, properties=None):
 
     # 4. NAVIGATION (Room Switching)
     text_lower = message_text.lower()
-    nav_map = {
-        "biblioteka": "library",
-        "studija": "studio", 
-        "dirbtuvės": "workshop",
-        "poilsio": "lounge",
-        "laboratorija": "think_tank"
-    }
-    for keyword, room_name in nav_map.items():
-        if keyword in text_lower:
-            current_room = room_name
-            conv_history = []  # Clear memory
-            
-            room_names = {
-                "library": "📚 Biblioteka",
-                "studio": "🎨 Studija", 
-                "workshop": "💻 Dirbtuvės",
-                "lounge": "🎭 Poilsio kambarys",
-                "think_tank": "🧠 Laboratorija"
-            }
-            
-            client.publish("termchat/output", json.dumps({
-                "type": "navigation",
-                "id": "TERMOS",
-                "msg": f"Įėjote į: {room_names.get(room_name, room_name)}",
-                "room": room_name
-            }))
-            return
+    # One pass over all AI triggers, nav keywords and plugin words
+    route = message_router.route(text_lower)
+    if "nav" in route:
+        room_name = route["nav"][0]
+        # Only this user moves; other rooms keep their history
+        room_store.set_user_room(user_id, room_name)
+        if cluster is not None:
+            cluster.broadcast(client, "move", user=user_id, room=room_name)
+        
+        output.publish(client, {
+            "type": "navigation",
+            "id": "TERMOS",
+            "msg": f"Įėjote į: {ROOM_NAMES.get(room_name, room_name)}",
+            "room": room_name
+        }, coalesce=True)
+        return
 
     # 5. AI / GAME / APP GENERATION
     # Check for simple ping test first
     if message_text.lower().strip() == "test ping":
-        client.publish("termchat/output", json.dumps({
+        output.publish(client, {
             "type": "chat",
             "id": "SYSTEM",
             "msg": "Pong! Backend is working correctly."
-        }))
+        }, coalesce=True)
         return
     
+    # Persist the chat line (buffered, flushed in batches off this thread)
+    save_message_to_db(room_store.get_user_room(user_id), user_id, message_text)
+
+    # Plugins registered for every chat line and for "keyword:<word>" triggers
+    for trigger in ["message"] + route.get("plugin", []):
+        trigger_plugins(client, trigger, {
+            "user_id": user_id,
+            "message": message_text
+        })
+
     # Check if AI should respond
-    ai_triggers = ["ai", "termai", "?"]
-    should_respond = any(trigger in text_lower for trigger in ai_triggers)
+    should_respond = "ai" in route
     
     if should_respond:
+        current_room = room_store.get_user_room(user_id)
+
         # Get System Prompt for current room
         system_content = ROOM_PROMPTS.get(current_room, ROOM_PROMPTS["living_room"])
         # Add JSON constraint for specific rooms
         if current_room in ["workshop", "studio", "lounge"]:
             system_content += " IMPORTANT: If creating app/game, return ONLY JSON."
 
-        sys_msg = {"role": "system", "content": system_content}
-        conv_history.append({"role": "user", "content": f"{user_id}: {message_text}"})
-        
-        # FORCE CLEANUP: Never keep more than 10 items in memory total
-        if len(conv_history) > 10:
-            conv_history = conv_history[-10:]
-            
-        messages_to_send = [sys_msg] + conv_history[-10:]
-        
-        # Enhanced error handling and logging
-        try:
-            reply = ai_call(messages_to_send, current_room)
-            
-            # Validate AI response
-            if not reply or len(reply) > 1000:
-                reply = "AI response error or too long"
-            
-            # Check if response is JSON (for apps/games)
-            try:
-                json_response = json.loads(reply)
-                if json_response.get("type") in ["app", "game"]:
-                    # Send as special JSON message
-                    client.publish("termchat/output", json.dumps({
-                        "type": "creation",
-                        "id": "TERMAI",
-                        "msg": "Sukūriau jums:",
-                        "creation": json_response
-                    }))
-                    conv_history.append({"role": "assistant", "content": reply})
-                    return
-            except json.JSONDecodeError:
-                pass  # Not JSON, send as regular message
-            
-            # Sanitize AI response
-            if reply.startswith("AI Error:"):
-                reply = get_fallback_response(messages_to_send)
-            
-            reply = str(reply).replace('<', '&lt;').replace('>', '&gt;')[:500]
-            
-            client.publish("termchat/output", json.dumps({
-                "type": "chat",
-                "id": "TERMAI", 
-                "msg": reply
-            }))
-            # Also publish to messages topic for compatibility
-            client.publish("termchat/messages", json.dumps({
-                "user": "TERMAI",
-                "text": reply
-            }))
-            conv_history.append({"role": "assistant", "content": reply})
-            
-        except Exception as e:
-            error_msg = f"AI Error: {str(e)[:100]}"
-            print(f"[ERROR] AI Failed: {e}")
-            client.publish("termchat/output", json.dumps({
+        room_store.append(current_room, user_id, {"role": "user", "content": f"{user_id}: {message_text}"})
+
+        # Prompt assembly (memory lookup, token budgeting) happens on the worker
+        job = {"client": client, "user_id": user_id, "room": current_room, "system": system_content,
+               "history": room_store.snapshot(current_room, user_id), "query": message_text}
+        if not rate_limiter.allow_ai_call() or not ai_dispatcher.submit(job):
+            output.publish(client, {
                 "type": "chat",
                 "id": "TERMAI",
-                "msg": error_msg
-            }))
-            client.publish("termchat/messages", json.dumps({
-                "user": "TERMAI",
-                "text": error_msg
-            }))
-
-class CustomHTTPRequestHandler(SimpleHTTPRequestHandler):
+                "msg": "TERMAI is busy right now, please try again in a moment."
+            })
+
+def process_ai_job(job):
+    """Run one AI call on a dispatcher worker and publish the reply"""
+    client = job["client"]
+    messages_to_send = context_builder.build(job["room"], job["system"], job["history"],
+                                             user_id=job["user_id"], query=job["query"])
+
+    # Streaming: chunk frames share a msg_id and increasing seq, then one "done" frame
+    msg_id = uuid.uuid4().hex[:12] if AI_STREAMING and zhipu_client else None
+    seq = 0
+    streamed = 0
+
+    def on_delta(text):
+        nonlocal seq, streamed
+        text = text.replace('<', '&lt;').replace('>', '&gt;')[:500 - streamed]
+        if not text:
+            return
+        streamed += len(text)
+        output.publish(client, {
+            "type": "chunk",
+            "id": "TERMAI",
+            "msg_id": msg_id,
+            "seq": seq,
+            "msg": text
+        })
+        seq += 1
+
+    def publish_final(msg, compat=False, **extra):
+        if msg_id:
+            frame = {"type": "done", "id": "TERMAI", "msg_id": msg_id, "seq": seq, "msg": msg}
+        else:
+            frame = {"type": "chat", "id": "TERMAI", "msg": msg}
+        frame.update(extra)
+        output.publish(client, frame, compat=compat)
+
+    # Enhanced error handling and logging
+    try:
+        if msg_id:
+            reply = ai_call_stream(messages_to_send, job["room"], on_delta)
+        else:
+            reply = ai_call(messages_to_send, job["room"])
+
+        # Validate AI response
+        if not reply or len(reply) > 1000:
+            reply = "AI response error or too long"
+
+        # Check if response is JSON (for apps/games)
+        try:
+            json_response = json.loads(reply)
+            if json_response.get("type") in ["app", "game"]:
+                # Send as special JSON message
+                output.publish(client, {
+                    "type": "creation",
+                    "id": "TERMAI",
+                    "msg": "Sukūriau jums:",
+                    "creation": json_response
+                })
+                if msg_id:
+                    publish_final("Sukūriau jums:", creation=True)
+                room_store.append(job["room"], job["user_id"], {"role": "assistant", "content": reply})
+                return
+        except json.JSONDecodeError:
+            pass  # Not JSON, send as regular message
+
+        # Sanitize AI response
+        if reply.startswith("AI Error:"):
+            reply = get_fallback_response(messages_to_send)
+
+        reply = str(reply).replace('<', '&lt;').replace('>', '&gt;')[:500]
+
+        # Mirrored to termchat/messages only with OUTPUT_COMPAT_BRIDGE=true
+        publish_final(reply, compat=True)
+        save_message_to_db(job["room"], "TERMAI", reply, msg_type="ai")
+        room_store.append(job["room"], job["user_id"], {"role": "assistant", "content": reply})
+
+    except Exception as e:
+        error_msg = f"AI Error: {str(e)[:100]}"
+        print(f"[ERROR] AI Failed: {e}")
+        publish_final(error_msg, compat=True)
+
+# AI worker pool (sized by AI_WORKERS / AI_QUEUE_DEPTH)
+ai_dispatcher = AIDispatcher(process_ai_job)
+
+# CPU-bound work in separate processes with --workers N (started in __main__)
+worker_pool = None
+
+def apply_cluster_event(kind, event):
+    """Apply another node's move/admin event to this node's state"""
+    if kind == "move":
+        if isinstance(event.get("user"), str) and event.get("room") in ROOM_PROMPTS:
+            room_store.set_user_room(event["user"], event["room"])
+    elif kind == "admin":
+        resp = handle_admin(str(event.get("payload", "")))
+        print(f"[CLUSTER] Admin from {event['node']}: {resp[:80]}")
+
+# One node of a CLUSTER_GROUP; None when running standalone
+cluster = ClusterNode(on_event=apply_cluster_event, forward_topics=CHAT_TOPICS) if CLUSTER_ENABLED else None
+
+# Persistent-session client with backoff reconnects; publishes made while
+# offline are queued and replayed. Callbacks receive it as `client`.
+if cluster is not None:
+    # Shared subscriptions need MQTT v5. A clean session per connect: while a
+    # node is away the group's other members take its share, and a
+    # persistent session would sit on the broker holding $share messages.
+    # The random suffix keeps others from kicking the node off by reusing its id.
+    mqtt_connection = MQTTConnection(on_connect=on_connect, on_message=on_message,
+                                     client_id=f"termchat-{cluster.node_id}-{uuid.uuid4().hex[:8]}",
+                                     protocol="5", persistent=False)
+    cluster.attach(mqtt_connection)
+else:
+    mqtt_connection = MQTTConnection(on_connect=on_connect, on_message=on_message)
+
+def health_page():
+    """HTML body for /health (shared by the threaded and asyncio front ends)"""
+    return f"""
+            <h1>TermOS LT - God Mode Backend</h1>
+            <p>Status: ONLINE</p>
+            <p>Default Room: {room_store.default_room}</p>
+            <p>Active Users: {len(active_users)}</p>
+            <p>Presence: {active_users.stats()}</p>
+            <p>Rooms: {room_store.stats()}</p>
+            <p>AI Queue: {ai_dispatcher.status()}</p>
+            <p>Rate Limits: {rate_limiter.status()}</p>
+            <p>AI Cache: {response_cache.stats()}</p>
+            <p>Message Writer: {message_writer.status() if message_writer else 'disabled'}</p>
+            <p>Plugin Sandbox: {sandbox_pool.status()}</p>
+            <p>Plugin Dispatch: {plugin_dispatcher.status()}</p>
+            <p>Output: {output.status()}</p>
+            <p>MQTT: {mqtt_connection.status()}</p>
+            <p>Cluster: {cluster.status() if cluster is not None else 'standalone'}</p>
+            <p>Worker Processes: {worker_pool.status() if worker_pool is not None else 'in-process'}</p>
+            <p>HTTP: {http_server.status() if http_server else 'async'}</p>
+            <p>Static Assets: {static_assets.status()}</p>
+            <p>Context Builder: {context_builder.status()}</p>
+            <p>Memory Bank: {vector_db.status() if vector_db is not None else 'disabled'}</p>
+            <p>Memory Ingest: {memory_ingest.status() if memory_ingest is not None else 'disabled'}</p>
+            <p>Plugin Loader: {plugin_loader.status()} cache {plugin_code_cache.stats}</p>
+            <p>AI Provider: {zhipu_client.status() if zhipu_client else 'local fallback'}</p>
+            """
+
+# PWA assets preloaded with gzip/brotli variants and ETags
+static_assets = StaticAssets(os.getcwd())
+
+# Rendered at most once a second however often Render polls
+health_cache = CachedHealth(health_page)
+http_server = None
+
+class CustomHTTPRequestHandler(KeepAliveMixin, SimpleHTTPRequestHandler):
     """Custom Handler to Explicitly Serve index.html"""
     def do_GET(self):
-        # EXPLICITLY SERVE INDEX.HTML (now in root directory)
-        if self.path == '/':
-            try:
-                with open("index.html", "rb") as f:
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/html')
-                    self.end_headers()
-                    self.wfile.write(f.read())
-                    print(f"[HTTP] Served index.html successfully.")
-                    return
-            except FileNotFoundError:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"404 Not Found: index.html missing (checked root directory).")
-        elif self.path == '/health':
+        if self.path == '/health':
             # Health check endpoint
+            body = health_cache.get()
             self.send_response(200)
             self.send_header('Content-type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
             self.end_headers()
-            status = f"""
-            <h1>TermOS LT - God Mode Backend</h1>
-            <p>Status: ONLINE</p>
-            <p>Current Room: {current_room}</p>
-            <p>Active Users: {len(active_users)}</p>
-            <p>Conversation History: {len(conv_history)} messages</p>
-            """
-            self.wfile.write(status.encode())
+            self.wfile.write(body)
         else:
-            # Serve static files
-            super().do_GET()
+            # index.html and other static files from memory
+            self.send_static()
+
+    def do_HEAD(self):
+        self.send_static(head=True)
+
+    def send_static(self, head=False):
+        status, reason, headers, body, file_path = static_assets.respond(self.path, self.headers, head)
+        self.send_response(status, reason)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if file_path:
+            # Zero-copy for large identity bodies
+            self.wfile.flush()
+            with open(file_path, 'rb') as f:
+                self.connection.sendfile(f)
+        elif body:
+            self.wfile.write(body)
 
     def do_POST(self):
         """Handle POST requests for remote shell and other features"""
@@ -842,21 +1139,62 @@ class CustomHTTPRequestHandler(SimpleHTTPRequestHandler):
 # ==========================================
 # 6. STARTUP
 # ==========================================
+def parse_args(argv=None):
+    """Command line: --workers N and --async (both also settable from the environment)"""
+    def count(value):
+        try:
+            workers = int(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"expected a whole number, got {value!r}")
+        if workers < 0:
+            raise argparse.ArgumentTypeError("must be 0 or more")
+        return workers
+
+    parser = argparse.ArgumentParser(description="TermChat MQTT backend")
+    parser.add_argument("--workers", type=count, default=SERVICE_WORKERS, metavar="N",
+                        help="worker processes for restricted plugin triggers and batched memory "
+                             "embedding (default: SERVICE_WORKERS or 0)")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="run MQTT, AI, HTTP and maintenance on one event loop")
+    return parser.parse_args(argv)
+
 if __name__ == '__main__':
+    args = parse_args()
+    if args.workers > 0:
+        # This process keeps the broker connection; plugin triggers and memory-ingest
+        # embedding batches run on the other cores (recall queries stay in-process)
+        worker_pool = ProcessWorkerPool(args.workers)
+        worker_pool.start()
+        if vector_db is not None:
+            vector_db.embedder = PooledEmbedder(worker_pool, vector_db.dim)
+
+    if message_writer:
+        message_writer.start()
+    if memory_ingest is not None:
+        memory_ingest.start()
+    plugin_loader.start()
+
+    if SERVICE_MODE == "async" or args.use_async:
+        # MQTT, AI, HTTP and maintenance all on one event loop
+        import async_service
+        async_service.run(sys.modules[__name__])
+        sys.exit(0)
+
     # Start Web Server
     try:
-        server = HTTPServer(('0.0.0.0', PORT), CustomHTTPRequestHandler)
-        threading.Thread(target=server.serve_forever, daemon=True).start()
-        print(f"[HTTP] Server running on {PORT}")
+        # Bounded worker pool with keep-alive; /health answered even when saturated
+        http_server = FrontEndServer(('0.0.0.0', PORT), CustomHTTPRequestHandler, health=health_cache)
+        threading.Thread(target=http_server.serve_forever, daemon=True).start()
+        print(f"[HTTP] Server running on {PORT} ({http_server.workers} workers)")
     except Exception as e:
         print(f"[ERROR] HTTP Server failed: {e}")
 
-    # Start MQTT
-    mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
-    mqtt_client.on_connect = on_connect
-    mqtt_client.on_message = on_message
+    # Start AI workers before any message can arrive
+    ai_dispatcher.start()
+    start_cleanup_timer()
+
+    # Start MQTT (retries the first connection too, with backoff)
     try:
-        mqtt_client.connect("broker.emqx.io", 1883, 60)
-        mqtt_client.loop_forever()
+        mqtt_connection.run_forever(MQTT_BROKER, MQTT_PORT)
     except Exception as e:
         print(f"[ERROR] MQTT Connection failed: {e}")
\ No newline at end of file
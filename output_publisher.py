@@ -0,0 +1,190 @@
+"""Serialize-once, coalescing publisher for service output
+
+Every frame goes out once, on one canonical topic (termchat/output), as
+compact UTF-8 JSON: no spaces after separators, and no \\uXXXX escapes, so
+Lithuanian text costs 2 bytes a letter instead of 6. The old second copy of
+each AI reply on termchat/messages ({"user", "text"} schema) is only sent
+when OUTPUT_COMPAT_BRIDGE=true.
+
+Small system frames (navigation, admin, pings, plugin messages) can be
+coalesced. Frames published within OUTPUT_COALESCE_MS of each other go out
+as one {"type": "batch", "frames": [...]} message, or as-is when only one
+arrived. Windows are closed by the event loop in async mode (bind_loop)
+and otherwise by one shared flusher thread, never a thread per window.
+index_clean.html unpacks batches and assembles "chunk"/"done" streams.
+
+Publishing goes through the client it is handed. For the service that is
+the MQTTConnection, which moves publishes made off the event loop's thread
+onto the loop.
+
+Clients that send "enc": "msgpack" in their input are remembered while they
+are online. While any such client is present, each frame is also published
+in msgpack on termchat/output/msgpack, if the msgpack package is installed.
+"""
+import heapq
+import json
+import os
+import threading
+import time
+
+try:
+    import msgpack
+except ImportError:  # JSON only
+    msgpack = None
+
+OUTPUT_TOPIC = os.getenv("OUTPUT_TOPIC", "termchat/output")
+OUTPUT_COMPAT_TOPIC = os.getenv("OUTPUT_COMPAT_TOPIC", "termchat/messages")
+OUTPUT_COMPAT_BRIDGE = os.getenv("OUTPUT_COMPAT_BRIDGE", "false").lower() == "true"
+OUTPUT_COALESCE_MS = float(os.getenv("OUTPUT_COALESCE_MS", 50))
+OUTPUT_BATCH_MAX = int(os.getenv("OUTPUT_BATCH_MAX", 32))
+
+_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def encode(frame):
+    """Compact UTF-8 JSON bytes for a frame"""
+    return _encoder.encode(frame).encode('utf-8')
+
+
+class OutputPublisher:
+    """Publishes frames once per topic, with optional batching and msgpack mirror"""
+
+    def __init__(self, topic=OUTPUT_TOPIC, compat_topic=OUTPUT_COMPAT_TOPIC,
+                 compat_bridge=OUTPUT_COMPAT_BRIDGE, coalesce_ms=OUTPUT_COALESCE_MS,
+                 batch_max=OUTPUT_BATCH_MAX):
+        self.topic = topic
+        self.binary_topic = topic + "/msgpack"
+        self.compat_topic = compat_topic
+        self.compat_bridge = compat_bridge
+        self.window = coalesce_ms / 1000.0
+        self.batch_max = batch_max
+        self.pending = {}  # (client id, topic) -> [client, topic, frames, token]
+        self.binary_clients = set()
+        self.lock = threading.Lock()
+        # Window deadlines for the flusher thread: (due, key, token)
+        self.due = []
+        self.wakeup = threading.Condition(self.lock)
+        self.flusher = None
+        self.loop = None
+        self.stats = {'frames': 0, 'publishes': 0, 'bytes': 0, 'batches': 0, 'coalesced': 0,
+                      'compat': 0, 'binary': 0}
+
+    def _send(self, client, topic, frame):
+        payload = encode(frame)
+        client.publish(topic, payload)
+        published = 1
+        size = len(payload)
+        if self.binary_clients and msgpack is not None and topic == self.topic:
+            binary = msgpack.packb(frame, default=str)
+            client.publish(self.binary_topic, binary)
+            published += 1
+            size += len(binary)
+            self.stats['binary'] += 1
+        with self.lock:
+            self.stats['publishes'] += published
+            self.stats['bytes'] += size
+
+    def publish(self, client, frame, topic=None, coalesce=False, compat=False):
+        """Publish one frame.
+
+        coalesce=True lets it wait up to the coalescing window to share a
+        message with other small frames; compat=True mirrors it to the
+        legacy topic when the bridge is on.
+        """
+        topic = topic or self.topic
+        with self.lock:
+            self.stats['frames'] += 1
+        if compat and self.compat_bridge:
+            client.publish(self.compat_topic, encode({"user": frame.get("id"), "text": frame.get("msg")}))
+            with self.lock:
+                self.stats['compat'] += 1
+                self.stats['publishes'] += 1
+
+        if not coalesce or self.window <= 0:
+            self._send(client, topic, frame)
+            return
+
+        key = (id(client), topic)
+        flush_now = None
+        token = None
+        with self.lock:
+            entry = self.pending.get(key)
+            if entry is None:
+                # The token ties the deadline to this window, not a later one for the same key
+                token = object()
+                self.pending[key] = [client, topic, [frame], token]
+                if self.loop is None:
+                    self._start_flusher()
+                    heapq.heappush(self.due, (time.monotonic() + self.window, id(token), key, token))
+                    self.wakeup.notify()
+            else:
+                entry[2].append(frame)
+                self.stats['coalesced'] += 1
+                if len(entry[2]) >= self.batch_max:
+                    flush_now = self.pending.pop(key)
+        if token is not None and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.call_later, self.window, self._flush, key, token)
+        if flush_now:
+            self._emit(*flush_now[:3])
+
+    def bind_loop(self, loop):
+        """Async mode: close coalescing windows with loop.call_later instead of the flusher thread"""
+        self.loop = loop
+
+    def _start_flusher(self):
+        # Called with the lock held
+        if self.flusher is None:
+            self.flusher = threading.Thread(target=self._run_flusher, name="output-flusher", daemon=True)
+            self.flusher.start()
+
+    def _run_flusher(self):
+        while True:
+            with self.lock:
+                while not self.due or self.due[0][0] > time.monotonic():
+                    self.wakeup.wait(self.due[0][0] - time.monotonic() if self.due else None)
+                _, _, key, token = heapq.heappop(self.due)
+            try:
+                self._flush(key, token)
+            except Exception as e:
+                # One bad publish must not stop every later window from closing
+                print(f"[OUTPUT] Flush failed: {e}")
+
+    def _flush(self, key, token):
+        with self.lock:
+            entry = self.pending.get(key)
+            if entry is None or entry[3] is not token:
+                return  # already sent (batch_max or flush())
+            del self.pending[key]
+        self._emit(*entry[:3])
+
+    def _emit(self, client, topic, frames):
+        if len(frames) == 1:
+            self._send(client, topic, frames[0])
+            return
+        with self.lock:
+            self.stats['batches'] += 1
+        self._send(client, topic, {"type": "batch", "frames": frames})
+
+    def flush(self):
+        """Send everything still waiting in a coalescing window"""
+        with self.lock:
+            entries = list(self.pending.values())
+            self.pending.clear()
+            self.due.clear()
+        for entry in entries:
+            self._emit(*entry[:3])
+
+    def set_encoding(self, user_id, encoding):
+        """Record a client's requested encoding ("msgpack" or "json")"""
+        if encoding == "msgpack" and msgpack is not None:
+            self.binary_clients.add(user_id)
+        else:
+            self.binary_clients.discard(user_id)
+
+    def forget(self, user_id):
+        self.binary_clients.discard(user_id)
+
+    def status(self):
+        with self.lock:
+            return dict(self.stats, binary_clients=len(self.binary_clients),
+                        compat_bridge=self.compat_bridge, msgpack=msgpack is not None)
@@ -0,0 +1,175 @@
+"""Concurrent, time-boxed plugin trigger fan-out
+
+Every plugin registered for a trigger runs on a shared thread pool at the
+same time, and fan_out() returns whatever finished before the deadline. Each
+call is measured against a wall-time and a CPU-time budget (CPU is the
+calling thread's thread_time(), so it covers in-process plugins; sandboxed
+plugins are bounded by the sandbox timeout and rlimits instead, and plugins
+run in --workers processes by the worker timeout). A plugin
+that goes over budget PLUGIN_MAX_STRIKES times in a row is disabled through
+the on_disable callback.
+
+Threads cannot be killed, so an in-process plugin stuck in a loop keeps its
+pool thread; disabling it stops further calls from piling up behind it.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+PLUGIN_DISPATCH_WORKERS = int(os.getenv("PLUGIN_DISPATCH_WORKERS", 8))
+PLUGIN_DEADLINE = float(os.getenv("PLUGIN_DEADLINE", 2.0))
+PLUGIN_WALL_BUDGET = float(os.getenv("PLUGIN_WALL_BUDGET", 0.5))
+PLUGIN_CPU_BUDGET = float(os.getenv("PLUGIN_CPU_BUDGET", 0.25))
+PLUGIN_MAX_STRIKES = int(os.getenv("PLUGIN_MAX_STRIKES", 3))
+PLUGIN_BACKLOG = int(os.getenv("PLUGIN_BACKLOG", 64))
+PLUGIN_LATENCY_SAMPLES = 256
+
+
+class PluginStats:
+    __slots__ = ("calls", "errors", "late", "overruns", "strikes", "disabled", "latencies")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.late = 0
+        self.overruns = 0
+        self.strikes = 0
+        self.disabled = False
+        self.latencies = deque(maxlen=PLUGIN_LATENCY_SAMPLES)  # milliseconds
+
+    def percentiles(self):
+        samples = sorted(self.latencies)
+        if not samples:
+            return {}
+        pick = lambda q: round(samples[min(len(samples) - 1, int(q * len(samples)))], 1)
+        return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99)}
+
+
+class PluginDispatcher:
+    """Runs plugin calls concurrently with per-plugin budgets and latency tracking"""
+
+    def __init__(self, workers=PLUGIN_DISPATCH_WORKERS, deadline=PLUGIN_DEADLINE,
+                 wall_budget=PLUGIN_WALL_BUDGET, cpu_budget=PLUGIN_CPU_BUDGET,
+                 max_strikes=PLUGIN_MAX_STRIKES, backlog=PLUGIN_BACKLOG, on_disable=None):
+        self.deadline = deadline
+        self.wall_budget = wall_budget
+        self.cpu_budget = cpu_budget
+        self.max_strikes = max_strikes
+        self.on_disable = on_disable
+        self.calls = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="plugin")
+        # Fan-outs started from the MQTT thread wait for their deadline here
+        self.collectors = ThreadPoolExecutor(max_workers=2, thread_name_prefix="plugin-collect")
+        self.backlog = threading.BoundedSemaphore(max(1, backlog))
+        self.plugins = {}
+        self.lock = threading.Lock()
+        self.shed = 0
+
+    def _stats(self, name):
+        stats = self.plugins.get(name)
+        if stats is None:
+            stats = self.plugins[name] = PluginStats()
+        return stats
+
+    def _run(self, name, fn):
+        started = time.perf_counter()
+        cpu_started = time.thread_time()
+        error = None
+        try:
+            result = fn()
+        except Exception as e:
+            error = e
+            result = {'error': str(e)}
+        wall = time.perf_counter() - started
+        cpu = time.thread_time() - cpu_started
+
+        disable = False
+        with self.lock:
+            stats = self._stats(name)
+            stats.calls += 1
+            stats.latencies.append(wall * 1000)
+            if error is not None:
+                stats.errors += 1
+            if wall > self.wall_budget or cpu > self.cpu_budget:
+                stats.overruns += 1
+                stats.strikes += 1
+                if stats.strikes >= self.max_strikes and not stats.disabled:
+                    stats.disabled = disable = True
+            else:
+                stats.strikes = 0
+
+        if error is not None:
+            print(f"[PLUGINS] Error in plugin {name}: {error}")
+        if disable:
+            print(f"[PLUGINS] {name} over budget {self.max_strikes}x in a row "
+                  f"(wall {wall:.3f}s, cpu {cpu:.3f}s), disabling")
+            if self.on_disable:
+                self.on_disable(name)
+        return result
+
+    def fan_out(self, calls, deadline=None):
+        """Run (name, fn) pairs concurrently; results that finished within the deadline"""
+        deadline = self.deadline if deadline is None else deadline
+        futures = {}
+        for name, fn in calls:
+            with self.lock:
+                if self._stats(name).disabled:
+                    continue
+            futures[self.calls.submit(self._run, name, fn)] = name
+        if not futures:
+            return []
+
+        done, pending = wait(futures, timeout=deadline)
+        if pending:
+            with self.lock:
+                for future in pending:
+                    self._stats(futures[future]).late += 1
+            print(f"[PLUGINS] {len(pending)} plugin(s) missed the {deadline:.1f}s deadline: "
+                  f"{', '.join(futures[f] for f in pending)}")
+        # Keep registration order rather than completion order
+        return [{'plugin': futures[f], 'result': f.result()} for f in futures if f in done]
+
+    def submit(self, calls, on_results, deadline=None):
+        """fan_out() off the caller's thread, then on_results(results). False if shed."""
+        if not self.backlog.acquire(blocking=False):
+            with self.lock:
+                self.shed += 1
+            print("[PLUGINS] Dispatch backlog full, shedding trigger")
+            return False
+
+        def collect():
+            try:
+                on_results(self.fan_out(calls, deadline))
+            except Exception as e:
+                print(f"[PLUGINS] Result handling failed: {e}")
+            finally:
+                self.backlog.release()
+
+        self.collectors.submit(collect)
+        return True
+
+    def enable(self, name):
+        """Clear a plugin's strikes and disabled flag (e.g. after a reload)"""
+        with self.lock:
+            stats = self._stats(name)
+            stats.strikes = 0
+            stats.disabled = False
+
+    def plugin_status(self, name):
+        with self.lock:
+            stats = self.plugins.get(name)
+            if stats is None:
+                return None
+            return dict(stats.percentiles(), calls=stats.calls, errors=stats.errors, late=stats.late,
+                        overruns=stats.overruns, disabled=stats.disabled)
+
+    def status(self):
+        with self.lock:
+            return {'plugins': len(self.plugins), 'shed': self.shed,
+                    'disabled': sorted(n for n, s in self.plugins.items() if s.disabled),
+                    'deadline': self.deadline, 'wall_budget': self.wall_budget, 'cpu_budget': self.cpu_budget}
+
+    def shutdown(self):
+        self.collectors.shutdown(wait=False)
+        self.calls.shutdown(wait=False)
@@ -0,0 +1,247 @@
+"""Plugin directory loader: startup scan, hot reload, restricted bytecode cache
+
+Every *.py in plugins/ is loaded at startup and reloaded when it changes on
+disk. Restricted compilation is the slow part, so compiled code objects are
+marshalled to plugins/__pycache__/restricted/<sha256>.bin keyed by the source
+hash, the interpreter's bytecode magic and a salt naming the compiler
+version and policy (so upgrading RestrictedPython or tightening the policy
+never reuses old bytecode); a restart or an unchanged re-save skips the
+compiler entirely.
+
+A plugin file may declare its registration up front:
+
+    TRIGGERS = ['user_join', 'keyword:labas']
+    SANDBOXED = True
+
+These are read with ast.literal_eval, so the loader never runs plugin code
+itself. Reloads go through the service's load function, which swaps the
+plugin entry in one assignment; triggers already running keep the handler
+they started with.
+
+Change notifications come from watchdog when it is installed and from an
+mtime poll otherwise.
+"""
+import ast
+import hashlib
+import importlib.util
+import marshal
+import os
+import threading
+import time
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # fall back to polling the directory
+    Observer = None
+    FileSystemEventHandler = object
+
+PLUGIN_RELOAD_DEBOUNCE = float(os.getenv("PLUGIN_RELOAD_DEBOUNCE", 0.3))
+PLUGIN_POLL_INTERVAL = float(os.getenv("PLUGIN_POLL_INTERVAL", 2.0))
+
+
+class BytecodeCache:
+    """Compiled code objects on disk, keyed by a hash of the source
+
+    salt identifies everything besides the source that shapes the bytecode
+    (compiler version, restriction policy).
+    """
+
+    def __init__(self, cache_dir, salt=""):
+        self.cache_dir = cache_dir
+        self.salt = salt
+        os.makedirs(cache_dir, exist_ok=True)
+        self.stats = {'hits': 0, 'misses': 0, 'write_errors': 0}
+
+    def key(self, source, filename):
+        digest = hashlib.sha256(importlib.util.MAGIC_NUMBER)
+        digest.update(self.salt.encode('utf-8') + b'\0')
+        digest.update(filename.encode('utf-8') + b'\0')
+        digest.update(source.encode('utf-8'))
+        return digest.hexdigest()
+
+    def compile(self, source, filename, compile_fn):
+        """compile_fn(source, filename) -> (code, errors); cached when errors is empty"""
+        path = os.path.join(self.cache_dir, self.key(source, filename) + ".bin")
+        try:
+            with open(path, 'rb') as f:
+                code = marshal.load(f)
+            self.stats['hits'] += 1
+            return code, None
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+
+        self.stats['misses'] += 1
+        code, errors = compile_fn(source, filename)
+        if code is not None and not errors:
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp, 'wb') as f:
+                    marshal.dump(code, f)
+                os.replace(tmp, path)
+            except (OSError, ValueError) as e:
+                self.stats['write_errors'] += 1
+                print(f"[PLUGINS] Could not cache bytecode for {filename}: {e}")
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+        return code, errors
+
+
+def read_declarations(source):
+    """TRIGGERS / SANDBOXED literals from a plugin's top level (without running it)"""
+    declared = {}
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return declared
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            if name in ("TRIGGERS", "SANDBOXED"):
+                try:
+                    declared[name] = ast.literal_eval(node.value)
+                except ValueError:
+                    print(f"[PLUGINS] {name} must be a literal, ignoring")
+    return declared
+
+
+class _ChangeHandler(FileSystemEventHandler):
+    def __init__(self, loader):
+        self.loader = loader
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        for path in (getattr(event, 'src_path', None), getattr(event, 'dest_path', None)):
+            if path:
+                self.loader.schedule(path)
+
+
+class PluginLoader:
+    """Loads plugins/*.py through load_fn and keeps them in sync with the directory.
+
+    load_fn(name, source, triggers, sandboxed) -> (ok, message)
+    unload_fn(name) removes a plugin whose file was deleted.
+    """
+
+    def __init__(self, plugins_dir, load_fn, unload_fn):
+        self.plugins_dir = plugins_dir
+        self.load_fn = load_fn
+        self.unload_fn = unload_fn
+        self.hashes = {}  # name -> sha256 of the loaded source
+        self.pending = set()
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.observer = None
+        self.stats = {'loaded': 0, 'reloaded': 0, 'unloaded': 0, 'failed': 0, 'skipped': 0}
+
+    def _plugin_name(self, path):
+        directory, filename = os.path.split(os.path.abspath(path))
+        if directory != os.path.abspath(self.plugins_dir):
+            return None
+        name, ext = os.path.splitext(filename)
+        if ext != ".py" or name.startswith(("_", ".")):
+            return None
+        return name
+
+    def sync(self, name):
+        """Load, reload or unload one plugin to match its file"""
+        path = os.path.join(self.plugins_dir, name + ".py")
+        try:
+            with open(path, encoding='utf-8') as f:
+                source = f.read()
+        except FileNotFoundError:
+            if self.hashes.pop(name, None) is not None:
+                self.unload_fn(name)
+                self.stats['unloaded'] += 1
+                print(f"[PLUGINS] Unloaded {name} (file removed)")
+            return
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"[PLUGINS] Cannot read {path}: {e}")
+            self.stats['failed'] += 1
+            return
+
+        digest = hashlib.sha256(source.encode('utf-8')).hexdigest()
+        if self.hashes.get(name) == digest:
+            self.stats['skipped'] += 1  # touched or re-saved without changes
+            return
+
+        declared = read_declarations(source)
+        triggers = declared.get("TRIGGERS") or []
+        success, message = self.load_fn(name, source, list(triggers), bool(declared.get("SANDBOXED")))
+        if not success:
+            # Keep the previous version running
+            self.stats['failed'] += 1
+            print(f"[PLUGINS] {name} not (re)loaded: {message}")
+            return
+        self.stats['reloaded' if name in self.hashes else 'loaded'] += 1
+        self.hashes[name] = digest
+
+    def scan(self):
+        """Load every plugin file (startup) and drop plugins whose file is gone"""
+        names = set()
+        if os.path.isdir(self.plugins_dir):
+            for filename in sorted(os.listdir(self.plugins_dir)):
+                name = self._plugin_name(os.path.join(self.plugins_dir, filename))
+                if name:
+                    names.add(name)
+        for name in sorted(names | set(self.hashes)):
+            self.sync(name)
+
+    def schedule(self, path):
+        name = self._plugin_name(path)
+        if name:
+            with self.lock:
+                self.pending.add(name)
+            self.wakeup.set()
+
+    def _reload_loop(self):
+        while True:
+            self.wakeup.wait()
+            # Editors write in several steps; let the burst settle
+            time.sleep(PLUGIN_RELOAD_DEBOUNCE)
+            with self.lock:
+                self.wakeup.clear()
+                names, self.pending = self.pending, set()
+            for name in sorted(names):
+                try:
+                    self.sync(name)
+                except Exception as e:
+                    print(f"[PLUGINS] Reload of {name} failed: {e}")
+
+    def _poll_loop(self):
+        mtimes = {}
+        while True:
+            time.sleep(PLUGIN_POLL_INTERVAL)
+            try:
+                entries = {e.path: e.stat().st_mtime for e in os.scandir(self.plugins_dir) if e.is_file()}
+            except OSError:
+                continue
+            for path in set(entries) | set(mtimes):
+                if entries.get(path) != mtimes.get(path):
+                    self.schedule(path)
+            mtimes = entries
+
+    def start(self):
+        """Initial scan, then watch the directory for changes"""
+        self.scan()
+        threading.Thread(target=self._reload_loop, name="plugin-reload", daemon=True).start()
+        if Observer is not None:
+            self.observer = Observer()
+            self.observer.daemon = True
+            self.observer.schedule(_ChangeHandler(self), self.plugins_dir, recursive=False)
+            self.observer.start()
+            mode = "watchdog"
+        else:
+            threading.Thread(target=self._poll_loop, name="plugin-poll", daemon=True).start()
+            mode = f"polling every {PLUGIN_POLL_INTERVAL:g}s"
+        print(f"[PLUGINS] Watching {self.plugins_dir} ({mode}), {len(self.hashes)} plugin(s) loaded")
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+
+    def status(self):
+        return dict(self.stats, plugins=len(self.hashes), watching=self.observer is not None)
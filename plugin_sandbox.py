@@ -0,0 +1,346 @@
+"""Warm subprocess sandboxes for plugin execution
+
+Each plugin gets long-lived worker interpreters (`python -I plugin_sandbox.py`)
+that load its code once and then answer JSON-line jobs on stdin/stdout.
+
+Isolation:
+- Workers start in a fresh network namespace (`unshare --net`, or
+  `unshare --user --map-root-user --net` when not root), so they have no
+  network access at all.
+- They get a scrubbed environment (no API keys, no ADMIN_TOKEN) and an
+  empty temporary working directory.
+- Before touching plugin code the worker sets its own rlimits: address
+  space, CPU seconds, no file writes, few descriptors and no new processes.
+  A worker started as root first drops to nobody, because the kernel does
+  not apply RLIMIT_NPROC to root.
+- When namespaces are unavailable (not Linux, or unprivileged user
+  namespaces are disabled), sandboxes refuse to start unless
+  PLUGIN_SANDBOX_REQUIRE_ISOLATION=false.
+
+A job that overruns its timeout gets its worker killed and replaced, and
+workers are recycled after PLUGIN_WORKER_MAX_JOBS jobs.
+
+No Docker daemon is needed, and a warm call costs one pipe round-trip
+instead of a container start.
+"""
+import importlib
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows: no rlimits, process isolation + timeout only
+    resource = None
+
+PLUGIN_WORKERS_PER_PLUGIN = int(os.getenv("PLUGIN_WORKERS_PER_PLUGIN", 1))
+PLUGIN_TIMEOUT = float(os.getenv("PLUGIN_TIMEOUT", 2.0))
+PLUGIN_MEMORY_MB = int(os.getenv("PLUGIN_MEMORY_MB", 128))
+PLUGIN_CPU_SECONDS = int(os.getenv("PLUGIN_CPU_SECONDS", 30))
+PLUGIN_WORKER_MAX_JOBS = int(os.getenv("PLUGIN_WORKER_MAX_JOBS", 500))
+PLUGIN_SANDBOX_REQUIRE_ISOLATION = os.getenv("PLUGIN_SANDBOX_REQUIRE_ISOLATION", "true").lower() == "true"
+# Unprivileged account a root-started worker switches to
+PLUGIN_SANDBOX_UID = int(os.getenv("PLUGIN_SANDBOX_UID", 65534))
+# Imported before a root-started worker drops privileges, in case the
+# interpreter's stdlib isn't readable by PLUGIN_SANDBOX_UID
+PLUGIN_SANDBOX_PRELOAD = os.getenv(
+    "PLUGIN_SANDBOX_PRELOAD",
+    "collections,datetime,functools,hashlib,itertools,math,random,re,statistics,string,textwrap")
+
+_isolation = None
+_isolation_lock = threading.Lock()
+
+
+def isolation_prefix():
+    """Command prefix that puts a worker in its own network namespace, or None"""
+    global _isolation
+    with _isolation_lock:
+        if _isolation is None:
+            _isolation = []
+            unshare = shutil.which("unshare")
+            if unshare and sys.platform.startswith("linux"):
+                for flags in (["--net"], ["--user", "--map-root-user", "--net"]):
+                    if flags[0] == "--net" and os.geteuid() != 0:
+                        continue
+                    try:
+                        probe = subprocess.run([unshare, *flags, "true"], capture_output=True, timeout=5)
+                    except (OSError, subprocess.SubprocessError):
+                        continue
+                    if probe.returncode == 0:
+                        _isolation = [unshare, *flags, "--"]
+                        break
+            if not _isolation:
+                print("[SANDBOX] No network namespace available (unshare)")
+        return _isolation or None
+
+
+def _sandbox_env():
+    """The whole environment a worker sees: nothing from the service's"""
+    return {"PATH": os.defpath, "LANG": "C.UTF-8", "LC_ALL": "C.UTF-8"}
+
+
+class SandboxWorker:
+    """One warm interpreter with a single plugin loaded"""
+
+    def __init__(self, plugin_name, code, memory_mb=PLUGIN_MEMORY_MB, cpu_seconds=PLUGIN_CPU_SECONDS,
+                 prefix=()):
+        self.plugin_name = plugin_name
+        self.jobs = 0
+        self.lines = queue.Queue()
+        self.workdir = tempfile.mkdtemp(prefix="termchat-sandbox-")
+        if hasattr(os, "geteuid") and os.geteuid() == 0:
+            os.chown(self.workdir, PLUGIN_SANDBOX_UID, PLUGIN_SANDBOX_UID)
+        # Limits are applied by the worker itself (no preexec_fn: unsafe in a threaded parent)
+        self.proc = subprocess.Popen(
+            [*prefix, sys.executable, "-I", os.path.abspath(__file__), str(memory_mb), str(cpu_seconds)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=None,
+            cwd=self.workdir, env=_sandbox_env(), start_new_session=True,
+            text=True, encoding="utf-8", bufsize=1
+        )
+        threading.Thread(target=self._read, daemon=True).start()
+        self.loaded = self._request({"op": "load", "name": plugin_name, "code": code}, PLUGIN_TIMEOUT * 5)
+
+    def _read(self):
+        for line in self.proc.stdout:
+            self.lines.put(line)
+        self.lines.put(None)
+
+    def _request(self, message, timeout):
+        try:
+            self.proc.stdin.write(json.dumps(message) + "\n")
+            self.proc.stdin.flush()
+            line = self.lines.get(timeout=timeout)
+        except queue.Empty:
+            self.kill()
+            return {"ok": False, "error": f"timeout after {timeout:.2f}s"}
+        except (OSError, ValueError) as e:
+            self.kill()
+            return {"ok": False, "error": f"worker unavailable: {e}"}
+        if line is None:
+            self.kill()
+            return {"ok": False, "error": "worker exited (memory or CPU limit?)"}
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError:
+            return {"ok": False, "error": "bad worker response"}
+
+    def call(self, op, trigger, data, timeout):
+        self.jobs += 1
+        return self._request({"op": op, "trigger": trigger, "data": data}, timeout)
+
+    @property
+    def alive(self):
+        return self.proc.poll() is None
+
+    def kill(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+            try:
+                self.proc.wait(1)
+            except subprocess.TimeoutExpired:
+                pass
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class SandboxPool:
+    """Per-plugin pools of warm SandboxWorkers"""
+
+    def __init__(self, workers_per_plugin=PLUGIN_WORKERS_PER_PLUGIN, timeout=PLUGIN_TIMEOUT,
+                 max_jobs=PLUGIN_WORKER_MAX_JOBS, require_isolation=PLUGIN_SANDBOX_REQUIRE_ISOLATION):
+        self.workers_per_plugin = max(1, workers_per_plugin)
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self.require_isolation = require_isolation
+        self.plugins = {}  # name -> {'code': str, 'idle': Queue}
+        self.lock = threading.Lock()
+        self.stats = {'calls': 0, 'timeouts': 0, 'errors': 0, 'recycled': 0, 'spawned': 0,
+                      'load_failed': 0}
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _spawn(self, name, code):
+        worker = SandboxWorker(name, code, prefix=isolation_prefix() or ())
+        self._count('spawned')
+        if not worker.loaded.get("ok"):
+            self._count('load_failed')
+            worker.kill()
+        return worker
+
+    @property
+    def available(self):
+        return isolation_prefix() is not None or not self.require_isolation
+
+    def load(self, name, code):
+        """Start warm workers for a plugin (replacing any old ones)"""
+        if not self.available:
+            return False, ("Sandbox refused: no network isolation on this host "
+                           "(set PLUGIN_SANDBOX_REQUIRE_ISOLATION=false to allow)")
+        worker = self._spawn(name, code)
+        if not worker.loaded.get("ok"):
+            return False, f"Sandbox load failed: {worker.loaded.get('error')}"
+        idle = queue.Queue()
+        idle.put(worker)
+        for _ in range(self.workers_per_plugin - 1):
+            # Only workers that loaded the plugin get calls
+            extra = self._spawn(name, code)
+            if extra.loaded.get("ok"):
+                idle.put(extra)
+        with self.lock:
+            old = self.plugins.get(name)
+            self.plugins[name] = {'code': code, 'idle': idle}
+        if old:
+            self._drain(old)
+        print(f"[SANDBOX] {name}: {idle.qsize()} warm worker(s) ready")
+        return True, "Plugin loaded in sandbox"
+
+    def _drain(self, entry):
+        while True:
+            try:
+                entry['idle'].get_nowait().kill()
+            except queue.Empty:
+                return
+
+    def unload(self, name):
+        with self.lock:
+            entry = self.plugins.pop(name, None)
+        if entry:
+            self._drain(entry)
+
+    def has(self, name, code=None):
+        entry = self.plugins.get(name)
+        return entry is not None and (code is None or entry['code'] == code)
+
+    def execute(self, name, trigger, data, op="call", timeout=None):
+        """Run handle_trigger (op='call') or main (op='main') in a warm worker"""
+        timeout = self.timeout if timeout is None else timeout
+        entry = self.plugins.get(name)
+        if entry is None:
+            return {'error': f"Plugin {name} not loaded in sandbox"}
+        started = time.time()
+        try:
+            worker = entry['idle'].get(timeout=timeout)
+        except queue.Empty:
+            self._count('timeouts')
+            return {'error': 'All sandbox workers busy'}
+
+        self._count('calls')
+        response = worker.call(op, trigger, data, max(0.01, timeout - (time.time() - started)))
+
+        if not response.get("ok"):
+            self._count('timeouts' if "timeout" in str(response.get("error")) else 'errors')
+        if not worker.alive or worker.jobs >= self.max_jobs:
+            if worker.alive:
+                self._count('recycled')
+            worker.kill()
+            worker = self._spawn(name, entry['code'])
+        if worker.loaded.get("ok") and self.plugins.get(name) is entry:
+            entry['idle'].put(worker)
+        else:
+            worker.kill()  # failed to load, or the plugin was reloaded meanwhile
+
+        if response.get("ok"):
+            return response.get("result")
+        return {'error': response.get("error")}
+
+    def status(self):
+        with self.lock:
+            plugins = {name: entry['idle'].qsize() for name, entry in self.plugins.items()}
+            stats = dict(self.stats)
+        return dict(stats, idle_workers=plugins, isolated=isolation_prefix() is not None)
+
+    def shutdown(self):
+        with self.lock:
+            entries = list(self.plugins.values())
+            self.plugins.clear()
+        for entry in entries:
+            self._drain(entry)
+
+
+# ==========================================
+# Worker process
+# ==========================================
+def _in_user_namespace():
+    """True under `unshare --user`: uid 0 there is the unprivileged caller"""
+    try:
+        with open("/proc/self/uid_map") as f:
+            return f.read().split() != ["0", "0", "4294967295"]
+    except OSError:
+        return False
+
+
+def _confine(memory_mb, cpu_seconds):
+    """Drop root and set rlimits; runs in the worker before any plugin code"""
+    if resource is None:
+        return
+    if os.geteuid() == 0 and not _in_user_namespace():
+        for module in filter(None, PLUGIN_SANDBOX_PRELOAD.split(",")):
+            try:
+                importlib.import_module(module.strip())
+            except ImportError:
+                pass
+        os.setgroups([])
+        os.setgid(PLUGIN_SANDBOX_UID)
+        os.setuid(PLUGIN_SANDBOX_UID)
+    limits = [
+        (resource.RLIMIT_AS, memory_mb * 1024 * 1024),
+        (resource.RLIMIT_CPU, cpu_seconds),
+        (resource.RLIMIT_FSIZE, 0),
+        (resource.RLIMIT_NOFILE, 16),
+    ]
+    if hasattr(resource, "RLIMIT_NPROC"):
+        limits.append((resource.RLIMIT_NPROC, 0))
+    for limit, value in limits:
+        try:
+            resource.setrlimit(limit, (value, value))
+        except (ValueError, OSError):
+            pass
+
+
+def worker_main():
+    """Serve JSON-line jobs for one plugin until stdin closes"""
+    if len(sys.argv) == 3:
+        _confine(int(sys.argv[1]), int(sys.argv[2]))
+    proto = sys.stdout
+    sys.stdout = sys.stderr  # plugin print() must not corrupt the protocol
+    namespace = None
+
+    for line in sys.stdin:
+        try:
+            job = json.loads(line)
+            op = job.get("op")
+            if op == "load":
+                namespace = {"__name__": f"plugin_{job.get('name')}"}
+                exec(compile(job["code"], f"{job.get('name')}.py", "exec"), namespace)
+                reply = {"ok": True}
+            elif namespace is None:
+                reply = {"ok": False, "error": "no plugin loaded"}
+            elif op == "main":
+                if "main" not in namespace:
+                    reply = {"ok": False, "error": "No main function found"}
+                else:
+                    reply = {"ok": True, "result": namespace["main"](job.get("data"))}
+            else:
+                handler = namespace.get("handle_trigger")
+                if handler is None:
+                    reply = {"ok": False, "error": "No handle_trigger function found"}
+                else:
+                    reply = {"ok": True, "result": handler(job.get("trigger"), job.get("data") or {})}
+            out = json.dumps(reply, default=str)
+        except MemoryError:
+            out = json.dumps({"ok": False, "error": "memory limit exceeded"})
+        except Exception as e:
+            out = json.dumps({"ok": False, "error": f"{type(e).__name__}: {e}"})
+        proto.write(out + "\n")
+        proto.flush()
+
+
+if __name__ == '__main__':
+    worker_main()
@@ -1,6 +1,11 @@
 # Example Plugin: Auto Greeter
 # This plugin automatically greets new users when they join
 
+# Read by plugin_loader.py when the file is loaded from plugins/
+# Not 'message': replies are broadcast to the room, so greeting back on
+# every chat line would spam everyone. Add it only for a private setup.
+TRIGGERS = ['user_join']
+
 def handle_trigger(trigger_type, data):
     """Handle plugin triggers"""
     if trigger_type == 'user_join':
@@ -11,8 +16,9 @@ def handle_trigger(trigger_type, data):
             'target': 'all'
         }
     elif trigger_type == 'message':
-        message = data.get('message', '').lower()
-        if 'hello' in message or 'hi' in message:
+        # Whole words only: "this" and "think" are not greetings
+        words = data.get('message', '').lower().replace('!', ' ').replace(',', ' ').split()
+        if 'hello' in words or 'hi' in words:
             return {
                 'action': 'send_message', 
                 'message': 'Hello there! Nice to meet you! 👋',
@@ -0,0 +1,119 @@
+"""User presence tracking on a timing wheel
+
+Replaces the hourly full scan of active_users. touch() is a dict lookup plus
+a timestamp write; expiry only visits the wheel slots whose time has come.
+Records are rescheduled lazily: a user who was active again since being
+slotted is moved to the slot of their new deadline when the old one fires,
+so each record sits in exactly one slot and touch never has to move it.
+"""
+import math
+import os
+import threading
+import time
+
+PRESENCE_TIMEOUT = int(os.getenv("PRESENCE_TIMEOUT", 3600))
+PRESENCE_TICK = int(os.getenv("PRESENCE_TICK", 10))
+
+
+class UserPresence:
+    __slots__ = ("user_id", "first_seen", "last_seen", "message_count")
+
+    def __init__(self, user_id, now):
+        self.user_id = user_id
+        self.first_seen = now
+        self.last_seen = now
+        self.message_count = 1
+
+
+class PresenceTracker:
+    """Tracks live users; on_join/on_leave(user_id, online_count) fire outside the lock"""
+
+    def __init__(self, timeout=PRESENCE_TIMEOUT, tick=PRESENCE_TICK, on_join=None, on_leave=None):
+        self.timeout = timeout
+        self.tick = tick
+        self.size = math.ceil(timeout / tick) + 1
+        self.slots = [[] for _ in range(self.size)]
+        self.users = {}
+        self.cursor = int(time.time() // tick)
+        self.on_join = on_join
+        self.on_leave = on_leave
+        self.lock = threading.Lock()
+        self.joins = 0
+        self.leaves = 0
+
+    def _schedule(self, record):
+        slot_tick = max(int((record.last_seen + self.timeout) // self.tick), self.cursor + 1)
+        self.slots[slot_tick % self.size].append(record)
+
+    def touch(self, user_id, now=None):
+        """Mark a user active. Returns the record (O(1))."""
+        now = time.time() if now is None else now
+        with self.lock:
+            record = self.users.get(user_id)
+            if record is not None:
+                record.last_seen = now
+                record.message_count += 1
+                return record
+            record = self.users[user_id] = UserPresence(user_id, now)
+            self._schedule(record)
+            self.joins += 1
+            online = len(self.users)
+        if self.on_join:
+            self.on_join(user_id, online)
+        return record
+
+    def leave(self, user_id):
+        """Explicitly remove a user; their wheel entry is skipped when it fires"""
+        with self.lock:
+            if self.users.pop(user_id, None) is None:
+                return False
+            self.leaves += 1
+            online = len(self.users)
+        if self.on_leave:
+            self.on_leave(user_id, online)
+        return True
+
+    def expire(self, now=None):
+        """Advance the wheel to `now` and drop users idle for `timeout`. Returns expired ids."""
+        now = time.time() if now is None else now
+        target = int(now // self.tick)
+        expired = []
+        with self.lock:
+            # Each slot only needs visiting once however long we were away
+            self.cursor = max(self.cursor, target - self.size)
+            while self.cursor < target:
+                self.cursor += 1
+                index = self.cursor % self.size
+                due, self.slots[index] = self.slots[index], []
+                for record in due:
+                    if self.users.get(record.user_id) is not record:
+                        continue  # left or re-joined since
+                    if record.last_seen + self.timeout <= now:
+                        del self.users[record.user_id]
+                        expired.append(record.user_id)
+                    else:
+                        self._schedule(record)
+            self.leaves += len(expired)
+            online = len(self.users)
+        if self.on_leave:
+            for user_id in expired:
+                self.on_leave(user_id, online)
+        return expired
+
+    def get(self, user_id):
+        return self.users.get(user_id)
+
+    def user_ids(self, limit=None):
+        with self.lock:
+            ids = list(self.users) if limit is None else [u for _, u in zip(range(limit), self.users)]
+        return ids
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, user_id):
+        return user_id in self.users
+
+    def stats(self):
+        return {'online': len(self.users), 'joins': self.joins, 'leaves': self.leaves,
+                'timeout': self.timeout, 'tick': self.tick}
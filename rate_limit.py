@@ -0,0 +1,205 @@
+"""Token-bucket rate limiting and sliding-window abuse detection for chat ingest
+
+Everything here is keyed on a cheap peek at the raw payload bytes, so a
+flood is rejected before on_message pays for decode() and json.loads().
+"""
+import os
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+RATE_USER_PER_SEC = float(os.getenv("RATE_USER_PER_SEC", 1))
+RATE_USER_BURST = float(os.getenv("RATE_USER_BURST", 5))
+RATE_ROOM_PER_SEC = float(os.getenv("RATE_ROOM_PER_SEC", 20))
+RATE_ROOM_BURST = float(os.getenv("RATE_ROOM_BURST", 50))
+RATE_TOPIC_PER_SEC = float(os.getenv("RATE_TOPIC_PER_SEC", 200))
+RATE_TOPIC_BURST = float(os.getenv("RATE_TOPIC_BURST", 400))
+AI_CALLS_PER_MIN = float(os.getenv("AI_CALLS_PER_MIN", 60))
+ABUSE_WINDOW = int(os.getenv("ABUSE_WINDOW", 60))
+ABUSE_THRESHOLD = int(os.getenv("ABUSE_THRESHOLD", 30))
+ABUSE_BAN_SECONDS = int(os.getenv("ABUSE_BAN_SECONDS", 300))
+RATE_MAX_KEYS = int(os.getenv("RATE_MAX_KEYS", 100000))
+
+_ID_RE = re.compile(rb'"id"\s*:\s*"([^"\\]{1,64})"')
+
+
+def peek_user_id(payload):
+    """User id from raw JSON bytes without a full parse ('system' for plain text)"""
+    match = _ID_RE.search(payload, 0, 512)
+    if match:
+        return match.group(1).decode('utf-8', 'replace')
+    return "unknown" if payload[:1] == b'{' else "system"
+
+
+class TokenBucketTable:
+    """One token bucket per key.
+
+    Keys are kept in last-touched order. A bucket untouched for burst/rate
+    seconds is full again, i.e. indistinguishable from a new one, so it is
+    dropped from the front; expiry is O(1) amortized instead of a full scan.
+    """
+
+    def __init__(self, rate, burst, max_keys=RATE_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.refill_time = burst / rate if rate > 0 else float('inf')
+        self.buckets = OrderedDict()  # key -> [tokens, last_update]
+
+    def allow(self, key, now, cost=1.0):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [self.burst, now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self.buckets.move_to_end(key)
+        allowed = bucket[0] >= cost
+        if allowed:
+            bucket[0] -= cost
+        self._expire(now)
+        return allowed
+
+    def _expire(self, now):
+        buckets = self.buckets
+        while buckets:
+            key, bucket = next(iter(buckets.items()))
+            if now - bucket[1] >= self.refill_time or len(buckets) > self.max_keys:
+                buckets.popitem(last=False)
+            else:
+                break
+
+    def __len__(self):
+        return len(self.buckets)
+
+
+class SlidingWindowCounter:
+    """Per-key event counts over the last `window` seconds at 1s resolution.
+
+    Each key owns a small array('H') ring plus a running total; advancing the
+    clock zeroes only the slots that expired since the key was last touched.
+    """
+
+    def __init__(self, window=ABUSE_WINDOW, max_keys=RATE_MAX_KEYS):
+        self.window = window
+        self.max_keys = max_keys
+        self.counters = OrderedDict()  # key -> [slots, last_second, total]
+
+    def _advance(self, counter, second):
+        slots, last, total = counter
+        gap = second - last
+        if gap >= self.window:
+            for i in range(self.window):
+                slots[i] = 0
+            total = 0
+        else:
+            for s in range(last + 1, second + 1):
+                i = s % self.window
+                total -= slots[i]
+                slots[i] = 0
+        counter[1] = second
+        counter[2] = total
+
+    def hit(self, key, now):
+        """Record one event and return the count inside the window"""
+        second = int(now)
+        counter = self.counters.get(key)
+        if counter is None:
+            counter = self.counters[key] = [array('H', bytes(2 * self.window)), second, 0]
+        else:
+            self._advance(counter, second)
+            self.counters.move_to_end(key)
+        i = second % self.window
+        if counter[0][i] < 0xFFFF:
+            counter[0][i] += 1
+            counter[2] += 1
+        # Oldest-touched keys have an empty window once it has fully passed
+        while self.counters:
+            old_key, old = next(iter(self.counters.items()))
+            if second - old[1] >= self.window or len(self.counters) > self.max_keys:
+                self.counters.popitem(last=False)
+            else:
+                break
+        return counter[2]
+
+    def __len__(self):
+        return len(self.counters)
+
+
+class RateLimiter:
+    """Per-topic, per-user and per-room buckets, a global AI budget and temp bans"""
+
+    def __init__(self):
+        self.users = TokenBucketTable(RATE_USER_PER_SEC, RATE_USER_BURST)
+        self.rooms = TokenBucketTable(RATE_ROOM_PER_SEC, RATE_ROOM_BURST)
+        self.topics = TokenBucketTable(RATE_TOPIC_PER_SEC, RATE_TOPIC_BURST)
+        self.ai_budget = TokenBucketTable(AI_CALLS_PER_MIN / 60.0, max(1.0, AI_CALLS_PER_MIN / 6.0))
+        self.rejections = SlidingWindowCounter(ABUSE_WINDOW)
+        self.banned = {}  # user_id -> banned until
+        self.next_ban_sweep = 0.0
+        self.lock = threading.Lock()
+        self.stats = {'accepted': 0, 'rejected': 0, 'banned': 0, 'ai_rejected': 0}
+
+    def admit(self, topic, payload, room_of=None, user_id=None):
+        """Decide on a raw MQTT message before it is decoded.
+
+        room_of(user_id) maps a user to their current room for the room bucket.
+        user_id overrides the id peeked from the payload; the caller passes
+        the parsed id when it differs from the peeked one (duplicate "id" keys,
+        nested objects), so a message can't be limited as one user and
+        processed as another. Returns (allowed, user_id).
+        """
+        if user_id is None:
+            user_id = peek_user_id(payload)
+        now = time.monotonic()
+        with self.lock:
+            until = self.banned.get(user_id)
+            if until is not None:
+                if now < until:
+                    self.stats['rejected'] += 1
+                    return False, user_id
+                del self.banned[user_id]
+
+            if now >= self.next_ban_sweep:
+                self._expire_bans(now)
+
+            if not self.topics.allow(topic, now):
+                self.stats['rejected'] += 1
+                return False, user_id
+            # Only the user's own bucket counts toward a ban: a busy topic or
+            # room must not get well-behaved users banned
+            if self.users.allow(user_id, now):
+                if room_of is None or self.rooms.allow(room_of(user_id), now):
+                    self.stats['accepted'] += 1
+                    return True, user_id
+                self.stats['rejected'] += 1
+                return False, user_id
+
+            self.stats['rejected'] += 1
+            if self.rejections.hit(user_id, now) >= ABUSE_THRESHOLD:
+                self.banned[user_id] = now + ABUSE_BAN_SECONDS
+                self.stats['banned'] += 1
+                print(f"[RATE_LIMIT] {user_id} flooding, banned for {ABUSE_BAN_SECONDS}s")
+            return False, user_id
+
+    def _expire_bans(self, now):
+        """Drop finished bans (users who never come back would otherwise stay forever)"""
+        expired = [user_id for user_id, until in self.banned.items() if until <= now]
+        for user_id in expired:
+            del self.banned[user_id]
+        self.next_ban_sweep = now + min(ABUSE_BAN_SECONDS, 60)
+
+    def allow_ai_call(self):
+        """Global AI-call budget (AI_CALLS_PER_MIN across all users)"""
+        with self.lock:
+            if self.ai_budget.allow("global", time.monotonic()):
+                return True
+            self.stats['ai_rejected'] += 1
+            return False
+
+    def status(self):
+        with self.lock:
+            return dict(self.stats, tracked_users=len(self.users), tracked_rooms=len(self.rooms),
+                        active_bans=len(self.banned))
@@ -0,0 +1,118 @@
+"""Per-room conversation state with bounded histories and LRU eviction"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+ROOM_HISTORY_SIZE = int(os.getenv("ROOM_HISTORY_SIZE", 10))
+MAX_ROOMS = int(os.getenv("MAX_ROOMS", 1000))
+MAX_TRACKED_USERS = int(os.getenv("MAX_TRACKED_USERS", 10000))
+ROOM_HISTORY_PER_USER = os.getenv("ROOM_HISTORY_PER_USER", "false").lower() == "true"
+
+
+class RoomState:
+    """One conversation buffer; appends are O(1) and old turns fall off the deque"""
+    __slots__ = ("history", "lock", "last_active")
+
+    def __init__(self, history_size):
+        self.history = deque(maxlen=history_size)
+        self.lock = threading.Lock()
+        self.last_active = time.time()
+
+
+class RoomStateStore:
+    """Thread-safe map of room (or room+user) -> RoomState.
+
+    The store lock only guards the dict lookups; each history has its own lock,
+    so busy rooms don't serialize on each other. Least recently used rooms are
+    evicted once max_rooms is exceeded.
+    """
+
+    def __init__(self, history_size=ROOM_HISTORY_SIZE, max_rooms=MAX_ROOMS,
+                 max_users=MAX_TRACKED_USERS, per_user=ROOM_HISTORY_PER_USER,
+                 default_room="living_room"):
+        self.history_size = history_size
+        self.max_rooms = max_rooms
+        self.max_users = max_users
+        self.per_user = per_user
+        self.default_room = default_room
+        self.rooms = OrderedDict()
+        self.user_rooms = OrderedDict()
+        self.lock = threading.Lock()
+        self.evicted = 0
+
+    def _key(self, room, user_id):
+        return (room, user_id) if self.per_user else room
+
+    def _state(self, key, create=True):
+        with self.lock:
+            state = self.rooms.get(key)
+            if state is not None:
+                self.rooms.move_to_end(key)
+            elif create:
+                state = self.rooms[key] = RoomState(self.history_size)
+                while len(self.rooms) > self.max_rooms:
+                    self.rooms.popitem(last=False)
+                    self.evicted += 1
+            return state
+
+    # --- User location ---
+    def get_user_room(self, user_id):
+        """Room the user is currently in (default_room if unknown)"""
+        with self.lock:
+            room = self.user_rooms.get(user_id)
+            if room is None:
+                return self.default_room
+            self.user_rooms.move_to_end(user_id)
+            return room
+
+    def set_user_room(self, user_id, room):
+        """Move a user to another room; only their own per-user history is reset"""
+        with self.lock:
+            self.user_rooms[user_id] = room
+            self.user_rooms.move_to_end(user_id)
+            while len(self.user_rooms) > self.max_users:
+                self.user_rooms.popitem(last=False)
+            if self.per_user:
+                self.rooms.pop((room, user_id), None)
+
+    # --- History ---
+    def append(self, room, user_id, message):
+        """Append a chat message dict to the room's history"""
+        state = self._state(self._key(room, user_id))
+        with state.lock:
+            state.history.append(message)
+            state.last_active = time.time()
+
+    def snapshot(self, room, user_id=None):
+        """Copy of the current history, oldest first"""
+        state = self._state(self._key(room, user_id), create=False)
+        if state is None:
+            return []
+        with state.lock:
+            return list(state.history)
+
+    def clear(self, room=None):
+        """Drop one room's histories, or everything when room is None"""
+        with self.lock:
+            if room is None:
+                self.rooms.clear()
+                return
+            for key in [k for k in self.rooms if k == room or (isinstance(k, tuple) and k[0] == room)]:
+                del self.rooms[key]
+
+    def evict_idle(self, max_idle=3600):
+        """Remove histories untouched for max_idle seconds. Returns count removed."""
+        cutoff = time.time() - max_idle
+        with self.lock:
+            idle = [k for k, s in self.rooms.items() if s.last_active < cutoff]
+            for key in idle:
+                del self.rooms[key]
+            self.evicted += len(idle)
+        return len(idle)
+
+    def stats(self):
+        with self.lock:
+            messages = sum(len(s.history) for s in self.rooms.values())
+            return {'rooms': len(self.rooms), 'users': len(self.user_rooms),
+                    'messages': messages, 'evicted': self.evicted}
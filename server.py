@@ -5,9 +5,10 @@ import time
 import threading
 import random
 import string
-import requests
 import sys
 
+from llm_providers import get_provider, ProviderError, CircuitOpenError
+
 # --- 1. CONFIGURATION & LOGGING ---
 print(">> SERVER BOOTING UP...")
 
@@ -31,49 +32,34 @@ def get_ai_response(prompt):
     # EXPLICITLY USE STABLE MODEL TO FIX DECOMMISSIONED ERROR
     model = "llama3-8b-8192" # The stable model
     
+    # Shared pooled Groq client (keep-alive, retries, circuit breaker)
+    provider = get_provider("groq")
+    if provider is None:
+        print("[AI ERROR] GROQ_API_KEY missing")
+        return "I'm sorry, I'm having trouble connecting to my brain right now."
+
     try:
-        response = requests.post(
-            "https://api.groq.com/openai/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {GROQ_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": model, # Using stable model here
-                "messages": [
-                    {"role": "system", "content": "You are TermOS AI. Respond in the same language as the user."},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.7
-            },
-            timeout=15
+        data = provider.chat(
+            [
+                {"role": "system", "content": "You are TermOS AI. Respond in the same language as the user."},
+                {"role": "user", "content": prompt}
+            ],
+            model=model, # Using stable model here
+            temperature=0.7
         )
-        
-        # ROBUST PARSING: Handle API errors explicitly
-        if response.status_code != 200:
-            print(f"[AI ERROR] Request failed: {response.status_code}")
-            return "I'm sorry, I'm having trouble connecting to my brain right now."
-        
-        try:
-            data = response.json()
-            
-            # SAFELY CHECK FOR ERROR KEYS
-            if 'error' in data:
-                print(f"[AI ERROR] Groq API: {data['error'].get('message', 'Unknown error')}")
-                return f"API Error: {data['error'].get('message', 'Unknown error')}"
-            
-            if 'choices' not in data or len(data['choices']) == 0:
-                print("[AI ERROR] No choices returned")
-                return "My neural pathways are empty."
-            
-            return data['choices'][0]['message']['content']
-            
-        except requests.exceptions.Timeout:
-            print("[AI ERROR] Connection timed out")
+        return data['choices'][0]['message']['content']
+
+    except CircuitOpenError:
+        print("[AI ERROR] Groq circuit open, skipping call")
+        return "I'm sorry, I'm having trouble connecting to my brain right now."
+    except ProviderError as e:
+        print(f"[AI ERROR] {e}")
+        if e.retryable:
             return "The signal is weak. Try again."
-        except Exception as e:
-            print(f"[AI CRITICAL] {e}")
-            return f"System Failure: {str(e)}"
+        return f"API Error: {str(e)[:100]}"
+    except Exception as e:
+        print(f"[AI CRITICAL] {e}")
+        return f"System Failure: {str(e)}"
 
 # --- 3. SIMPLE MQTT CLIENT ---
 # Only import MQTT if available
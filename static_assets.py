@@ -0,0 +1,184 @@
+"""In-memory static asset layer for the PWA files
+
+Assets are read once at startup together with precomputed gzip (and brotli,
+when the `brotli` package is installed) variants and a strong ETag, so a
+page load costs no disk reads or compression. Conditional requests get a
+304. Files whose name carries a content hash (app.3f9a1c2e.js) are served as
+immutable for a year; HTML, the service worker and the manifest must
+revalidate every time; everything else is cacheable for STATIC_MAX_AGE.
+
+Only web asset types are served, so Python sources, .env and the SQLite/
+spill files in the working directory are never exposed.
+
+With STATIC_SENDFILE on, files over STATIC_SENDFILE_MIN bytes keep only
+their compressed variants in memory; the identity body is sent from disk
+with sendfile() when a client doesn't accept compression.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from email.utils import formatdate
+from urllib.parse import unquote
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", 300))
+STATIC_MAX_FILE_BYTES = int(os.getenv("STATIC_MAX_FILE_BYTES", 8 * 1024 * 1024))
+STATIC_COMPRESS_MIN = int(os.getenv("STATIC_COMPRESS_MIN", 1024))
+STATIC_SENDFILE = os.getenv("STATIC_SENDFILE", "false").lower() == "true"
+STATIC_SENDFILE_MIN = int(os.getenv("STATIC_SENDFILE_MIN", 256 * 1024))
+
+STATIC_EXTENSIONS = {
+    '.html', '.htm', '.js', '.mjs', '.css', '.json', '.webmanifest', '.map', '.svg', '.ico',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.woff', '.woff2', '.ttf', '.m3u',
+    '.mp3', '.ogg', '.wav', '.txt',
+}
+# Already-compressed formats gain nothing from gzip
+_COMPRESSIBLE = {'.html', '.htm', '.js', '.mjs', '.css', '.json', '.webmanifest', '.map', '.svg',
+                 '.ico', '.ttf', '.m3u', '.txt'}
+_SKIP_DIRS = {'__pycache__', 'node_modules', 'venv', '.venv', 'plugins', 'memory_bank', 'termAi'}
+_NO_CACHE = {'index.html', 'sw.js', 'manifest.json'}
+_HASHED_RE = re.compile(r'[.-][0-9a-f]{8,}\.\w+$')
+
+
+class Asset:
+    __slots__ = ("path", "content_type", "etag", "last_modified", "cache_control",
+                 "size", "identity", "variants")
+
+    def __init__(self, path, data, url_path):
+        filename = os.path.basename(path)
+        ext = os.path.splitext(filename)[1].lower()
+        self.path = path
+        self.size = len(data)
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+            content_type += '; charset=utf-8'
+        self.content_type = content_type
+        self.etag = '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+        self.last_modified = formatdate(os.path.getmtime(path), usegmt=True)
+        if _HASHED_RE.search(filename):
+            self.cache_control = 'public, max-age=31536000, immutable'
+        elif filename in _NO_CACHE or ext in ('.html', '.htm') or url_path == '/':
+            self.cache_control = 'no-cache'
+        else:
+            self.cache_control = f'public, max-age={STATIC_MAX_AGE}'
+
+        self.variants = {}
+        if ext in _COMPRESSIBLE and self.size >= STATIC_COMPRESS_MIN:
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(compressed) < self.size * 0.9:
+                self.variants['gzip'] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(data, quality=11)
+                if len(compressed) < self.size * 0.9:
+                    self.variants['br'] = compressed
+        # Large identity bodies stay on disk for sendfile()
+        self.identity = None if STATIC_SENDFILE and self.size >= STATIC_SENDFILE_MIN else data
+
+
+def _accepted_encodings(header):
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q=') and q[2:].strip() in ('0', '0.0', '0.00', '0.000'):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+class StaticAssets:
+    """Preloaded assets under a root directory, looked up by URL path"""
+
+    def __init__(self, root, index='index.html'):
+        self.root = os.path.realpath(root)
+        self.index = index
+        self.assets = {}
+        self.stats = {'requests': 0, 'not_modified': 0, 'gzip': 0, 'br': 0, 'identity': 0,
+                      'sendfile': 0, 'not_found': 0, 'bytes_sent': 0}
+        self.load()
+
+    def load(self):
+        """(Re)read every servable file under root"""
+        assets = {}
+        raw = compressed = 0
+        for directory, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if not d.startswith('.') and d not in _SKIP_DIRS]
+            for filename in files:
+                if os.path.splitext(filename)[1].lower() not in STATIC_EXTENSIONS or filename.startswith('.'):
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    if os.path.getsize(path) > STATIC_MAX_FILE_BYTES:
+                        continue
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                except OSError:
+                    continue
+                url_path = '/' + os.path.relpath(path, self.root).replace(os.sep, '/')
+                asset = Asset(path, data, url_path)
+                assets[url_path] = asset
+                raw += asset.size
+                compressed += min([asset.size] + [len(v) for v in asset.variants.values()])
+        if self.index and '/' + self.index in assets:
+            assets['/'] = assets['/' + self.index]
+        self.assets = assets
+        print(f"[HTTP] {len(assets)} static assets preloaded "
+              f"({raw // 1024} KB, {compressed // 1024} KB compressed{', brotli' if brotli else ''})")
+
+    def lookup(self, url_path):
+        path = unquote(url_path.split('?', 1)[0].split('#', 1)[0])
+        asset = self.assets.get(path)
+        if asset is None and path.endswith('/'):
+            asset = self.assets.get(path + self.index)
+        return asset
+
+    def respond(self, url_path, headers, head=False):
+        """Resolve a GET/HEAD.
+
+        headers is a case-insensitive mapping (or a dict with lower-case keys).
+        Returns (status, reason, header list, body bytes, file path); the
+        file path is set instead of a body when the caller should sendfile().
+        """
+        self.stats['requests'] += 1
+        asset = self.lookup(url_path)
+        if asset is None:
+            self.stats['not_found'] += 1
+            body = b'404 Not Found'
+            return 404, 'Not Found', [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))], \
+                (b'' if head else body), None
+
+        common = [('ETag', asset.etag), ('Last-Modified', asset.last_modified),
+                  ('Cache-Control', asset.cache_control), ('Vary', 'Accept-Encoding')]
+
+        if_none_match = headers.get('if-none-match') or headers.get('If-None-Match')
+        if if_none_match:
+            tags = {t.strip().removeprefix('W/') for t in if_none_match.split(',')}
+            if asset.etag in tags or '*' in tags:
+                self.stats['not_modified'] += 1
+                return 304, 'Not Modified', common, b'', None
+
+        accepted = _accepted_encodings(headers.get('accept-encoding') or headers.get('Accept-Encoding') or '')
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in asset.variants:
+                body = asset.variants[encoding]
+                self.stats[encoding] += 1
+                self.stats['bytes_sent'] += 0 if head else len(body)
+                return 200, 'OK', [('Content-Type', asset.content_type), ('Content-Encoding', encoding),
+                                   ('Content-Length', str(len(body)))] + common, (b'' if head else body), None
+
+        response_headers = [('Content-Type', asset.content_type), ('Content-Length', str(asset.size))] + common
+        self.stats['bytes_sent'] += 0 if head else asset.size
+        if asset.identity is None:
+            self.stats['sendfile'] += 1
+            return 200, 'OK', response_headers, b'', (None if head else asset.path)
+        self.stats['identity'] += 1
+        return 200, 'OK', response_headers, (b'' if head else asset.identity), None
+
+    def status(self):
+        return dict(self.stats, assets=len(self.assets), brotli=brotli is not None)
@@ -1,6 +1,6 @@
-from .core import Tensor, Softmax
-from .models import Linear, SimpleChatBot, MiniGPT, TransformerBlock
+from .core import Tensor, Softmax, cross_entropy, layer_norm, SGD, Adam
+from .models import Linear, LayerNorm, SimpleChatBot, MiniGPT, TransformerBlock
 from .chat_interface import VirtualUser
 from .data_collector import ChatLogger
 
-__version__ = "0.1.0"
\ No newline at end of file
+__version__ = "0.1.0"
@@ -1,61 +1,390 @@
 import numpy as np
 
+
+def _unbroadcast(grad, shape):
+    # Sum a gradient back down to the shape of an operand that was broadcast
+    if grad.shape == shape:
+        return grad
+    extra = grad.ndim - len(shape)
+    if extra > 0:
+        grad = grad.sum(axis=tuple(range(extra)))
+    axes = tuple(i for i, n in enumerate(shape) if n == 1 and grad.shape[i] != 1)
+    if axes:
+        grad = grad.sum(axis=axes, keepdims=True)
+    return grad.reshape(shape)
+
+
+def _as_tensor(value):
+    return value if isinstance(value, Tensor) else Tensor(value)
+
+
 class Tensor:
+    """NumPy array with reverse-mode autograd.
+
+    Leaf tensors created with requires_grad=True get a preallocated grad
+    buffer that backward() accumulates into in place; zero_grad() clears it.
+    Results of operations only record their parents (and a backward closure)
+    when some input requires a gradient, so inference builds no graph.
+    """
+
     def __init__(self, data, requires_grad=False):
-        # Ensure data is a numpy array
-        self.data = np.array(data)
+        # Ensure data is a floating point numpy array
+        data = np.asarray(data)
+        if data.dtype.kind not in 'fc':
+            data = data.astype(np.float64)
+        self.data = data
         self.requires_grad = requires_grad
-        self.grad = None
-        self._backward = lambda: None
+        self.grad = np.zeros_like(data) if requires_grad else None
+        self._parents = ()
+        self._backward = None
 
     def __repr__(self):
         return f"Tensor(data={self.data}, grad={self.grad})"
 
-    def backward(self):
-        # Topological sort for backpropagation (simplified)
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def ndim(self):
+        return self.data.ndim
+
+    def numpy(self):
+        return self.data
+
+    def item(self):
+        return self.data.item()
+
+    def detach(self):
+        return Tensor(self.data)
+
+    # ---- graph ----
+    @staticmethod
+    def _result(data, parents, backward):
+        out = Tensor(data)
+        if any(p.requires_grad for p in parents):
+            out.requires_grad = True
+            out._parents = parents
+            out._backward = backward
+        return out
+
+    def _accumulate(self, grad):
+        grad = _unbroadcast(grad, self.data.shape)
+        if self.grad is None:
+            self.grad = np.array(grad, dtype=self.data.dtype)
+        else:
+            np.add(self.grad, grad, out=self.grad, casting='unsafe')
+
+    def zero_grad(self):
+        if self.grad is not None:
+            self.grad.fill(0)
+
+    def backward(self, grad=None):
+        # Topological order (iterative, so deep graphs don't hit the recursion limit)
         topo = []
         visited = set()
-        def build_topo(v):
-            if v not in visited:
-                visited.add(v)
-                # If we had a computation graph history, we would traverse parents here
-                topo.append(v)
-        build_topo(self)
-        
-        # Go backwards
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                topo.append(node)
+                continue
+            if id(node) in visited:
+                continue
+            visited.add(id(node))
+            stack.append((node, True))
+            for parent in node._parents:
+                if parent.requires_grad and id(parent) not in visited:
+                    stack.append((parent, False))
+
+        self._accumulate(np.ones_like(self.data) if grad is None else np.asarray(grad))
+
+        # Go backwards; intermediate gradients are dropped once passed on
         for node in reversed(topo):
-            node._backward()
+            if node._backward is not None and node.grad is not None:
+                node._backward(node.grad)
+                node.grad = None
 
-    # Example basic operation: Addition
+    # ---- elementwise ----
     def __add__(self, other):
-        other = other if isinstance(other, Tensor) else Tensor(other)
-        out = Tensor(self.data + other.data)
-
-        def _backward():
-            self.grad += out.grad
-            other.grad += out.grad
-        
-        out._backward = _backward
-        return out
+        other = _as_tensor(other)
+
+        def _backward(grad):
+            if self.requires_grad:
+                self._accumulate(grad)
+            if other.requires_grad:
+                other._accumulate(grad)
+
+        return Tensor._result(self.data + other.data, (self, other), _backward)
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return Tensor._result(-self.data, (self,), lambda grad: self._accumulate(-grad))
+
+    def __sub__(self, other):
+        other = _as_tensor(other)
+
+        def _backward(grad):
+            if self.requires_grad:
+                self._accumulate(grad)
+            if other.requires_grad:
+                other._accumulate(-grad)
+
+        return Tensor._result(self.data - other.data, (self, other), _backward)
+
+    def __rsub__(self, other):
+        return _as_tensor(other) - self
 
-    # Example basic operation: Multiplication
     def __mul__(self, other):
-        other = other if isinstance(other, Tensor) else Tensor(other)
-        out = Tensor(self.data * other.data)
+        other = _as_tensor(other)
 
-        def _backward():
-            self.grad += other.data * out.grad
-            other.grad += self.data * out.grad
+        def _backward(grad):
+            if self.requires_grad:
+                self._accumulate(grad * other.data)
+            if other.requires_grad:
+                other._accumulate(grad * self.data)
+
+        return Tensor._result(self.data * other.data, (self, other), _backward)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        other = _as_tensor(other)
+
+        def _backward(grad):
+            if self.requires_grad:
+                self._accumulate(grad / other.data)
+            if other.requires_grad:
+                other._accumulate(-grad * self.data / (other.data * other.data))
+
+        return Tensor._result(self.data / other.data, (self, other), _backward)
+
+    def __rtruediv__(self, other):
+        return _as_tensor(other) / self
+
+    def __pow__(self, exponent):
+        # Constant exponent only
+        def _backward(grad):
+            self._accumulate(grad * exponent * self.data ** (exponent - 1))
+
+        return Tensor._result(self.data ** exponent, (self,), _backward)
+
+    def exp(self):
+        out_data = np.exp(self.data)
+        return Tensor._result(out_data, (self,), lambda grad: self._accumulate(grad * out_data))
+
+    def log(self):
+        return Tensor._result(np.log(self.data), (self,), lambda grad: self._accumulate(grad / self.data))
+
+    def tanh(self):
+        out_data = np.tanh(self.data)
+        return Tensor._result(out_data, (self,), lambda grad: self._accumulate(grad * (1 - out_data * out_data)))
+
+    def relu(self):
+        mask = self.data > 0
+        return Tensor._result(self.data * mask, (self,), lambda grad: self._accumulate(grad * mask))
+
+    # ---- matrix ----
+    def __matmul__(self, other):
+        other = _as_tensor(other)
+        a, b = self.data, other.data
+
+        def _backward(grad):
+            # Promote 1-D operands to matrices the way np.matmul does
+            a2 = a[None, :] if a.ndim == 1 else a
+            b2 = b[:, None] if b.ndim == 1 else b
+            g2 = grad
+            if a.ndim == 1:
+                g2 = np.expand_dims(g2, -2)
+            if b.ndim == 1:
+                g2 = np.expand_dims(g2, -1)
+            if self.requires_grad:
+                ga = g2 @ np.swapaxes(b2, -1, -2)
+                self._accumulate(ga[..., 0, :] if a.ndim == 1 else ga)
+            if other.requires_grad:
+                if b2.ndim == 2 and a2.ndim > 2:
+                    # Shared weight: fold the batch dims into one big matmul
+                    gb = a2.reshape(-1, a2.shape[-1]).T @ g2.reshape(-1, g2.shape[-1])
+                else:
+                    gb = np.swapaxes(a2, -1, -2) @ g2
+                other._accumulate(gb[..., 0] if b.ndim == 1 else gb)
+
+        return Tensor._result(a @ b, (self, other), _backward)
+
+    def __rmatmul__(self, other):
+        return _as_tensor(other) @ self
+
+    # ---- reductions ----
+    def sum(self, axis=None, keepdims=False):
+        def _backward(grad):
+            if axis is not None and not keepdims:
+                grad = np.expand_dims(grad, axis)
+            self._accumulate(np.broadcast_to(grad, self.data.shape))
+
+        return Tensor._result(self.data.sum(axis=axis, keepdims=keepdims), (self,), _backward)
+
+    def mean(self, axis=None, keepdims=False):
+        count = self.data.size if axis is None else np.prod([self.data.shape[i] for i in np.atleast_1d(axis)])
+        return self.sum(axis=axis, keepdims=keepdims) * (1.0 / count)
+
+    def softmax(self, axis=-1):
+        # Shift data for numerical stability
+        exp_data = np.exp(self.data - self.data.max(axis=axis, keepdims=True))
+        out_data = exp_data / exp_data.sum(axis=axis, keepdims=True)
+
+        def _backward(grad):
+            self._accumulate(out_data * (grad - (grad * out_data).sum(axis=axis, keepdims=True)))
+
+        return Tensor._result(out_data, (self,), _backward)
+
+    def log_softmax(self, axis=-1):
+        shifted = self.data - self.data.max(axis=axis, keepdims=True)
+        out_data = shifted - np.log(np.exp(shifted).sum(axis=axis, keepdims=True))
+
+        def _backward(grad):
+            self._accumulate(grad - np.exp(out_data) * grad.sum(axis=axis, keepdims=True))
+
+        return Tensor._result(out_data, (self,), _backward)
+
+    # ---- shape ----
+    def reshape(self, *shape):
+        shape = shape[0] if len(shape) == 1 and isinstance(shape[0], tuple) else shape
+        return Tensor._result(self.data.reshape(shape), (self,),
+                              lambda grad: self._accumulate(grad.reshape(self.data.shape)))
+
+    def transpose(self, *axes):
+        axes = axes or tuple(reversed(range(self.data.ndim)))
+        inverse = np.argsort(axes)
+        return Tensor._result(self.data.transpose(axes), (self,),
+                              lambda grad: self._accumulate(grad.transpose(inverse)))
+
+    def swapaxes(self, axis1, axis2):
+        axes = list(range(self.data.ndim))
+        axes[axis1], axes[axis2] = axes[axis2], axes[axis1]
+        return self.transpose(*axes)
+
+    @property
+    def T(self):
+        return self.transpose()
+
+    def __getitem__(self, index):
+        index = index.data.astype(np.intp) if isinstance(index, Tensor) else index
+
+        def _backward(grad):
+            # Scatter-add straight into the (preallocated) buffer; repeated rows add up
+            if self.grad is None:
+                self.grad = np.zeros_like(self.data)
+            np.add.at(self.grad, index, grad)
+
+        return Tensor._result(self.data[index], (self,), _backward)
+
+
+def cross_entropy(logits, targets):
+    """Mean negative log-likelihood of integer targets under softmax(logits).
+
+    logits: (..., classes) Tensor; targets: int array of the leading shape.
+    Fused, so the backward pass is just softmax - one_hot (no one-hot array).
+    """
+    targets = np.asarray(targets, dtype=np.intp).reshape(-1)
+    flat = logits.data.reshape(-1, logits.data.shape[-1])
+    shifted = flat - flat.max(axis=-1, keepdims=True)
+    log_probs = shifted - np.log(np.exp(shifted).sum(axis=-1, keepdims=True))
+    rows = np.arange(len(targets))
+    loss = -log_probs[rows, targets].mean()
+
+    def _backward(grad):
+        probs = np.exp(log_probs)
+        probs[rows, targets] -= 1
+        probs *= grad / len(targets)
+        logits._accumulate(probs.reshape(logits.data.shape))
+
+    return Tensor._result(np.asarray(loss, dtype=flat.dtype), (logits,), _backward)
+
+
+def layer_norm(x, gamma, beta, eps=1e-5):
+    """Normalize over the last axis, then scale by gamma and shift by beta"""
+    mean = x.data.mean(axis=-1, keepdims=True)
+    centered = x.data - mean
+    rstd = 1.0 / np.sqrt((centered * centered).mean(axis=-1, keepdims=True) + eps)
+    x_hat = centered * rstd
+
+    def _backward(grad):
+        if gamma.requires_grad:
+            gamma._accumulate(grad * x_hat)
+        if beta.requires_grad:
+            beta._accumulate(grad)
+        if x.requires_grad:
+            d_hat = grad * gamma.data
+            x._accumulate(rstd * (d_hat - d_hat.mean(axis=-1, keepdims=True)
+                                  - x_hat * (d_hat * x_hat).mean(axis=-1, keepdims=True)))
+
+    return Tensor._result(x_hat * gamma.data + beta.data, (x, gamma, beta), _backward)
 
-        out._backward = _backward
-        return out
 
 class Softmax:
-    def __init__(self):
-        pass
-    
+    def __init__(self, axis=-1):
+        self.axis = axis
+
     def __call__(self, x_tensor):
-        # Shift data for numerical stability
-        exp_data = np.exp(x_tensor.data - np.max(x_tensor.data))
-        softmax_data = exp_data / np.sum(exp_data)
-        return Tensor(softmax_data)
\ No newline at end of file
+        return _as_tensor(x_tensor).softmax(axis=self.axis)
+
+
+class SGD:
+    """Plain / momentum SGD updating parameter arrays in place"""
+
+    def __init__(self, parameters, lr=0.01, momentum=0.0):
+        self.parameters = list(parameters)
+        self.lr = lr
+        self.momentum = momentum
+        self.velocity = [np.zeros_like(p.data) for p in self.parameters] if momentum else None
+
+    def step(self):
+        for i, p in enumerate(self.parameters):
+            if p.grad is None:
+                continue
+            if self.velocity is not None:
+                v = self.velocity[i]
+                v *= self.momentum
+                v += p.grad
+                p.data -= self.lr * v
+            else:
+                p.data -= self.lr * p.grad
+
+    def zero_grad(self):
+        for p in self.parameters:
+            p.zero_grad()
+
+
+class Adam:
+    """Adam with moment buffers allocated once per parameter"""
+
+    def __init__(self, parameters, lr=1e-3, betas=(0.9, 0.999), eps=1e-8, weight_decay=0.0):
+        self.parameters = list(parameters)
+        self.lr = lr
+        self.beta1, self.beta2 = betas
+        self.eps = eps
+        self.weight_decay = weight_decay
+        self.m = [np.zeros_like(p.data) for p in self.parameters]
+        self.v = [np.zeros_like(p.data) for p in self.parameters]
+        self.steps = 0
+
+    def step(self):
+        self.steps += 1
+        correction1 = 1 - self.beta1 ** self.steps
+        correction2 = 1 - self.beta2 ** self.steps
+        for p, m, v in zip(self.parameters, self.m, self.v):
+            if p.grad is None:
+                continue
+            grad = p.grad
+            if self.weight_decay:
+                p.data *= 1 - self.lr * self.weight_decay
+            m *= self.beta1
+            m += (1 - self.beta1) * grad
+            v *= self.beta2
+            v += (1 - self.beta2) * grad * grad
+            p.data -= self.lr * (m / correction1) / (np.sqrt(v / correction2) + self.eps)
+
+    def zero_grad(self):
+        for p in self.parameters:
+            p.zero_grad()
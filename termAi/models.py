@@ -1,91 +1,130 @@
 import numpy as np
 import random
-from .core import Tensor, Softmax
+from .core import Tensor, Softmax, layer_norm
 
 class Linear:
     def __init__(self, in_features, out_features):
-        self.weights = Tensor(np.random.randn(in_features, out_features) * 0.1)
-        self.bias = Tensor(np.zeros(out_features))
+        self.weights = Tensor((np.random.randn(in_features, out_features) * 0.1).astype(np.float32), requires_grad=True)
+        self.bias = Tensor(np.zeros(out_features, dtype=np.float32), requires_grad=True)
 
     def __call__(self, x):
-        # x * weights + bias
-        return Tensor(np.dot(x.data, self.weights.data) + self.bias.data)
-    
+        # x * weights + bias (x may carry any number of batch dimensions)
+        x = x if isinstance(x, Tensor) else Tensor(x)
+        return x @ self.weights + self.bias
+
     def parameters(self):
         return [self.weights, self.bias]
 
 class Embedding:
     def __init__(self, vocab_size, embed_size):
-        self.weights = Tensor(np.random.randn(vocab_size, embed_size) * 0.1)
-    
+        self.weights = Tensor((np.random.randn(vocab_size, embed_size) * 0.1).astype(np.float32), requires_grad=True)
+
+    def __call__(self, x):
+        # Row lookup for a token id or an array of ids: (..., embed_size)
+        return self.weights[x if isinstance(x, int) else np.asarray(x, dtype=np.intp)]
+
+    def parameters(self):
+        return [self.weights]
+
+class LayerNorm:
+    def __init__(self, size, eps=1e-5):
+        self.gamma = Tensor(np.ones(size, dtype=np.float32), requires_grad=True)
+        self.beta = Tensor(np.zeros(size, dtype=np.float32), requires_grad=True)
+        self.eps = eps
+
     def __call__(self, x):
-        # Simple lookup - in practice this would be more sophisticated
-        return Tensor(self.weights.data[x] if isinstance(x, int) else self.weights.data)
+        return layer_norm(x, self.gamma, self.beta, self.eps)
+
+    def parameters(self):
+        return [self.gamma, self.beta]
 
 class SelfAttention:
-    def __init__(self, embed_size):
+    def __init__(self, embed_size, causal=False):
         # Weights for Query, Key, and Value
-        self.W_q = Tensor(np.random.randn(embed_size, embed_size) * 0.1)
-        self.W_k = Tensor(np.random.randn(embed_size, embed_size) * 0.1)
-        self.W_v = Tensor(np.random.randn(embed_size, embed_size) * 0.1)
+        self.W_q = Tensor((np.random.randn(embed_size, embed_size) * 0.1).astype(np.float32), requires_grad=True)
+        self.W_k = Tensor((np.random.randn(embed_size, embed_size) * 0.1).astype(np.float32), requires_grad=True)
+        self.W_v = Tensor((np.random.randn(embed_size, embed_size) * 0.1).astype(np.float32), requires_grad=True)
         self.softmax = Softmax()
+        # Causal: a position may only look at itself and earlier positions (for next-token training)
+        self.causal = causal
 
     def __call__(self, x_tensor):
-        # x_tensor shape: (context_length, embed_size)
-        
+        # x_tensor shape: (context_length, embed_size) or (batch, context_length, embed_size)
+
         # 1. Calculate Q, K, V (Query, Key, Value)
         # This represents: "What am I looking for?", "What do I contain?", "What do I offer?"
-        Q = np.dot(x_tensor.data, self.W_q.data)
-        K = np.dot(x_tensor.data, self.W_k.data)
-        V = np.dot(x_tensor.data, self.W_v.data)
-        
+        Q = x_tensor @ self.W_q
+        K = x_tensor @ self.W_k
+        V = x_tensor @ self.W_v
+
         # 2. Attention Scores
         # How much focus should word A put on word B?
-        score = np.dot(Q, K.T) 
-        
+        score = Q @ K.swapaxes(-1, -2)
+
         # 3. Scale (prevent numbers from getting too huge)
-        embed_size = K.shape[1]
-        scaled_scores = score / np.sqrt(embed_size)
-        
-        # 4. Softmax (Convert to probabilities)
-        attention_weights = self.softmax(Tensor(scaled_scores)).data
-        
+        embed_size = K.shape[-1]
+        scaled_scores = score * (1.0 / np.sqrt(embed_size))
+        if self.causal:
+            length = scaled_scores.shape[-1]
+            future = np.triu(np.full((length, length), -1e9, dtype=scaled_scores.data.dtype), k=1)
+            scaled_scores = scaled_scores + future
+
+        # 4. Softmax (Convert to probabilities, per query row)
+        attention_weights = self.softmax(scaled_scores)
+
         # 5. Weighted Sum
         # The final output is the sum of values, weighted by attention
-        output_data = np.dot(attention_weights, V)
-        
-        return Tensor(output_data)
+        return attention_weights @ V
+
+    def parameters(self):
+        return [self.W_q, self.W_k, self.W_v]
 
 class TransformerBlock:
-    def __init__(self, embed_size):
-        self.attention = SelfAttention(embed_size)
-        # In a full model, you would add a FeedForward Network here
-    
+    def __init__(self, embed_size, causal=False):
+        self.norm1 = LayerNorm(embed_size)
+        self.attention = SelfAttention(embed_size, causal=causal)
+        self.norm2 = LayerNorm(embed_size)
+        # FeedForward Network: expand, non-linearity, project back
+        self.ff_in = Linear(embed_size, 4 * embed_size)
+        self.ff_out = Linear(4 * embed_size, embed_size)
+
     def __call__(self, x):
-        # "Residual connection" helps gradient flow
-        attended = self.attention(x)
-        
-        # Add the input back to the output (Helps the AI learn faster)
-        # Note: Simplified element-wise addition
-        return Tensor(attended.data + x.data)
+        # "Residual connection" helps gradient flow (pre-norm, as in GPT-2)
+        x = x + self.attention(self.norm1(x))
+        return x + self.ff_out(self.ff_in(self.norm2(x)).relu())
+
+    def parameters(self):
+        return (self.norm1.parameters() + self.attention.parameters() + self.norm2.parameters()
+                + self.ff_in.parameters() + self.ff_out.parameters())
 
 class MiniGPT:
-    def __init__(self, vocab_size, embed_size, num_layers):
+    def __init__(self, vocab_size, embed_size, num_layers, context_size=64):
         self.embedding = Embedding(vocab_size, embed_size)
+        self.position = Embedding(context_size, embed_size)
+        self.context_size = context_size
         # STACK THE BLOCKS - This is "Scaling"
-        self.blocks = [TransformerBlock(embed_size) for _ in range(num_layers)]
+        self.blocks = [TransformerBlock(embed_size, causal=True) for _ in range(num_layers)]
+        self.norm = LayerNorm(embed_size)
         self.head = Linear(embed_size, vocab_size) # Output layer
 
     def __call__(self, x):
-        x = self.embedding(x)
-        
+        # x: token ids, (context_length,) or (batch, context_length)
+        x = np.asarray(x, dtype=np.intp)[..., -self.context_size:]
+        h = self.embedding(x) + self.position(np.arange(x.shape[-1]))
+
         # Pass data through every layer in the stack
         for block in self.blocks:
-            x = block(x)
-            
-        logits = self.head(x)
+            h = block(h)
+
+        logits = self.head(self.norm(h))
         return logits
 
+    def parameters(self):
+        params = self.embedding.parameters() + self.position.parameters()
+        for block in self.blocks:
+            params += block.parameters()
+        return params + self.norm.parameters() + self.head.parameters()
+
 class SimpleChatBot:
     def __init__(self, vocab_size=10):
         self.vocab_size = vocab_size
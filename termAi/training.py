@@ -0,0 +1,72 @@
+"""Train MiniGPT on ChatLogger conversations (character level)"""
+import numpy as np
+from .core import Adam, cross_entropy
+from .models import MiniGPT
+from .data_collector import ChatLogger
+
+class CharTokenizer:
+    def __init__(self, text):
+        # Id 0 is reserved for characters never seen in training
+        self.chars = sorted(set(text))
+        self.ids = {c: i + 1 for i, c in enumerate(self.chars)}
+
+    @property
+    def vocab_size(self):
+        return len(self.chars) + 1
+
+    def encode(self, text):
+        return np.array([self.ids.get(c, 0) for c in text], dtype=np.intp)
+
+    def decode(self, ids):
+        return "".join(self.chars[i - 1] if i > 0 else "?" for i in ids)
+
+def conversation_text(entries):
+    # One "input -> output" turn per block; the model learns to continue after "\n> "
+    return "".join(f"{e['input']}\n> {e['output']}\n\n" for e in entries)
+
+def get_batch(tokens, batch_size, context_size, rng):
+    # Random windows; targets are the same windows shifted by one token
+    starts = rng.integers(0, len(tokens) - context_size - 1, size=batch_size)
+    offsets = np.arange(context_size)
+    x = tokens[starts[:, None] + offsets]
+    y = tokens[starts[:, None] + offsets + 1]
+    return x, y
+
+def train(entries=None, steps=500, batch_size=32, context_size=64, embed_size=64, num_layers=2,
+          lr=3e-3, seed=0, log_every=50):
+    """Returns (model, tokenizer, losses). entries default to ChatLogger().load_training_data()"""
+    entries = ChatLogger().load_training_data() if entries is None else entries
+    text = conversation_text(entries)
+    if len(text) < context_size + 2:
+        raise ValueError(f"Need more than {context_size + 1} characters of chat logs to train")
+    tokenizer = CharTokenizer(text)
+    tokens = tokenizer.encode(text)
+    rng = np.random.default_rng(seed)
+    np.random.seed(seed)
+
+    model = MiniGPT(tokenizer.vocab_size, embed_size, num_layers, context_size=context_size)
+    optimizer = Adam(model.parameters(), lr=lr)
+    losses = []
+    for step in range(steps):
+        x, y = get_batch(tokens, batch_size, context_size, rng)
+        loss = cross_entropy(model(x), y)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        losses.append(loss.item())
+        if log_every and (step % log_every == 0 or step == steps - 1):
+            print(f"[termAi] step {step}: loss {losses[-1]:.3f}")
+    return model, tokenizer, losses
+
+def generate(model, tokenizer, prompt, max_new_tokens=100, temperature=0.8, seed=None):
+    """Sample a reply after `prompt` until a blank line"""
+    rng = np.random.default_rng(seed)
+    ids = list(tokenizer.encode(f"{prompt}\n> "))
+    start = len(ids)
+    for _ in range(max_new_tokens):
+        logits = model(np.array(ids[-model.context_size:])).data[-1] / temperature
+        probs = np.exp(logits - logits.max())
+        ids.append(int(rng.choice(len(probs), p=probs / probs.sum())))
+        if tokenizer.decode(ids[-2:]) == "\n\n":
+            break
+    return tokenizer.decode(ids[start:]).strip()
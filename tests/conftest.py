@@ -0,0 +1,25 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def service(tmp_path_factory):
+    """mqtt_service imported with in-memory message storage in a scratch directory"""
+    pytest.importorskip("dotenv")
+    # The service creates its stores and plugins/ under the working directory
+    workdir = tmp_path_factory.mktemp("service")
+    previous = os.getcwd(), os.environ.get("MESSAGE_STORE")
+    os.chdir(workdir)
+    os.environ["MESSAGE_STORE"] = "memory"
+    try:
+        sys.modules.pop("mqtt_service", None)
+        yield importlib.import_module("mqtt_service")
+    finally:
+        os.chdir(previous[0])
+        if previous[1] is None:
+            os.environ.pop("MESSAGE_STORE", None)
+        else:
+            os.environ["MESSAGE_STORE"] = previous[1]
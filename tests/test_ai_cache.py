@@ -0,0 +1,74 @@
+"""Reply-cache keys: what must and must not share a cached reply"""
+from ai_cache import ResponseCache, cache_key
+from context_builder import ContextBuilder
+
+ROOM = {"role": "system", "content": "You are TermAi."}
+
+
+def user(user_id, text):
+    return {"role": "user", "content": f"{user_id}: {text}"}
+
+
+def test_same_question_from_different_users_shares_a_key():
+    assert cache_key([ROOM, user("a", "Hello!")]) == cache_key([ROOM, user("b", "hello")])
+
+
+def test_uncacheable_prompts():
+    assert cache_key([ROOM]) is None
+    assert cache_key([ROOM, {"role": "assistant", "content": "hi"}]) is None
+    assert cache_key([ROOM, user("a", "")]) is None
+
+
+def test_room_prompt_is_part_of_the_key():
+    other = {"role": "system", "content": "You are AI Librarian."}
+    assert cache_key([ROOM, user("a", "hi")]) != cache_key([other, user("a", "hi")])
+
+
+def test_injected_memories_isolate_users():
+    memory = {"role": "system", "content": "What you remember about this user:\n- name: Ona"}
+    personal = cache_key([ROOM, memory, user("a", "what is my name?")])
+    assert personal != cache_key([ROOM, user("b", "what is my name?")])
+
+
+def test_activity_note_and_history_stay_out_of_the_key():
+    # A live room: other users' lines, earlier AI replies and a changing activity note
+    first = [ROOM, {"role": "system", "content": "Recent messages in this room:\nc: hi"},
+             user("c", "hi"), {"role": "assistant", "content": "Hi c"}, user("a", "labas ai")]
+    second = [ROOM, {"role": "system", "content": "Recent messages in this room:\na: labas ai"},
+              user("a", "labas ai"), {"role": "assistant", "content": "Labas!"}, user("b", "Labas AI")]
+    assert cache_key(first) == cache_key(second) == cache_key([ROOM, user("d", "labas ai")])
+
+
+def test_recent_turns_are_part_of_the_key_when_enabled():
+    first = [ROOM, user("a", "my name is Ona"), {"role": "assistant", "content": "Hi Ona"}, user("a", "who am I?")]
+    second = [ROOM, user("b", "my name is Jonas"), {"role": "assistant", "content": "Hi Jonas"},
+              user("b", "who am I?")]
+    assert cache_key(first, context_turns=4) != cache_key(second, context_turns=4)
+    assert cache_key(first) == cache_key(second)
+
+
+def test_same_memories_for_two_users_still_do_not_share_a_key():
+    memory = {"role": "system", "content": "What you remember about this user:\n- likes tea"}
+    assert cache_key([ROOM, memory, user("a", "what do I like?")]) != cache_key(
+        [ROOM, memory, user("b", "what do I like?")])
+
+
+def test_context_builder_prompts_for_two_users_do_not_collide():
+    memories = {"a": ["name: Ona"], "b": []}
+    builder = ContextBuilder(memories=lambda user_id, query, limit: memories[user_id])
+    prompt_a = builder.build("living_room", ROOM["content"], [user("a", "who am I?")], user_id="a", query="who am I?")
+    prompt_b = builder.build("living_room", ROOM["content"], [user("b", "who am I?")], user_id="b", query="who am I?")
+    assert cache_key(prompt_a) != cache_key(prompt_b)
+
+
+def test_response_cache_ttl_and_bounds():
+    cache = ResponseCache(ttl=60, max_entries=2, max_bytes=10_000)
+    cache.put("k1", "one")
+    cache.put("k2", "two")
+    assert cache.get("k1") == "one"
+    cache.put("k3", "three")  # evicts k2, the least recently used
+    assert cache.get("k2") is None
+    assert cache.get("k1") == "one" and cache.get("k3") == "three"
+    cache.ttl = -1
+    cache.put("k4", "four")
+    assert cache.get("k4") is None
@@ -0,0 +1,146 @@
+"""Finite-difference checks for termAi's reverse-mode autograd"""
+import numpy as np
+import pytest
+
+from termAi.core import Tensor, cross_entropy, layer_norm
+from termAi.models import MiniGPT
+from termAi.training import CharTokenizer, train
+
+
+def numeric_grad(f, arrays, index, eps=1e-6):
+    """Central-difference d f(*arrays) / d arrays[index]"""
+    target = arrays[index]
+    grad = np.zeros_like(target)
+    for i in np.ndindex(target.shape):
+        original = target[i]
+        target[i] = original + eps
+        plus = f(*arrays)
+        target[i] = original - eps
+        minus = f(*arrays)
+        target[i] = original
+        grad[i] = (plus - minus) / (2 * eps)
+    return grad
+
+
+def check(build, *shapes, seed=0):
+    """Compare backward() with finite differences for every input of build(*tensors) -> scalar Tensor"""
+    rng = np.random.default_rng(seed)
+    arrays = [rng.standard_normal(shape) for shape in shapes]
+    tensors = [Tensor(a.copy(), requires_grad=True) for a in arrays]
+    build(*tensors).backward()
+
+    def value(*raw):
+        return build(*[Tensor(a) for a in raw]).item()
+
+    for index, tensor in enumerate(tensors):
+        expected = numeric_grad(value, arrays, index)
+        np.testing.assert_allclose(tensor.grad, expected, rtol=1e-5, atol=1e-7)
+
+
+# Weighted sums make every output element matter to the scalar loss
+def weights(shape, seed=1):
+    return np.random.default_rng(seed).standard_normal(shape)
+
+
+def test_matmul_2d():
+    check(lambda a, b: ((a @ b) * weights((3, 5))).sum(), (3, 4), (4, 5))
+
+
+def test_matmul_batched_with_broadcast_weight():
+    # (batch, n, k) @ (k, m): the weight's gradient is summed over the batch
+    check(lambda a, b: ((a @ b) * weights((2, 3, 5))).sum(), (2, 3, 4), (4, 5))
+
+
+def test_matmul_vector():
+    check(lambda v, m: ((v @ m) * weights(5)).sum(), (4,), (4, 5))
+
+
+@pytest.mark.parametrize("shape_a,shape_b", [
+    ((3, 4), (4,)),
+    ((3, 4), (3, 1)),
+    ((2, 3, 4), (1, 4)),
+    ((3, 1), (1, 4)),
+])
+def test_broadcasting_ops(shape_a, shape_b):
+    out = np.broadcast_shapes(shape_a, shape_b)
+    check(lambda a, b: ((a + b) * (a - b) * weights(out)).sum(), shape_a, shape_b)
+    check(lambda a, b: ((a * b) / (b * b + 2.0) * weights(out)).sum(), shape_a, shape_b)
+
+
+def test_unary_and_reductions():
+    check(lambda a: (a.tanh() * weights((3, 4))).sum(), (3, 4))
+    check(lambda a: ((a * a + 1.0).log() + (a * 0.5).exp()).mean(axis=0).sum(), (3, 4))
+    check(lambda a: (a.sum(axis=-1, keepdims=True) * a).sum(), (3, 4))
+    check(lambda a: (a.reshape(4, 3).transpose() * weights((3, 4))).sum(), (3, 4))
+    check(lambda a: (a.swapaxes(-1, -2) * weights((2, 4, 3))).sum(), (2, 3, 4))
+
+
+@pytest.mark.parametrize("index", [
+    1,
+    slice(1, 3),
+    (slice(None), 2),
+    np.array([0, 2, 2, 1]),  # repeated rows accumulate
+    np.array([[0, 1], [2, 2]]),
+])
+def test_indexing(index):
+    rng = np.random.default_rng(3)
+    shape_out = np.empty((3, 4))[index].shape
+    w = rng.standard_normal(shape_out)
+    check(lambda a: (a[index] * w).sum(), (3, 4))
+
+
+def test_softmax_and_log_softmax():
+    check(lambda a: (a.softmax(axis=-1) * weights((3, 5))).sum(), (3, 5))
+    check(lambda a: (a.log_softmax(axis=-1) * weights((3, 5))).sum(), (3, 5))
+    check(lambda a: (a.log_softmax(axis=0) * weights((3, 5))).sum(), (3, 5))
+
+
+def test_cross_entropy():
+    targets = np.array([[0, 4, 2], [1, 1, 3]])
+    check(lambda logits: cross_entropy(logits, targets), (2, 3, 5))
+
+
+def test_cross_entropy_matches_log_softmax():
+    logits = Tensor(np.random.default_rng(4).standard_normal((4, 6)))
+    targets = np.array([5, 0, 2, 2])
+    expected = -logits.log_softmax(axis=-1).data[np.arange(4), targets].mean()
+    assert cross_entropy(logits, targets).item() == pytest.approx(expected)
+
+
+def test_layer_norm():
+    check(lambda x, g, b: (layer_norm(x, g, b) * weights((2, 3, 6))).sum(), (2, 3, 6), (6,), (6,))
+
+
+def test_grad_accumulates_across_uses_and_backward_calls():
+    a = Tensor(np.array([1.0, 2.0]), requires_grad=True)
+    (a * a + a).sum().backward()
+    np.testing.assert_allclose(a.grad, [3.0, 5.0])
+    (a * 2.0).sum().backward()
+    np.testing.assert_allclose(a.grad, [5.0, 7.0])
+    a.zero_grad()
+    np.testing.assert_allclose(a.grad, [0.0, 0.0])
+
+
+def test_no_graph_without_requires_grad():
+    a = Tensor(np.ones((2, 2)))
+    out = (a @ a).relu().sum()
+    assert out._backward is None and out._parents == ()
+
+
+def test_minigpt_gradients_reach_every_parameter():
+    np.random.seed(0)
+    model = MiniGPT(vocab_size=7, embed_size=8, num_layers=1, context_size=5)
+    x = np.array([[1, 2, 3, 4, 5], [6, 5, 4, 3, 2]])
+    cross_entropy(model(x), (x + 1) % 7).backward()
+    for p in model.parameters():
+        assert np.any(p.grad != 0)
+
+
+def test_training_reduces_loss():
+    entries = [{"input": "labas", "output": "labas, kaip sekasi?"},
+               {"input": "hello", "output": "hello, how are you?"}] * 4
+    _, tokenizer, losses = train(entries, steps=60, batch_size=8, context_size=16, embed_size=16,
+                                 num_layers=1, lr=1e-2, log_every=0)
+    assert losses[-1] < losses[0] * 0.7
+    assert tokenizer.decode(tokenizer.encode("labas")) == "labas"
+    assert CharTokenizer("ab").encode("z")[0] == 0
@@ -0,0 +1,146 @@
+"""Cluster frame signing, validation and forwarding rules (no broker needed)"""
+import json
+import time
+
+import pytest
+
+from cluster import ClusterNode, HashRing
+
+
+class FakeClient:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published.append((topic, payload))
+
+
+def make_node(node_id, secret="s3cret", **kwargs):
+    return ClusterNode(node_id=node_id, group="test", prefix="termchat/cluster", secret=secret, **kwargs)
+
+
+def forward_frame(sender, topic, payload=b'{"id":"u1","msg":"hi"}'):
+    client = FakeClient()
+    sender.forward(client, "b", topic, payload)
+    return client.published[0][1]
+
+
+def test_secret_is_required():
+    with pytest.raises(ValueError):
+        make_node("a", secret="")
+
+
+def test_forward_round_trip():
+    a, b = make_node("a"), make_node("b")
+    topic, payload, hops = b.receive(FakeClient(), b.inbox_topic, forward_frame(a, "termchat/input"))
+    assert topic == "termchat/input"
+    assert json.loads(payload)["msg"] == "hi"
+    assert hops == 1
+
+
+def test_forward_limited_to_chat_topics():
+    a, b = make_node("a"), make_node("b")
+    assert b.receive(FakeClient(), b.inbox_topic, forward_frame(a, "termchat/admin")) is None
+    assert b.stats['rejected'] == 1
+
+
+def test_unsigned_and_wrong_secret_frames_are_rejected():
+    b = make_node("b")
+    plain = json.dumps({"type": "forward", "node": "x", "topic": "termchat/input",
+                        "payload": "{}", "ts": time.time()}).encode()
+    assert b.receive(FakeClient(), b.inbox_topic, plain) is None
+    other = make_node("a", secret="different")
+    assert b.receive(FakeClient(), b.inbox_topic, forward_frame(other, "termchat/input")) is None
+    assert b.stats['rejected'] == 2
+
+
+def test_tampered_body_is_rejected():
+    a, b = make_node("a"), make_node("b")
+    envelope = json.loads(forward_frame(a, "termchat/input"))
+    envelope["body"] = envelope["body"].replace("termchat/input", "termchat/messages")
+    assert b.receive(FakeClient(), b.inbox_topic, json.dumps(envelope).encode()) is None
+
+
+@pytest.mark.parametrize("payload", [b"", b"not json", b"[]", b'{"body": 1, "sig": "x"}', b'{"body": "{}"}'])
+def test_malformed_frames_are_ignored(payload):
+    b = make_node("b")
+    assert b.receive(FakeClient(), b.control_topic, payload) is None
+
+
+def test_stale_event_frames_are_rejected(monkeypatch):
+    events = []
+    a = make_node("a")
+    b = make_node("b", on_event=lambda kind, frame: events.append(kind), max_age=60)
+    client = FakeClient()
+    monkeypatch.setattr("cluster.time.time", lambda: 1000.0)
+    a.broadcast(client, "admin", payload="TOKEN status")
+    monkeypatch.setattr("cluster.time.time", lambda: 1000.0 + 61)
+    b.receive(FakeClient(), b.control_topic, client.published[0][1])
+    assert events == []
+    monkeypatch.setattr("cluster.time.time", lambda: 1000.0 + 30)
+    b.receive(FakeClient(), b.control_topic, client.published[0][1])
+    assert events == ["admin"]
+
+
+class FakeConnection(FakeClient):
+    def __init__(self):
+        super().__init__()
+        self.will = None
+
+    def will_set(self, topic, payload=None, qos=0, retain=False):
+        self.will = payload
+
+
+def connect(node):
+    """attach + on_connect; returns (connection, the will that connect carried)"""
+    connection = FakeConnection()
+    node.attach(connection)
+    will = connection.will
+    node.connected(connection)
+    return connection, will
+
+
+def test_membership_hello_and_old_bye_will():
+    a, b = make_node("a"), make_node("b")
+    connection, will = connect(a)
+    b.receive(FakeClient(), b.control_topic, connection.published[0][1])
+    assert b.status()["nodes"] == ["a", "b"]
+    b.max_age = -1  # every timestamp is now "too old"
+    b.receive(FakeClient(), b.control_topic, will)
+    assert b.status()["nodes"] == ["b"]
+
+
+def test_replayed_bye_from_an_earlier_connection_is_ignored():
+    a, b = make_node("a"), make_node("b")
+    connection, first_will = connect(a)
+    b.receive(FakeClient(), b.control_topic, connection.published[0][1])
+    # The connection drops: the broker publishes the will and b drops a
+    b.receive(FakeClient(), b.control_topic, first_will)
+    assert b.status()["nodes"] == ["b"]
+    # a reconnects with the will that was re-armed on the first connect
+    second_will = connection.will
+    a.connected(connection)
+    b.receive(FakeClient(), b.control_topic, connection.published[-1][1])
+    assert b.status()["nodes"] == ["a", "b"]
+    # Someone replays the captured first will
+    b.receive(FakeClient(), b.control_topic, first_will)
+    assert b.status()["nodes"] == ["a", "b"]
+    assert b.stats['rejected'] == 1
+    b.receive(FakeClient(), b.control_topic, second_will)
+    assert b.status()["nodes"] == ["b"]
+
+
+def test_bye_without_a_session_is_ignored():
+    a, b = make_node("a"), make_node("b")
+    connection, _ = connect(a)
+    b.receive(FakeClient(), b.control_topic, connection.published[0][1])
+    b.receive(FakeClient(), b.control_topic, a._frame("bye"))
+    assert b.status()["nodes"] == ["a", "b"]
+
+
+def test_ring_moves_only_departed_nodes_rooms():
+    rooms = [f"room-{i}" for i in range(200)]
+    before = HashRing(["a", "b", "c"], vnodes=32)
+    after = HashRing(["a", "b"], vnodes=32)
+    moved = [r for r in rooms if before.owner(r) != after.owner(r)]
+    assert moved and all(before.owner(r) == "c" for r in moved)
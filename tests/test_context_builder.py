@@ -0,0 +1,46 @@
+"""Prompt assembly: activity note dedup, doc caching and the token budget"""
+from context_builder import ContextBuilder
+
+
+def user(user_id, text):
+    return {"role": "user", "content": f"{user_id}: {text}"}
+
+
+def notes(messages):
+    return [m["content"] for m in messages[1:] if m["role"] == "system"]
+
+
+def test_activity_note_skips_lines_already_in_history():
+    docs = [{"user_id": "a", "message": "hi"}, {"user_id": "TERMAI", "message": "Hello  there"},
+            {"user_id": "c", "message": "other room chatter"}]
+    builder = ContextBuilder(recent_messages=lambda room, limit: docs)
+    history = [user("a", "hi"), {"role": "assistant", "content": "Hello there"}, user("a", "next")]
+    assert notes(builder.build("r", "room", history)) == ["Recent messages in this room:\nc: other room chatter"]
+
+
+def test_cached_docs_are_deduplicated_against_every_build():
+    fetches = []
+    docs = [{"user_id": "c", "message": "old news"}, {"user_id": "a", "message": "question?"}]
+    builder = ContextBuilder(recent_messages=lambda room, limit: fetches.append(room) or docs)
+
+    first = builder.build("r", "room", [user("c", "old news")])
+    assert notes(first) == ["Recent messages in this room:\na: question?"]
+    # Within the TTL: same docs, but the message being answered is now in history
+    second = builder.build("r", "room", [user("a", "question?")])
+    assert notes(second) == ["Recent messages in this room:\nc: old news"]
+    assert notes(builder.build("r", "room", [user("c", "old news"), user("a", "question?")])) == []
+    assert fetches == ["r"]
+    assert builder.status()["activity_hits"] == 2
+
+    builder.invalidate("r")
+    builder.build("r", "room", [])
+    assert fetches == ["r", "r"]
+
+
+def test_history_is_trimmed_oldest_first_to_the_budget():
+    history = [user("a", f"message number {i} " + "word " * 20) for i in range(20)]
+    builder = ContextBuilder(budget=200)
+    messages = builder.build("r", "room", history)
+    assert messages[-1] == history[-1]
+    assert messages[1:] == history[-(len(messages) - 1):]
+    assert 1 < len(messages) < len(history)
@@ -0,0 +1,44 @@
+"""Coalescing windows and the shared flusher thread"""
+import json
+import time
+
+from output_publisher import OutputPublisher
+
+
+class Client:
+    def __init__(self, fail=0):
+        self.fail = fail
+        self.published = []
+
+    def publish(self, topic, payload):
+        if self.fail:
+            self.fail -= 1
+            raise OSError("broker gone")
+        self.published.append((topic, json.loads(payload)))
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return predicate()
+
+
+def test_frames_in_one_window_go_out_as_a_batch():
+    output = OutputPublisher(coalesce_ms=20)
+    client = Client()
+    output.publish(client, {"type": "chat", "msg": "a"}, coalesce=True)
+    output.publish(client, {"type": "chat", "msg": "b"}, coalesce=True)
+    assert wait_for(lambda: client.published)
+    assert client.published == [("termchat/output", {"type": "batch", "frames": [
+        {"type": "chat", "msg": "a"}, {"type": "chat", "msg": "b"}]})]
+
+
+def test_a_failed_publish_does_not_stop_the_flusher():
+    output = OutputPublisher(coalesce_ms=10)
+    broken, client = Client(fail=1), Client()
+    output.publish(broken, {"type": "chat", "msg": "lost"}, coalesce=True)
+    assert wait_for(lambda: not output.pending)
+    output.publish(client, {"type": "chat", "msg": "kept"}, coalesce=True)
+    assert wait_for(lambda: client.published)
+    assert client.published == [("termchat/output", {"type": "chat", "msg": "kept"})]
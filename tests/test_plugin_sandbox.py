@@ -0,0 +1,60 @@
+"""SandboxPool bookkeeping, with fake workers instead of subprocesses"""
+import pytest
+
+import plugin_sandbox
+from plugin_sandbox import SandboxPool
+
+
+class FakeWorker:
+    """Loads fine unless its spawn number is in `failing`"""
+    failing = set()
+    spawned = 0
+
+    def __init__(self, name, code, prefix=()):
+        FakeWorker.spawned += 1
+        self.number = FakeWorker.spawned
+        ok = self.number not in FakeWorker.failing
+        self.loaded = {"ok": True} if ok else {"ok": False, "error": "boom"}
+        self.alive = ok
+        self.jobs = 0
+
+    def call(self, op, trigger, data, timeout):
+        self.jobs += 1
+        return {"ok": True, "result": self.number}
+
+    def kill(self):
+        self.alive = False
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    FakeWorker.spawned = 0
+    FakeWorker.failing = set()
+    monkeypatch.setattr(plugin_sandbox, "SandboxWorker", FakeWorker)
+    return SandboxPool(workers_per_plugin=3, require_isolation=False)
+
+
+def test_workers_that_fail_to_load_get_no_calls(pool):
+    FakeWorker.failing = {2}
+    ok, _ = pool.load("p", "code")
+    assert ok
+    assert pool.status()["idle_workers"] == {"p": 2}
+    assert {pool.execute("p", "message", {}) for _ in range(6)} == {1, 3}
+    assert pool.status()["load_failed"] == 1
+
+
+def test_first_worker_failing_fails_the_load(pool):
+    FakeWorker.failing = {1}
+    ok, message = pool.load("p", "code")
+    assert not ok and "boom" in message
+    assert not pool.has("p")
+
+
+def test_recycled_worker_that_fails_to_load_is_dropped(pool):
+    pool.max_jobs = 1
+    pool.workers_per_plugin = 1
+    FakeWorker.failing = {2}
+    pool.load("p", "code")
+    assert pool.execute("p", "message", {}) == 1
+    assert pool.status()["idle_workers"] == {"p": 0}
+
@@ -0,0 +1,70 @@
+"""In-process restricted plugins: load from plugins/ and fire their triggers"""
+import os
+
+import pytest
+
+from plugin_loader import read_declarations
+
+pytest.importorskip("RestrictedPython")
+pytest.importorskip("dotenv")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def fire(service, trigger, data):
+    return {name: call() for name, call in service.plugin_calls(trigger, data)}
+
+
+def test_auto_greeter_greets_joining_users(service):
+    with open(os.path.join(ROOT, "plugins", "auto_greeter.py")) as f:
+        source = f.read()
+    ok, message = service.load_plugin("auto_greeter", source, read_declarations(source)["TRIGGERS"])
+    assert ok, message
+    result = fire(service, "user_join", {"user_id": "ona"})["auto_greeter"]
+    assert result["action"] == "send_message"
+    assert "ona" in result["message"]
+
+
+def test_restricted_plugins_can_use_attributes_items_loops_and_print(service):
+    source = (
+        "def handle_trigger(trigger_type, data):\n"
+        "    words = [w.upper() for w in data['message'].split()]\n"
+        "    first, *rest = words\n"
+        "    print(first)\n"
+        "    return {'action': 'send_message', 'message': ' '.join(rest), 'target': data.get('user_id')}\n"
+    )
+    ok, message = service.load_plugin("shout", source, ["message"])
+    assert ok, message
+    result = fire(service, "message", {"message": "labas visi", "user_id": "ona"})["shout"]
+    assert result == {"action": "send_message", "message": "VISI", "target": "ona"}
+
+
+def test_restricted_plugins_cannot_reach_private_attributes(service):
+    source = "def handle_trigger(trigger_type, data):\n    return data.__class__\n"
+    ok, message = service.load_plugin("sneaky", source, ["message"])
+    assert not ok and "__class__" in message
+
+
+def test_auto_greeter_only_greets_on_join_and_whole_words(service):
+    with open(os.path.join(ROOT, "plugins", "auto_greeter.py")) as f:
+        source = f.read()
+    assert read_declarations(source)["TRIGGERS"] == ["user_join"]
+    ok, message = service.load_plugin("greeter_on_messages", source, ["message"])
+    assert ok, message
+    assert fire(service, "message", {"message": "I think this works", "user_id": "ona"})["greeter_on_messages"] is None
+    assert fire(service, "message", {"message": "Hi, all!", "user_id": "ona"})["greeter_on_messages"]
+
+
+def test_with_workers_triggers_run_in_the_pool(service, monkeypatch):
+    from worker_pool import ProcessWorkerPool
+    ok, message = service.load_plugin("pid", "def handle_trigger(trigger_type, data):\n    return data['n'] + 1\n",
+                                      ["count"])
+    assert ok, message
+    pool = ProcessWorkerPool(workers=1)
+    pool.start()
+    monkeypatch.setattr(service, "worker_pool", pool)
+    try:
+        assert fire(service, "count", {"n": 41}) == {"pid": 42}
+        assert pool.status()["calls"] == 1
+    finally:
+        pool.shutdown()
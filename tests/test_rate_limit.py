@@ -0,0 +1,100 @@
+"""Token buckets, the sliding abuse window and RateLimiter.admit"""
+import pytest
+
+import rate_limit
+from rate_limit import RateLimiter, SlidingWindowCounter, TokenBucketTable, peek_user_id
+
+
+def payload(user_id):
+    return b'{"id":"%s","msg":"hi"}' % user_id.encode()
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    return clock
+
+
+def test_peek_user_id():
+    assert peek_user_id(payload("alice")) == "alice"
+    assert peek_user_id(b'{"msg":"no id"}') == "unknown"
+    assert peek_user_id(b"plain text") == "system"
+
+
+def test_token_bucket_burst_then_refill():
+    table = TokenBucketTable(rate=1.0, burst=3)
+    assert [table.allow("k", 0.0) for _ in range(4)] == [True, True, True, False]
+    assert table.allow("k", 1.0)
+    assert not table.allow("k", 1.0)
+
+
+def test_token_bucket_expires_idle_keys():
+    table = TokenBucketTable(rate=1.0, burst=2)
+    table.allow("old", 0.0)
+    table.allow("new", 5.0)
+    assert len(table) == 1
+
+
+def test_sliding_window_counts_only_recent_events():
+    counter = SlidingWindowCounter(window=10)
+    for second in range(5):
+        counter.hit("k", float(second))
+    assert counter.hit("k", 9.0) == 6
+    assert counter.hit("k", 12.5) == 4  # seconds 0..2 fell out: 3, 4, 9, 12
+    assert counter.hit("k", 40.0) == 1
+
+
+def test_flooding_user_is_banned_and_ban_expires(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, "ABUSE_THRESHOLD", 3)
+    monkeypatch.setattr(rate_limit, "ABUSE_BAN_SECONDS", 30)
+    limiter = RateLimiter()
+    limiter.users = TokenBucketTable(rate=0.001, burst=1)
+    results = [limiter.admit("termchat/input", payload("spammer"))[0] for _ in range(5)]
+    assert results[0] and not any(results[1:])
+    assert limiter.status()["active_bans"] == 1
+
+    clock.now += 31
+    limiter.users = TokenBucketTable(rate=0.001, burst=1)
+    assert limiter.admit("termchat/input", payload("spammer"))[0]
+
+
+def test_room_and_topic_rejections_do_not_count_toward_a_ban(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, "ABUSE_THRESHOLD", 2)
+    limiter = RateLimiter()
+    limiter.rooms = TokenBucketTable(rate=0.001, burst=1)
+    limiter.topics = TokenBucketTable(rate=0.001, burst=2)
+    room_of = lambda user_id: "lobby"
+    assert limiter.admit("termchat/input", payload("u0"), room_of)[0]
+    # Room bucket is now empty; topic bucket has one token left, then is empty too
+    for i in range(1, 10):
+        clock.now += 1
+        assert not limiter.admit("termchat/input", payload(f"u{i % 2}"), room_of)[0]
+    assert limiter.status()["banned"] == 0
+    assert not limiter.banned
+
+
+def test_expired_bans_are_swept(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, "ABUSE_BAN_SECONDS", 30)
+    limiter = RateLimiter()
+    limiter.banned = {"gone": clock.now + 30}
+    limiter.admit("termchat/input", payload("someone"))
+    clock.now += 31
+    limiter.next_ban_sweep = 0
+    limiter.admit("termchat/input", payload("someone-else"))
+    assert "gone" not in limiter.banned
+
+
+def test_ai_budget(monkeypatch, clock):
+    limiter = RateLimiter()
+    limiter.ai_budget = TokenBucketTable(rate=0.001, burst=2)
+    assert [limiter.allow_ai_call() for _ in range(3)] == [True, True, False]
+    assert limiter.status()["ai_rejected"] == 1
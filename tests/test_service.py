@@ -0,0 +1,54 @@
+"""mqtt_service.on_message: what gets stored and dispatched"""
+import json
+from types import SimpleNamespace
+
+
+class FakeClient:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published.append((topic, payload))
+        return SimpleNamespace(rc=0, mid=len(self.published))
+
+
+def deliver(service, topic, data):
+    payload = json.dumps(data).encode()
+    service.on_message(FakeClient(), None, SimpleNamespace(topic=topic, payload=payload))
+
+
+def stored(service, user_id):
+    room = service.room_store.get_user_room(user_id)
+    return [doc["message"] for doc in service.get_recent_messages(room) if doc["user_id"] == user_id]
+
+
+def test_display_mirror_is_not_stored(service):
+    deliver(service, "termchat/messages", {"user": "mirror-user", "text": "labas"})
+    assert stored(service, "unknown") == []
+    assert stored(service, "mirror-user") == []
+
+
+def test_chat_messages_on_either_topic_are_stored(service):
+    deliver(service, "termchat/input", {"id": "input-user", "msg": "labas visi"})
+    deliver(service, "termchat/messages", {"id": "legacy-user", "msg": "sveiki"})
+    assert stored(service, "input-user") == ["labas visi"]
+    assert stored(service, "legacy-user") == ["sveiki"]
+
+
+def test_is_display_mirror(service):
+    assert service.is_display_mirror("termchat/messages", b'{"user":"a","text":"hi"}')
+    assert not service.is_display_mirror("termchat/input", b'{"user":"a","text":"hi"}')
+    assert not service.is_display_mirror("termchat/messages", b'{"id":"a","msg":"the text"}')
+    assert not service.is_display_mirror("termchat/messages", b'"text" but not json')
+
+
+def test_duplicate_id_keys_are_limited_as_the_parsed_user(service, monkeypatch):
+    from rate_limit import RateLimiter, TokenBucketTable
+    limiter = RateLimiter()
+    limiter.users = TokenBucketTable(rate=0.001, burst=1)
+    monkeypatch.setattr(service, "rate_limiter", limiter)
+    for i in range(3):
+        # peek_user_id sees each decoy, json.loads keeps the last "id"
+        payload = b'{"id":"decoy-%d","id":"dup-user","msg":"flood %d"}' % (i, i)
+        service.on_message(FakeClient(), None, SimpleNamespace(topic="termchat/input", payload=payload))
+    assert stored(service, "dup-user") == ["flood 0"]
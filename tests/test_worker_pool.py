@@ -0,0 +1,60 @@
+"""Work that --workers moves off the supervisor: plugin triggers and ingest embedding"""
+import numpy as np
+import pytest
+
+from memory_bank import MemoryBank, MemoryIngest, PooledEmbedder
+from worker_pool import ProcessWorkerPool, WorkerError
+
+pytest.importorskip("RestrictedPython")
+
+GREETER = (
+    "def handle_trigger(trigger_type, data):\n"
+    "    return {'action': 'send_message', 'message': 'hi ' + data['user_id'], 'target': 'all'}\n"
+)
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = ProcessWorkerPool(workers=1, timeout=10)
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+
+def test_restricted_plugin_trigger_runs_in_a_worker(pool):
+    from plugin_runtime import run_trigger
+    result = pool.call(run_trigger, "greeter", GREETER, "user_join", {"user_id": "ona"})
+    assert result["message"] == "hi ona"
+    # A reloaded version replaces the old one in the worker
+    reloaded = GREETER.replace("'hi '", "'labas '")
+    assert pool.call(run_trigger, "greeter", reloaded, "user_join", {"user_id": "ona"})["message"] == "labas ona"
+
+
+def test_plugin_guards_apply_in_workers(pool):
+    from plugin_runtime import run_trigger
+    sneaky = "def handle_trigger(trigger_type, data):\n    return data.__class__\n"
+    with pytest.raises(WorkerError):
+        pool.call(run_trigger, "sneaky", sneaky, "message", {})
+
+
+def test_overrunning_plugin_is_killed_with_its_worker(pool):
+    from plugin_runtime import run_trigger
+    spin = "def handle_trigger(trigger_type, data):\n    while True:\n        pass\n"
+    with pytest.raises(WorkerError, match="timeout"):
+        pool.call(run_trigger, "spin", spin, "message", {}, timeout=0.5)
+    assert pool.call(run_trigger, "greeter", GREETER, "user_join", {"user_id": "x"})["message"] == "hi x"
+
+
+def test_ingest_flush_embeds_all_users_in_one_worker_batch(pool, tmp_path):
+    bank = MemoryBank(str(tmp_path), dim=64)
+    bank.embedder = PooledEmbedder(pool, 64, min_batch=8)
+    ingest = MemoryIngest(bank)
+    ingest.running = True  # buffer without starting the writer thread
+    for i in range(12):
+        ingest.enqueue(f"user-{i % 6}", "note", f"fact number {i}")
+    calls = pool.status()["calls"]
+    ingest.flush()
+    assert pool.status()["calls"] == calls + 1
+    assert bank.status()["memories"] == 12
+    assert bank.query("user-1", "fact number 7", 1) == ["fact number 7"]
+    assert np.allclose(bank.embedder.embed("fact"), MemoryBank(str(tmp_path / "b"), dim=64).embedder.embed("fact"))
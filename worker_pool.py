@@ -0,0 +1,259 @@
+"""Supervised worker processes for CPU-bound work (`--workers N`)
+
+The service process keeps the broker connection, the HTTP front end and all
+room state. Pure-CPU functions are shipped to N warm worker interpreters
+(`python worker_pool.py`), so they run on other cores instead of competing
+with the MQTT loop for the GIL. Today these are restricted plugin triggers
+(plugin_runtime.run_trigger) and memory-ingest embedding, one batch per
+flush across all users (memory_bank.PooledEmbedder). Recall queries embed
+one short text and stay in-process.
+
+Jobs and results travel as length-prefixed pickle frames over the worker's
+stdin/stdout. A job names its function as "module:function". Workers are
+started as fresh interpreters, not forked, so they never inherit the
+service's threads, sockets or locks.
+
+The supervisor replaces a worker when:
+- it dies (a crash or the OOM killer)
+- it overruns WORKER_TIMEOUT (it is killed first)
+- it served WORKER_MAX_JOBS jobs
+- its peak RSS passed the WORKER_MEMORY_MB high-water mark (the worker
+  reports this with each result, then exits)
+"""
+import importlib
+import os
+import pickle
+import queue
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows: no RSS reporting, recycling by job count only
+    resource = None
+
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", 0))
+WORKER_TIMEOUT = float(os.getenv("WORKER_TIMEOUT", 10.0))
+WORKER_MEMORY_MB = int(os.getenv("WORKER_MEMORY_MB", 512))
+WORKER_MAX_JOBS = int(os.getenv("WORKER_MAX_JOBS", 10000))
+
+_HEADER = struct.Struct(">I")
+
+
+class WorkerError(Exception):
+    """A job failed in, or could not be delivered to, a worker process"""
+
+
+def _write_frame(stream, obj):
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(_HEADER.pack(len(data)) + data)
+    stream.flush()
+
+
+def _read_frame(stream):
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    (size,) = _HEADER.unpack(header)
+    data = stream.read(size)
+    if len(data) < size:
+        return None
+    return pickle.loads(data)
+
+
+def _target_name(fn):
+    return fn if isinstance(fn, str) else f"{fn.__module__}:{fn.__qualname__}"
+
+
+class ProcessWorker:
+    """One warm interpreter serving pickle-frame jobs"""
+
+    def __init__(self, memory_mb=WORKER_MEMORY_MB):
+        self.jobs = 0
+        self.rss_mb = 0.0
+        self.retiring = False
+        self.frames = queue.Queue()
+        here = os.path.dirname(os.path.abspath(__file__))
+        # One core per worker: N workers each running an N-thread BLAS would oversubscribe
+        env = dict(os.environ, WORKER_MEMORY_MB=str(memory_mb), OMP_NUM_THREADS="1",
+                   OPENBLAS_NUM_THREADS="1", MKL_NUM_THREADS="1")
+        self.proc = subprocess.Popen([sys.executable, os.path.join(here, "worker_pool.py")],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=None,
+                                     cwd=here, env=env)
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        while True:
+            try:
+                frame = _read_frame(self.proc.stdout)
+            except Exception:
+                frame = None
+            self.frames.put(frame)
+            if frame is None:
+                return
+
+    def call(self, target, args, kwargs, timeout):
+        self.jobs += 1
+        try:
+            _write_frame(self.proc.stdin, (target, args, kwargs))
+            frame = self.frames.get(timeout=timeout)
+        except queue.Empty:
+            self.kill()
+            raise WorkerError(f"timeout after {timeout:.2f}s")
+        except (OSError, ValueError) as e:
+            self.kill()
+            raise WorkerError(f"worker unavailable: {e}")
+        if frame is None:
+            self.kill()
+            raise WorkerError("worker exited (crash or memory limit?)")
+        (ok, value), self.rss_mb, self.retiring = frame
+        if not ok:
+            raise WorkerError(value)
+        return value
+
+    @property
+    def alive(self):
+        return self.proc.poll() is None
+
+    def kill(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+            try:
+                self.proc.wait(1)
+            except subprocess.TimeoutExpired:
+                pass
+
+
+class ProcessWorkerPool:
+    """N supervised ProcessWorkers; call() blocks the calling thread only"""
+
+    def __init__(self, workers=SERVICE_WORKERS, timeout=WORKER_TIMEOUT, memory_mb=WORKER_MEMORY_MB,
+                 max_jobs=WORKER_MAX_JOBS):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self.max_jobs = max_jobs
+        self.idle = queue.Queue()
+        self.closed = False
+        self.lock = threading.Lock()
+        self.stats = {'calls': 0, 'errors': 0, 'timeouts': 0, 'busy': 0, 'restarted': 0,
+                      'recycled': 0, 'spawned': 0, 'peak_rss_mb': 0.0}
+
+    def _spawn(self):
+        worker = ProcessWorker(self.memory_mb)
+        with self.lock:
+            self.stats['spawned'] += 1
+        return worker
+
+    def start(self):
+        for _ in range(self.workers):
+            self.idle.put(self._spawn())
+        print(f"[WORKERS] {self.workers} worker processes started "
+              f"(high-water {self.memory_mb} MB, timeout {self.timeout}s)")
+
+    def call(self, fn, *args, timeout=None, **kwargs):
+        """Run fn(*args, **kwargs) in a worker; fn must be importable at module level"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        try:
+            worker = self.idle.get(timeout=timeout)
+        except queue.Empty:
+            with self.lock:
+                self.stats['busy'] += 1
+            raise WorkerError("all workers busy")
+        if not worker.alive:
+            # Died while idle: replace it before handing out work
+            with self.lock:
+                self.stats['restarted'] += 1
+            worker = self._spawn()
+
+        with self.lock:
+            self.stats['calls'] += 1
+        try:
+            return worker.call(_target_name(fn), args, kwargs,
+                               max(0.01, timeout - (time.monotonic() - started)))
+        except WorkerError as e:
+            with self.lock:
+                self.stats['timeouts' if str(e).startswith("timeout") else 'errors'] += 1
+            raise
+        finally:
+            self._release(worker)
+
+    def _release(self, worker):
+        with self.lock:
+            self.stats['peak_rss_mb'] = max(self.stats['peak_rss_mb'], worker.rss_mb)
+        if self.closed:
+            worker.kill()
+            return
+        recycle = worker.retiring or worker.jobs >= self.max_jobs
+        if recycle or not worker.alive:
+            with self.lock:
+                self.stats['recycled' if recycle else 'restarted'] += 1
+            worker.kill()
+            worker = self._spawn()
+        self.idle.put(worker)
+
+    def status(self):
+        with self.lock:
+            return dict(self.stats, workers=self.workers, idle=self.idle.qsize())
+
+    def shutdown(self):
+        self.closed = True
+        while True:
+            try:
+                self.idle.get_nowait().kill()
+            except queue.Empty:
+                return
+
+
+# ==========================================
+# Worker process
+# ==========================================
+def _resolve(target, cache):
+    fn = cache.get(target)
+    if fn is None:
+        module, _, name = target.partition(":")
+        fn = importlib.import_module(module)
+        for part in name.split("."):
+            fn = getattr(fn, part)
+        cache[target] = fn
+    return fn
+
+
+def worker_main():
+    """Serve pickle-frame jobs until stdin closes or the high-water mark is passed"""
+    proto_in, proto_out = sys.stdin.buffer, sys.stdout.buffer
+    sys.stdout = sys.stderr  # stray print() must not corrupt the protocol
+    high_water = int(os.getenv("WORKER_MEMORY_MB", WORKER_MEMORY_MB))
+    functions = {}
+
+    while True:
+        job = _read_frame(proto_in)
+        if job is None:
+            return
+        try:
+            target, args, kwargs = job
+            reply = (True, _resolve(target, functions)(*args, **kwargs))
+        except MemoryError:
+            reply = (False, "memory limit exceeded")
+        except Exception as e:
+            reply = (False, f"{type(e).__name__}: {e}")
+        # ru_maxrss is KB on Linux, bytes on macOS
+        rss_mb = 0.0
+        if resource is not None:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            rss_mb = rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+        retiring = rss_mb > high_water
+        try:
+            _write_frame(proto_out, (reply, rss_mb, retiring))
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            _write_frame(proto_out, ((False, f"unpicklable result: {e}"), rss_mb, retiring))
+        if retiring:
+            return
+
+
+if __name__ == '__main__':
+    worker_main()